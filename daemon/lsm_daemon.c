@@ -53,6 +53,8 @@
 #define LSMD_CONF_FILE "lsmd.conf"
 #define LSM_CONF_ALLOW_ROOT_OPT_NAME "allow-plugin-root-privilege"
 #define LSM_CONF_REQUIRE_ROOT_OPT_NAME "require-root-privilege"
+#define LSM_CONF_ZYGOTE_OPT_NAME "zygote"
+#define PLUGIN_ZYGOTE_ARG "--zygote"
 
 #define min(a,b) \
    ({ __typeof__ (a) _a = (a); \
@@ -90,6 +92,9 @@ struct plugin {
     char *file_path;
     int require_root;
     int fd;
+    int zygote;                 /* Plug-in supports zygote mode */
+    int zygote_fd;              /* Control socket of running zygote or -1 */
+    pid_t zygote_pid;
     LIST_ENTRY(plugin) pointers;
 };
 
@@ -421,6 +426,12 @@ void empty_plugin_list(struct plugin_list *list)
                  item->file_path, strerror(err));
         }
 
+        if (item->zygote_fd >= 0) {
+            /* The zygote exits when its control socket is closed */
+            close(item->zygote_fd);
+            item->zygote_fd = -1;
+        }
+
         free(item->file_path);
         item->file_path = NULL;
         item->fd = INT_MAX;
@@ -465,15 +476,14 @@ void parse_conf_bool(const char *conf_path, const char *key_name, int *value)
 }
 
 /**
- * Load plugin config for root privilege setting.
- * If config not found, return 0 for no root privilege required.
+ * Forms the path of the config file of a plug-in.
  * @param plugin_path Full path of plugin
- * @return 1 for require root privilege, 0 or not.
+ * @return Config file path, caller must call free when done
  */
 
-int chk_pconf_root_pri(char *plugin_path)
+char *plugin_conf_path_form(char *plugin_path)
 {
-    int require_root = 0;
+    char *plugin_conf_path = NULL;
     char *base_name = basename(plugin_path);
     ssize_t plugin_name_len = strlen(base_name) - strlen(plugin_extension);
     if (plugin_name_len <= 0) {
@@ -491,25 +501,59 @@ int chk_pconf_root_pri(char *plugin_path)
         char *plugin_conf_dir_path = path_form(conf_dir,
                                                LSM_PLUGIN_CONF_DIR_NAME);
 
-        char *plugin_conf_path = path_form(plugin_conf_dir_path,
-                                           plugin_conf_filename);
-        parse_conf_bool(plugin_conf_path, LSM_CONF_REQUIRE_ROOT_OPT_NAME,
-                        &require_root);
-
-        if (require_root == 1 && allow_root_plugin == 0) {
-            warn("Plugin %s require root privilege while %s disable globally\n",
-                 base_name, LSMD_CONF_FILE);
-        }
+        plugin_conf_path = path_form(plugin_conf_dir_path,
+                                     plugin_conf_filename);
         free(plugin_conf_dir_path);
         free(plugin_conf_filename);
-        free(plugin_conf_path);
     } else {
         log_and_exit("malloc failure while trying to allocate %d "
                      "bytes\n", conf_file_name_len);
     }
+    return plugin_conf_path;
+}
+
+/**
+ * Load plugin config for root privilege setting.
+ * If config not found, return 0 for no root privilege required.
+ * @param plugin_path Full path of plugin
+ * @return 1 for require root privilege, 0 or not.
+ */
+
+int chk_pconf_root_pri(char *plugin_path)
+{
+    int require_root = 0;
+    char *plugin_conf_path = plugin_conf_path_form(plugin_path);
+
+    parse_conf_bool(plugin_conf_path, LSM_CONF_REQUIRE_ROOT_OPT_NAME,
+                    &require_root);
+
+    if (require_root == 1 && allow_root_plugin == 0) {
+        warn("Plugin %s require root privilege while %s disable globally\n",
+             basename(plugin_path), LSMD_CONF_FILE);
+    }
+    free(plugin_conf_path);
     return require_root;
 }
 
+/**
+ * Load plugin config for zygote setting.
+ * If config not found, return 0 for exec'ing the plug-in per connection.
+ * Plug-ins requiring root privilege are always exec'ed per connection, as
+ * the privilege depends on the client.
+ * @param plugin_path Full path of plugin
+ * @return 1 for zygote mode, 0 or not.
+ */
+
+int chk_pconf_zygote(char *plugin_path)
+{
+    int zygote = 0;
+    char *plugin_conf_path = plugin_conf_path_form(plugin_path);
+
+    parse_conf_bool(plugin_conf_path, LSM_CONF_ZYGOTE_OPT_NAME, &zygote);
+    free(plugin_conf_path);
+    return zygote;
+}
+
 /**
  * Call back for plug-in processing.
  * @param p             Private data
@@ -532,6 +576,9 @@ int process_plugin(void *p, char *full_name)
                     item->fd = setup_socket(full_name);
                     item->require_root = chk_pconf_root_pri(full_name);
                     has_root_plugin |= item->require_root;
+                    item->zygote = !item->require_root &&
+                        chk_pconf_zygote(full_name);
+                    item->zygote_fd = -1;
 
                     if (item->file_path && item->fd >= 0) {
                         LIST_INSERT_HEAD((struct plugin_list *) p, item,
@@ -553,6 +600,30 @@ int process_plugin(void *p, char *full_name)
     return 0;
 }
 
+/**
+ * Checks if an exited child is the zygote of a plug-in.  A zygote only exits
+ * on its own on failure, the plug-in is exec'ed per connection from then on.
+ * @param si        Child exit information from waitid()
+ */
+void zygote_exited(siginfo_t *si)
+{
+    struct plugin *plug = NULL;
+    LIST_FOREACH(plug, &head, pointers) {
+        if (plug->zygote_fd >= 0 && plug->zygote_pid == si->si_pid) {
+            close(plug->zygote_fd);
+            plug->zygote_fd = -1;
+
+            if (si->si_code == CLD_EXITED && si->si_status != 0) {
+                warn("Zygote of plug-in %s failed, exec'ing plug-in per "
+                     "connection instead\n", plug->file_path);
+                plug->zygote = 0;
+            } else {
+                info("Zygote of plug-in %s exited\n", plug->file_path);
+            }
+        }
+    }
+}
+
 /**
  * Cleans up any children that have exited.
  */
@@ -581,6 +652,7 @@ void child_cleanup(void)
                     info("Plug-in process %d exited with %d\n", si.si_pid,
                          si.si_status);
                 }
+                zygote_exited(&si);
             }
         }
     } while (1);
@@ -734,6 +806,156 @@ void exec_plugin(char *plugin, int client_fd, int require_root)
     }
 }
 
+/**
+ * Starts the zygote of a plug-in, a long lived plug-in process which has the
+ * plug-in loaded already and forks a child for each client connection passed
+ * to it.
+ * @param p             Plug-in to start the zygote of
+ * @param client_fd     Client connection lsmd is holding, not to be kept
+ *                      open by the zygote
+ * @return 0 on success, else -1
+ */
+int zygote_start(struct plugin *p, int client_fd)
+{
+    int err = 0;
+    int sv[2];
+
+    if (-1 == socketpair(AF_UNIX, SOCK_STREAM, 0, sv)) {
+        err = errno;
+        info("Error on creating zygote socket pair: %s\n", strerror(err));
+        return -1;
+    }
+
+    pid_t process = fork();
+    if (-1 == process) {
+        err = errno;
+        info("Error on forking zygote of plug-in %s: %s\n", p->file_path,
+             strerror(err));
+        close(sv[0]);
+        close(sv[1]);
+        return -1;
+    }
+
+    if (process) {
+        /* Parent */
+        close(sv[1]);
+        p->zygote_fd = sv[0];
+        p->zygote_pid = process;
+        info("Started zygote %d of plug-in %s\n", process, p->file_path);
+        return 0;
+    }
+
+    /* Child */
+    char fd_str[12];
+    const char *plugin_argv[4];
+    extern char **environ;
+
+    drop_privileges();
+
+    char *p_copy = strdup(p->file_path);
+
+    close(sv[0]);
+    /* The client gets passed over the control socket once we are ready */
+    close(client_fd);
+    empty_plugin_list(&head);
+    sprintf(fd_str, "%d", sv[1]);
+
+    plugin_argv[0] = basename(p_copy);
+    plugin_argv[1] = PLUGIN_ZYGOTE_ARG;
+    plugin_argv[2] = fd_str;
+    plugin_argv[3] = NULL;
+
+    if (-1 == execve(p_copy, (char * const*) plugin_argv, environ)) {
+        err = errno;
+        log_and_exit("Error on exec'ing zygote of plug-in %s: %s\n",
+                     p_copy, strerror(err));
+    }
+    return -1;
+}
+
+/**
+ * Passes the client connection to a zygote.
+ * @param zygote_fd     Control socket of the zygote
+ * @param client_fd     Client connected file descriptor
+ * @return 0 on success, else -1 with errno set
+ */
+int zygote_send(int zygote_fd, int client_fd)
+{
+    char data = 0;
+    struct iovec iov;
+    struct msghdr msg;
+    struct cmsghdr *cmsg = NULL;
+    union {
+        struct cmsghdr align;
+        char buf[CMSG_SPACE(sizeof(int))];
+    } control;
+
+    memset(&msg, 0, sizeof(msg));
+    memset(&control, 0, sizeof(control));
+
+    iov.iov_base = &data;
+    iov.iov_len = sizeof(data);
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    msg.msg_control = control.buf;
+    msg.msg_controllen = sizeof(control.buf);
+
+    cmsg = CMSG_FIRSTHDR(&msg);
+    cmsg->cmsg_level = SOL_SOCKET;
+    cmsg->cmsg_type = SCM_RIGHTS;
+    cmsg->cmsg_len = CMSG_LEN(sizeof(int));
+    memcpy(CMSG_DATA(cmsg), &client_fd, sizeof(int));
+
+    if (sendmsg(zygote_fd, &msg, MSG_NOSIGNAL) != sizeof(data)) {
+        return -1;
+    }
+    return 0;
+}
+
+/**
+ * Hands the client connection over to the zygote of the plug-in, starting
+ * the zygote when it is not running yet.
+ * @param p             Plug-in the client connected to
+ * @param client_fd     Client connected file descriptor
+ * @return 0 when the zygote took the connection, else -1 and the caller
+ *         should exec the plug-in instead.
+ */
+int zygote_plugin(struct plugin *p, int client_fd)
+{
+    int err = 0;
+    int attempt = 0;
+
+    /* Retry once with a new zygote in case the old one went away */
+    for (attempt = 0; attempt < 2 && p->zygote; attempt++) {
+        if (p->zygote_fd < 0 && zygote_start(p, client_fd)) {
+            return -1;
+        }
+
+        if (0 == zygote_send(p->zygote_fd, client_fd)) {
+            info("Passed connection to zygote of plug-in %s\n",
+                 p->file_path);
+            if (-1 == close(client_fd)) {
+                err = errno;
+                info("Error on closing accepted socket in parent: %s\n",
+                     strerror(err));
+            }
+            return 0;
+        }
+
+        err = errno;
+        info("Error on passing connection to zygote of plug-in %s: %s\n",
+             p->file_path, strerror(err));
+
+        /* Reap the zygote when it exited, checking how it did */
+        child_cleanup();
+        if (p->zygote_fd >= 0) {
+            close(p->zygote_fd);
+            p->zygote_fd = -1;
+        }
+    }
+    return -1;
+}
+
 /**
  * Main event loop
  */
@@ -780,7 +1002,10 @@ void _serving(void)
                     int cfd = accept(fd, NULL, NULL);
                     if (-1 != cfd) {
                         struct plugin *p = plugin_lookup(fd);
-                        exec_plugin(p->file_path, cfd, p->require_root);
+                        if (!p->zygote || plugin_mem_debug ||
+                            zygote_plugin(p, cfd)) {
+                            exec_plugin(p->file_path, cfd, p->require_root);
+                        }
                     } else {
                         err = errno;
                         info("Error on accepting request: %s", strerror(err));
@@ -17,18 +17,22 @@
 import subprocess
 import os
 
+from lsm import trace_span
+
 
 def cmd_exec(cmds):
     """
     Execute provided command and return the STDOUT as string.
     Raise ExecError if command return code is not zero
     """
-    cmd_popen = subprocess.Popen(
-        cmds, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        env={"PATH": os.getenv("PATH")}, universal_newlines=True)
-    str_stdout = "".join(list(cmd_popen.stdout)).strip()
-    str_stderr = "".join(list(cmd_popen.stderr)).strip()
-    errno = cmd_popen.wait()
+    with trace_span('arcconf.cmd_exec', cmd=" ".join(cmds)) as attributes:
+        cmd_popen = subprocess.Popen(
+            cmds, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env={"PATH": os.getenv("PATH")}, universal_newlines=True)
+        str_stdout = "".join(list(cmd_popen.stdout)).strip()
+        str_stderr = "".join(list(cmd_popen.stderr)).strip()
+        errno = cmd_popen.wait()
+        attributes['exit_status'] = errno
     if errno != 0:
         raise ExecError(" ".join(cmds), errno, str_stdout, str_stderr)
     return str_stdout
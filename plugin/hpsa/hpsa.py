@@ -25,7 +25,7 @@
 from lsm import (
     IPlugin, Client, Capabilities, VERSION, LsmError, ErrorNumber, uri_parse,
     System, Pool, size_human_2_size_bytes, search_property, Volume, Disk,
-    LocalDisk, Battery, int_div)
+    LocalDisk, Battery, int_div, PluginCache)
 
 from lsm.plugin.hpsa.utils import cmd_exec, ExecError
 
@@ -330,6 +330,8 @@ class SmartArray(IPlugin):
     def __init__(self):
         self._sacli_bin = None
         self._tmo_ms = 30000
+        # Output of the hpssacli show commands
+        self._cache = PluginCache()
 
     def _find_sacli(self):
         """
@@ -422,7 +424,17 @@ def capabilities(self, system, flags=Client.FLAG_RSVD):
     def _sacli_exec(self, sacli_cmds, flag_convert=True, flag_force=False):
         """
         If flag_convert is True, convert data into dict.
+        The output of show commands is cached for a while, any other command
+        drops it as it might change the controllers.
         """
+        if 'show' not in sacli_cmds:
+            self._cache.invalidate()
+            return self._sacli_run(sacli_cmds, flag_convert, flag_force)
+        return self._cache.get(
+            (tuple(sacli_cmds), flag_convert, flag_force),
+            lambda: self._sacli_run(sacli_cmds, flag_convert, flag_force))
+
+    def _sacli_run(self, sacli_cmds, flag_convert, flag_force):
         sacli_cmds.insert(0, self._sacli_bin)
         if flag_force:
             sacli_cmds.append('forced')
@@ -22,7 +22,8 @@
 
 from lsm import (uri_parse, search_property, size_human_2_size_bytes,
                  Capabilities, LsmError, ErrorNumber, System, Client,
-                 Disk, VERSION, IPlugin, Pool, Volume, Battery, int_div)
+                 Disk, VERSION, IPlugin, Pool, Volume, Battery, int_div,
+                 PluginCache)
 
 from lsm.plugin.megaraid.utils import cmd_exec, ExecError
 
@@ -333,6 +334,8 @@ class MegaRAID(IPlugin):
     def __init__(self):
         self._storcli_bin = None
         self._tmo_ms = 3000    # TODO(Gris Ge): Not implemented yet.
+        # Output of the storcli show commands
+        self._cache = PluginCache()
 
     def _find_storcli(self):
         """
@@ -411,6 +414,18 @@ def capabilities(self, system, flags=Client.FLAG_RSVD):
         return cap
 
     def _storcli_exec(self, storcli_cmds, flag_json=True):
+        """
+        Runs storcli, the output of show commands is cached for a while, any
+        other command drops it as it might change the controllers.
+        """
+        if 'show' not in storcli_cmds:
+            self._cache.invalidate()
+            return self._storcli_run(storcli_cmds, flag_json)
+        return self._cache.get(
+            (tuple(storcli_cmds), flag_json),
+            lambda: self._storcli_run(storcli_cmds, flag_json))
+
+    def _storcli_run(self, storcli_cmds, flag_json):
         storcli_cmds.insert(0, self._storcli_bin)
         if flag_json:
             storcli_cmds.append(MegaRAID._CMD_JSON_OUTPUT_SWITCH)
@@ -539,8 +554,9 @@ def disks(self, search_key=None, search_value=None,
             sys_id = self._sys_id_of_ctrl_num(ctrl_num)
 
             try:
-                disk_show_output = self._storcli_exec(
-                    ["/c%d/eall/sall" % ctrl_num, "show", "all"])
+                # A copy, the output is cached and gets updated below
+                disk_show_output = dict(self._storcli_exec(
+                    ["/c%d/eall/sall" % ctrl_num, "show", "all"]))
             except ExecError:
                 disk_show_output = {}
 
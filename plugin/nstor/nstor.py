@@ -30,13 +30,9 @@
 import sys
 
 try:
-    from urllib.request import (Request,
-                                urlopen)
     from urllib.parse import (urlunsplit)
     from urllib.parse import urlparse
 except ImportError:
-    from urllib2 import (Request,
-                         urlopen)
     from urlparse import (urlunsplit, urlparse)
 
 from lsm import (AccessGroup, Capabilities, ErrorNumber, FileSystem, INfs,
@@ -81,6 +77,12 @@ def _ns_request(self, path, data):
 
         url = '%s://%s:%s/%s' % \
               (self._scheme, self.uparse.hostname, self._port, path)
+        # Imported on first use, loading the plug-in doesn't need it
+        try:
+            from urllib.request import (Request, urlopen)
+        except ImportError:
+            from urllib2 import (Request, urlopen)
+
         request = Request(url, parms.encode('utf-8'))
 
         username = self.uparse.username or 'admin'
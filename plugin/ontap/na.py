@@ -17,38 +17,14 @@
 import socket
 import sys
 import six
-from xml.etree import ElementTree
 import time
 from binascii import hexlify
-import ssl
 from lsm.external.xmltodict import convert_xml_to_dict
-from lsm import (LsmError, ErrorNumber)
+from lsm import (LsmError, ErrorNumber, trace_span)
 
 if six.PY3:
     long = int
 
-try:
-    from urllib.request import (Request,
-                                urlopen,
-                                HTTPPasswordMgrWithDefaultRealm,
-                                HTTPBasicAuthHandler,
-                                HTTPSHandler,
-                                build_opener,
-                                install_opener)
-    from urllib.error import (URLError, HTTPError)
-    from urllib.parse import urlparse
-except ImportError:
-    from urllib2 import (Request,
-                         urlopen,
-                         HTTPPasswordMgrWithDefaultRealm,
-                         HTTPBasicAuthHandler,
-                         HTTPSHandler,
-                         build_opener,
-                         install_opener,
-                         URLError,
-                         HTTPError)
-    from urlparse import urlparse
-
 
 # Set to an appropriate directory and file to dump the raw response.
 xml_debug = ""
@@ -60,6 +36,7 @@ def netapp_filer_parse_response(resp):
         out.write(resp)
         out.close()
 
+    from xml.etree import ElementTree
     return convert_xml_to_dict(ElementTree.fromstring(resp))
 
 
@@ -85,6 +62,29 @@ def netapp_filer(host, username, password, timeout, command, parameters=None,
     Issue a command to the NetApp filer.
     Note: Change to default use_ssl on before we ship a release version.
     """
+    # Imported here so that loading the plug-in does not pay for the http
+    # stack when it is never used, e.g. for plugin_info().
+    import ssl
+    try:
+        from urllib.request import (Request,
+                                    HTTPPasswordMgrWithDefaultRealm,
+                                    HTTPBasicAuthHandler,
+                                    HTTPSHandler,
+                                    build_opener,
+                                    install_opener,
+                                    urlopen)
+        from urllib.error import (URLError, HTTPError)
+    except ImportError:
+        from urllib2 import (Request,
+                             HTTPPasswordMgrWithDefaultRealm,
+                             HTTPBasicAuthHandler,
+                             HTTPSHandler,
+                             build_opener,
+                             install_opener,
+                             urlopen,
+                             URLError,
+                             HTTPError)
+
     proto = 'http'
     if use_ssl:
         proto = 'https'
@@ -129,10 +129,11 @@ def netapp_filer(host, username, password, timeout, command, parameters=None,
     handler = None
     rc = None
     try:
-        handler = urlopen(req, data.encode('utf-8'), float(timeout))
+        with trace_span('ontap.' + command, host=host):
+            handler = urlopen(req, data.encode('utf-8'), float(timeout))
 
-        if handler.getcode() == 200:
-            rc = netapp_filer_parse_response(handler.read())
+            if handler.getcode() == 200:
+                rc = netapp_filer_parse_response(handler.read())
     except HTTPError:
         raise
     except URLError as ue:
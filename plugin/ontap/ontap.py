@@ -22,7 +22,8 @@
                  AccessGroup, System, Capabilities, Disk, Pool,
                  IStorageAreaNetwork, INfs, LsmError, ErrorNumber, JobStatus,
                  md5, VERSION, common_urllib2_error_handler,
-                 search_property, TargetPort, int_div, uri_parse)
+                 search_property, search_pushdown, TargetPort, int_div,
+                 uri_parse)
 
 import lsm.plugin.ontap.na as na
 
@@ -322,11 +323,21 @@ def _disk(self, d, flags=0):
                     int(d['bytes-per-sector']), int(d['physical-blocks']),
                     status, self.sys_info.id)
 
+    @search_pushdown(['id'])
     @handle_ontap_errors
     def volumes(self, search_key=None, search_value=None, flags=0):
+        if search_key == 'id':
+            # Volume id is the LUN path, ask the filer for that LUN only.
+            try:
+                luns = self.f.luns_get_specific(na_lun_name=search_value)
+            except na.FilerError as fe:
+                if fe.errno == na.Filer.ENO_SUCH_VOLUME:
+                    return []
+                raise
+            return [self._lun(l) for l in luns if l['path'] == search_value]
+
         luns = self.f.luns_get_all()
-        return search_property(
-            [self._lun(l) for l in luns], search_key, search_value)
+        return [self._lun(l) for l in luns]
 
     # This is based on NetApp ONTAP Manual pages:
     # https://library.netapp.com/ecmdocs/ECMP1196890/html/man1/na_aggr.1.html
@@ -16,22 +16,27 @@
 #         Gris Ge <fge@redhat.com>
 
 import random
+import string
 import tempfile
 import os
 import time
 import sqlite3
+import types
 
 
 from lsm import (size_human_2_size_bytes)
 from lsm import (System, Volume, Disk, Pool, FileSystem, AccessGroup,
                  FsSnapshot, NfsExport, md5, LsmError, TargetPort,
-                 ErrorNumber, JobStatus, Battery, int_div)
+                 ErrorNumber, JobStatus, Battery, int_div, search_property)
 
 
 def _handle_errors(method):
     def wrapper(*args, **kargs):
         try:
-            return method(*args, **kargs)
+            rc = method(*args, **kargs)
+            if isinstance(rc, types.GeneratorType):
+                return _handle_errors_iter(args[0], rc)
+            return rc
         except sqlite3.OperationalError as sql_error:
             if type(args[0]) is SimArray and hasattr(args[0], 'bs_obj'):
                 args[0].bs_obj.trans_rollback()
@@ -55,6 +60,22 @@ def wrapper(*args, **kargs):
     return wrapper
 
 
+_ITER_END = object()
+
+
+def _handle_errors_iter(sim_array, items):
+    """
+    Handle the errors raised while the generator returned by a method
+    decorated with _handle_errors() is being consumed.
+    """
+    next_item = _handle_errors(lambda obj: next(items, _ITER_END))
+    while True:
+        item = next_item(sim_array)
+        if item is _ITER_END:
+            return
+        yield item
+
+
 def _random_vpd():
     """
     Generate a random VPD83 NAA_Type3 ID
@@ -146,9 +167,461 @@ class BackStore(object):
     DEFAULT_PHYSICAL_DISK_CACHE = Volume.PHYSICAL_DISK_CACHE_DISABLED
 
     _DEFAULT_READ_CACHE_PCT = 10
+    # 2017-01-01 00:00 UTC, time of the snapshots made by sim_generate()
+    _GENERATE_TIMESTAMP = 1483228800
     _LIST_SPLITTER = '#'
     _ID_FMT_LEN = 5
 
+    # sqlite3 name of a database kept in memory.
+    MEMORY_STATEFILE = ':memory:'
+
+    # Number of prepared statements sqlite3 keeps per connection.
+    _SQL_CACHE_SIZE = 256
+
+    _INDEXES = """
+        CREATE INDEX IF NOT EXISTS disks_owner_pool_id
+            ON disks(owner_pool_id);
+        CREATE INDEX IF NOT EXISTS pools_parent_pool_id
+            ON pools(parent_pool_id);
+        CREATE INDEX IF NOT EXISTS volumes_pool_id ON volumes(pool_id);
+        CREATE INDEX IF NOT EXISTS inits_owner_ag_id ON inits(owner_ag_id);
+        CREATE INDEX IF NOT EXISTS vol_masks_ag_id_vol_id
+            ON vol_masks(ag_id, vol_id);
+        CREATE INDEX IF NOT EXISTS vol_masks_vol_id ON vol_masks(vol_id);
+        CREATE INDEX IF NOT EXISTS vol_reps_src_vol_id
+            ON vol_reps(src_vol_id);
+        CREATE INDEX IF NOT EXISTS vol_reps_dst_vol_id
+            ON vol_reps(dst_vol_id);
+        CREATE INDEX IF NOT EXISTS fss_pool_id ON fss(pool_id);
+        CREATE INDEX IF NOT EXISTS fs_snaps_fs_id ON fs_snaps(fs_id);
+        CREATE INDEX IF NOT EXISTS fs_clones_src_fs_id
+            ON fs_clones(src_fs_id);
+        CREATE INDEX IF NOT EXISTS fs_clones_dst_fs_id
+            ON fs_clones(dst_fs_id);
+        CREATE INDEX IF NOT EXISTS exps_fs_id ON exps(fs_id);
+        CREATE INDEX IF NOT EXISTS exp_root_hosts_exp_id
+            ON exp_root_hosts(exp_id);
+        CREATE INDEX IF NOT EXISTS exp_rw_hosts_exp_id
+            ON exp_rw_hosts(exp_id);
+        CREATE INDEX IF NOT EXISTS exp_ro_hosts_exp_id
+            ON exp_ro_hosts(exp_id);
+        """
+
+    # Keep pools.consumed_space up to date in the statement changing the
+    # volumes, file systems or sub-pools, hence in its transaction.
+    _POOL_TRIGGERS = """
+        CREATE TRIGGER volumes_space_insert AFTER INSERT ON volumes
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space + NEW.consumed_size WHERE id = NEW.pool_id;
+        END;
+        CREATE TRIGGER volumes_space_update
+            AFTER UPDATE OF consumed_size, pool_id ON volumes
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space - OLD.consumed_size WHERE id = OLD.pool_id;
+            UPDATE pools SET consumed_space =
+                consumed_space + NEW.consumed_size WHERE id = NEW.pool_id;
+        END;
+        CREATE TRIGGER volumes_space_delete AFTER DELETE ON volumes
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space - OLD.consumed_size WHERE id = OLD.pool_id;
+        END;
+
+        CREATE TRIGGER fss_space_insert AFTER INSERT ON fss
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space + NEW.consumed_size WHERE id = NEW.pool_id;
+        END;
+        CREATE TRIGGER fss_space_update
+            AFTER UPDATE OF consumed_size, pool_id ON fss
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space - OLD.consumed_size WHERE id = OLD.pool_id;
+            UPDATE pools SET consumed_space =
+                consumed_space + NEW.consumed_size WHERE id = NEW.pool_id;
+        END;
+        CREATE TRIGGER fss_space_delete AFTER DELETE ON fss
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space - OLD.consumed_size WHERE id = OLD.pool_id;
+        END;
+
+        CREATE TRIGGER sub_pools_space_insert AFTER INSERT ON pools
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space + NEW.total_space
+                WHERE id = NEW.parent_pool_id;
+        END;
+        CREATE TRIGGER sub_pools_space_update
+            AFTER UPDATE OF total_space, parent_pool_id ON pools
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space - OLD.total_space
+                WHERE id = OLD.parent_pool_id;
+            UPDATE pools SET consumed_space =
+                consumed_space + NEW.total_space
+                WHERE id = NEW.parent_pool_id;
+        END;
+        CREATE TRIGGER sub_pools_space_delete AFTER DELETE ON pools
+        BEGIN
+            UPDATE pools SET consumed_space =
+                consumed_space - OLD.total_space
+                WHERE id = OLD.parent_pool_id;
+        END;
+        """
+
+    # What pools.total_space of a pool made of disks and pools.consumed_space
+    # add up to, for the pool of the "pools" table in the enclosing query.
+    _POOL_DATA_SPACE = """
+        (SELECT ifnull(SUM(disk.total_space), 0) FROM disks disk
+            WHERE disk.owner_pool_id = pools.id AND disk.role = 'DATA')
+        """
+    _POOL_CONSUMED_SPACE = """
+        (SELECT ifnull(SUM(volume.consumed_size), 0) FROM volumes volume
+            WHERE volume.pool_id = pools.id) +
+        (SELECT ifnull(SUM(fs.consumed_size), 0) FROM fss fs
+            WHERE fs.pool_id = pools.id) +
+        (SELECT ifnull(SUM(sub_pool.total_space), 0) FROM pools sub_pool
+            WHERE sub_pool.parent_pool_id = pools.id)
+        """
+
+    # Create views, SUBSTR() used below is alternative way of PRINTF()
+    # which only exists on sqlite 3.8+ while RHEL6 or Ubuntu 12.04 ships
+    # older version.  The lsm ids end with the sim id zero padded to
+    # _ID_FMT_LEN digits, larger ids are kept whole.
+    _POOLS_VIEW = """
+        CREATE VIEW pools_view AS
+            SELECT
+                pool0.id,
+                    'POOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || pool0.id,
+                               -MAX(LENGTH(pool0.id), {ID_FMT_LEN}))
+                lsm_pool_id,
+                pool0.name,
+                pool0.status,
+                pool0.status_info,
+                pool0.element_type,
+                pool0.unsupported_actions,
+                pool0.raid_type,
+                pool0.member_type,
+                pool0.parent_pool_id,
+                    'POOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || pool0.parent_pool_id,
+                               -MAX(LENGTH(pool0.parent_pool_id),
+                                    {ID_FMT_LEN}))
+                parent_lsm_pool_id,
+                pool0.strip_size,
+                pool0.total_space total_space,
+                pool0.total_space - pool0.consumed_space free_space,
+                    (SELECT COUNT(disk.id) FROM disks disk
+                        WHERE disk.owner_pool_id = pool0.id AND
+                              disk.role = 'DATA')
+                data_disk_count,
+                    (SELECT COUNT(disk.id) FROM disks disk
+                        WHERE disk.owner_pool_id = pool0.id)
+                disk_count
+            FROM
+                pools pool0;
+        """
+
+    _VIEWS = """
+        CREATE VIEW tgts_view AS
+            SELECT
+                id,
+                    'TGT_PORT_ID_' ||
+                        SUBSTR('{ID_PADDING}' || id,
+                               -MAX(LENGTH(id), {ID_FMT_LEN}))
+                lsm_tgt_id,
+                port_type,
+                service_address,
+                network_address,
+                physical_address,
+                physical_name
+            FROM
+                tgts;
+
+        CREATE VIEW disks_view AS
+            SELECT
+                id,
+                    'DISK_ID_' ||
+                        SUBSTR('{ID_PADDING}' || id,
+                               -MAX(LENGTH(id), {ID_FMT_LEN}))
+                lsm_disk_id,
+                    disk_prefix || '_' || id
+                name,
+                total_space,
+                disk_type,
+                role,
+                status,
+                vpd83,
+                rpm,
+                link_type,
+                location,
+                owner_pool_id
+            FROM
+                disks;
+
+        CREATE VIEW volumes_view AS
+            SELECT
+                id,
+                    'VOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || id,
+                               -MAX(LENGTH(id), {ID_FMT_LEN}))
+                lsm_vol_id,
+                vpd83,
+                name,
+                total_space,
+                consumed_size,
+                admin_state,
+                is_hw_raid_vol,
+                write_cache_policy,
+                read_cache_policy,
+                phy_disk_cache,
+                pool_id,
+                    'POOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || pool_id,
+                               -MAX(LENGTH(pool_id), {ID_FMT_LEN}))
+                lsm_pool_id
+            FROM
+                volumes;
+
+        CREATE VIEW fss_view AS
+            SELECT
+                id,
+                    'FS_ID_' ||
+                        SUBSTR('{ID_PADDING}' || id,
+                               -MAX(LENGTH(id), {ID_FMT_LEN}))
+                lsm_fs_id,
+                name,
+                total_space,
+                consumed_size,
+                free_space,
+                pool_id,
+                    'POOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || pool_id,
+                               -MAX(LENGTH(pool_id), {ID_FMT_LEN}))
+                lsm_pool_id
+            FROM
+                fss;
+
+        CREATE VIEW bats_view AS
+            SELECT
+                id,
+                    'BAT_ID_' ||
+                        SUBSTR('{ID_PADDING}' || id,
+                               -MAX(LENGTH(id), {ID_FMT_LEN}))
+                lsm_bat_id,
+                name,
+                type,
+                status
+            FROM
+                batteries;
+
+        CREATE VIEW fs_snaps_view AS
+            SELECT
+                id,
+                    'FS_SNAP_ID_' ||
+                        SUBSTR('{ID_PADDING}' || id,
+                               -MAX(LENGTH(id), {ID_FMT_LEN}))
+                lsm_fs_snap_id,
+                name,
+                timestamp,
+                fs_id,
+                    'FS_ID_' ||
+                        SUBSTR('{ID_PADDING}' || fs_id,
+                               -MAX(LENGTH(fs_id), {ID_FMT_LEN}))
+                lsm_fs_id
+            FROM
+                fs_snaps;
+
+        CREATE VIEW volumes_by_ag_view AS
+            SELECT
+                vol.id,
+                    'VOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || vol.id,
+                               -MAX(LENGTH(vol.id), {ID_FMT_LEN}))
+                lsm_vol_id,
+                vol.vpd83,
+                vol.name,
+                vol.total_space,
+                vol.consumed_size,
+                vol.pool_id,
+                    'POOL_ID_' ||
+                        SUBSTR('{ID_PADDING}' || vol.pool_id,
+                               -MAX(LENGTH(vol.pool_id), {ID_FMT_LEN}))
+                lsm_pool_id,
+                vol.admin_state,
+                vol.is_hw_raid_vol,
+                vol_mask.ag_id ag_id,
+                vol.write_cache_policy,
+                vol.read_cache_policy,
+                vol.phy_disk_cache
+            FROM
+                volumes vol
+                    LEFT JOIN vol_masks vol_mask
+                        ON vol_mask.vol_id = vol.id;
+
+        CREATE VIEW ags_view AS
+            SELECT
+                ag.id,
+                    'AG_ID_' ||
+                        SUBSTR('{ID_PADDING}' || ag.id,
+                               -MAX(LENGTH(ag.id), {ID_FMT_LEN}))
+                lsm_ag_id,
+                ag.name,
+                    CASE
+                        WHEN count(DISTINCT init.init_type) = 1
+                            THEN init.init_type
+                        WHEN count(DISTINCT init.init_type) = 2
+                            THEN {AG_INIT_TYPE_MIXED}
+                        ELSE {AG_INIT_TYPE_UNKNOWN}
+                    END
+                init_type,
+                group_concat(init.id, '{SPLITTER}') init_ids_str
+            FROM
+                ags ag
+                    LEFT JOIN inits init
+                        ON ag.id = init.owner_ag_id
+            GROUP BY
+                ag.id
+            ORDER BY
+                init.init_type;
+
+        CREATE VIEW ags_by_vol_view AS
+            SELECT
+                ag_new.id,
+                    'AG_ID_' ||
+                        SUBSTR('{ID_PADDING}' || ag_new.id,
+                               -MAX(LENGTH(ag_new.id), {ID_FMT_LEN}))
+                lsm_ag_id,
+                ag_new.name,
+                ag_new.init_type,
+                ag_new.init_ids_str,
+                vol_mask.vol_id vol_id
+            FROM
+                (
+                    SELECT
+                        ag.id,
+                        ag.name,
+                            CASE
+                                WHEN count(DISTINCT init.init_type) = 1
+                                    THEN init.init_type
+                                WHEN count(DISTINCT init.init_type) = 2
+                                    THEN {AG_INIT_TYPE_MIXED}
+                                ELSE {AG_INIT_TYPE_UNKNOWN}
+                            END
+                        init_type,
+                        group_concat(init.id, '{SPLITTER}') init_ids_str
+                    FROM
+                        ags ag
+                            LEFT JOIN inits init
+                                ON ag.id = init.owner_ag_id
+                    GROUP BY
+                        ag.id
+                    ORDER BY
+                        init.init_type
+                ) ag_new
+                    LEFT JOIN vol_masks vol_mask
+                        ON vol_mask.ag_id = ag_new.id
+        ;
+
+        CREATE VIEW exps_view AS
+            SELECT
+                exp.id,
+                    'EXP_ID_' ||
+                        SUBSTR('{ID_PADDING}' || exp.id,
+                               -MAX(LENGTH(exp.id), {ID_FMT_LEN}))
+                lsm_exp_id,
+                exp.fs_id,
+                    'FS_ID_' ||
+                        SUBSTR('{ID_PADDING}' || exp.fs_id,
+                               -MAX(LENGTH(exp.fs_id), {ID_FMT_LEN}))
+                lsm_fs_id,
+                exp.exp_path,
+                exp.auth_type,
+                exp.anon_uid,
+                exp.anon_gid,
+                exp.options,
+                exp2.exp_root_hosts_str,
+                exp3.exp_rw_hosts_str,
+                exp4.exp_ro_hosts_str
+            FROM
+                exps exp
+                    LEFT JOIN (
+                        SELECT
+                            exp_t2.id,
+                                group_concat(
+                                    exp_root_host.host, '{SPLITTER}')
+                            exp_root_hosts_str
+                        FROM
+                            exps exp_t2
+                            LEFT JOIN exp_root_hosts exp_root_host
+                                ON exp_t2.id = exp_root_host.exp_id
+                        GROUP BY
+                            exp_t2.id
+                    ) exp2
+                        ON exp.id = exp2.id
+                    LEFT JOIN (
+                        SELECT
+                            exp_t3.id,
+                                group_concat(
+                                    exp_rw_host.host, '{SPLITTER}')
+                            exp_rw_hosts_str
+                        FROM
+                            exps exp_t3
+                            LEFT JOIN exp_rw_hosts exp_rw_host
+                                ON exp_t3.id = exp_rw_host.exp_id
+                        GROUP BY
+                            exp_t3.id
+                    ) exp3
+                        ON exp.id = exp3.id
+                    LEFT JOIN (
+                        SELECT
+                            exp_t4.id,
+                                group_concat(
+                                    exp_ro_host.host, '{SPLITTER}')
+                            exp_ro_hosts_str
+                        FROM
+                            exps exp_t4
+                            LEFT JOIN exp_ro_hosts exp_ro_host
+                                ON exp_t4.id = exp_ro_host.exp_id
+                        GROUP BY
+                            exp_t4.id
+                    ) exp4
+                        ON exp.id = exp4.id
+            GROUP BY
+                exp.id;
+        ;
+        """
+
+    # Version of the schema, kept in the "user_version" of the state file.
+    # _MIGRATIONS holds the script bringing a state file from the previous
+    # version to the version it is stored for, they are applied in order to
+    # state files made by older simulators.
+    SCHEMA_VERSION = 3
+    _MIGRATIONS = {
+        # Indexes on the foreign keys and the other lookup columns
+        1: _INDEXES,
+        # Pool space counters instead of summing up everything in pools_view
+        2: """
+            ALTER TABLE pools
+                ADD COLUMN consumed_space LONG NOT NULL DEFAULT 0;
+            UPDATE pools SET total_space = %s
+                WHERE parent_pool_id IS NULL;
+            UPDATE pools SET consumed_space = %s;
+            DROP VIEW pools_view;
+            """ % (_POOL_DATA_SPACE, _POOL_CONSUMED_SPACE) +
+        _POOLS_VIEW + _POOL_TRIGGERS,
+        # lsm ids of sim ids above 99999 were cut to their last 5 digits
+        3: "".join("DROP VIEW %s;\n" % view_name for view_name in (
+            'pools_view', 'tgts_view', 'disks_view', 'volumes_view',
+            'fss_view', 'bats_view', 'fs_snaps_view', 'volumes_by_ag_view',
+            'ags_view', 'ags_by_vol_view', 'exps_view')) +
+        _POOLS_VIEW + _VIEWS,
+    }
+
     SUPPORTED_VCR_RAID_TYPES = [
         Volume.RAID_TYPE_RAID0, Volume.RAID_TYPE_RAID1,
         Volume.RAID_TYPE_RAID5, Volume.RAID_TYPE_RAID6,
@@ -159,20 +632,36 @@ class BackStore(object):
         8 * 1024, 16 * 1024, 32 * 1024, 64 * 1024, 128 * 1024, 256 * 1024,
         512 * 1024, 1024 * 1024]
 
-    def __init__(self, statefile, timeout):
-        if not os.path.exists(statefile):
+    def __init__(self, statefile, timeout, wal=False):
+        """
+        The statefile MEMORY_STATEFILE keeps the state in memory, for this
+        BackStore only.  With wal, the state file is switched to the WAL
+        journal mode, in which reading the state never waits for the
+        changes of others or holds them up.
+        """
+        if statefile != BackStore.MEMORY_STATEFILE and \
+           not os.path.exists(statefile):
             os.close(os.open(statefile, os.O_WRONLY | os.O_CREAT))
             # Due to umask, os.open() created file migt not be 666 permission.
             os.chmod(statefile, 0o666)
 
         self.statefile = statefile
         self.lastrowid = None
+        # True while batch() runs, see there.
+        self._in_batch = False
         self.sql_conn = sqlite3.connect(
-            statefile, timeout=int(int_div(timeout, 1000)), isolation_level="IMMEDIATE")
+            statefile, timeout=int(int_div(timeout, 1000)),
+            isolation_level="IMMEDIATE",
+            cached_statements=BackStore._SQL_CACHE_SIZE)
         self.sql_conn.row_factory = _dict_factory
-        # Create tables no matter exist or not. No lock required.
+        if wal:
+            self.sql_conn.execute("PRAGMA journal_mode = WAL;")
 
+        # Create tables no matter exist or not, in a transaction so that
+        # other simulators starting meanwhile wait until all of them exist.
+        # The foreign_keys pragma does nothing inside a transaction.
         sql_cmd = "PRAGMA foreign_keys = ON;\n"
+        sql_cmd += "BEGIN IMMEDIATE TRANSACTION;\n"
 
         sql_cmd += \
             """
@@ -210,12 +699,17 @@ def __init__(self, statefile, timeout):
             parent_pool_id INTEGER,
             member_type INTEGER,
             strip_size INTEGER,
-            total_space LONG);
+            total_space LONG,
+            consumed_space LONG NOT NULL DEFAULT 0);
             """
         # parent_pool_id:
         #   Indicate this pool is allocated from # other pool
         # total_space:
-        #   is only for sub-pool \pool from pool)
+        #   size of the sub-pool, or of the data disks of a pool made of
+        #   disks
+        # consumed_space:
+        #   space used by the volumes, file systems and sub-pools allocated
+        #   from the pool, kept up to date by the _POOL_TRIGGERS
 
         sql_cmd += \
             """
@@ -393,415 +887,26 @@ def __init__(self, statefile, timeout):
             status INTEGER NOT NULL);
             """
 
-        # Create views, SUBSTR() used below is alternative way of PRINTF()
-        # which only exists on sqlite 3.8+ while RHEL6 or Ubuntu 12.04 ships
-        # older version.
-        sql_cmd += \
-            """
-            CREATE VIEW pools_view AS
-                SELECT
-                    pool0.id,
-                        'POOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || pool0.id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_pool_id,
-                    pool0.name,
-                    pool0.status,
-                    pool0.status_info,
-                    pool0.element_type,
-                    pool0.unsupported_actions,
-                    pool0.raid_type,
-                    pool0.member_type,
-                    pool0.parent_pool_id,
-                        'POOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || pool0.parent_pool_id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    parent_lsm_pool_id,
-                    pool0.strip_size,
-                    pool1.total_space total_space,
-                    pool1.total_space -
-                    pool2.vol_consumed_size  -
-                    pool3.fs_consumed_size -
-                    pool4.sub_pool_consumed_size free_space,
-                    pool1.data_disk_count,
-                    pool5.disk_count
-                FROM
-                    pools pool0
-                        LEFT JOIN (
-                            SELECT
-                                pool.id,
-                                    ifnull(pool.total_space,
-                                        ifnull(SUM(disk.total_space), 0))
-                                total_space,
-                                COUNT(disk.id) data_disk_count
-                            FROM pools pool
-                                LEFT JOIN disks disk
-                                    ON pool.id = disk.owner_pool_id AND
-                                       disk.role = 'DATA'
-                            GROUP BY
-                                pool.id
-                        ) pool1 ON pool0.id = pool1.id
-
-                        LEFT JOIN (
-                            SELECT
-                                pool.id,
-                                ifnull(SUM(volume.consumed_size), 0)
-                                vol_consumed_size
-                            FROM pools pool
-                                LEFT JOIN volumes volume
-                                    ON volume.pool_id = pool.id
-                            GROUP BY
-                                pool.id
-                        ) pool2 ON pool0.id = pool2.id
-
-                        LEFT JOIN (
-                            SELECT
-                                pool.id,
-                                ifnull(SUM(fs.consumed_size), 0)
-                                fs_consumed_size
-                            FROM pools pool
-                                LEFT JOIN fss fs
-                                    ON fs.pool_id = pool.id
-                            GROUP BY
-                                pool.id
-                        ) pool3 ON pool0.id = pool3.id
-
-                        LEFT JOIN (
-                            SELECT
-                                pool.id,
-                                ifnull(SUM(sub_pool.total_space), 0)
-                                sub_pool_consumed_size
-                            FROM pools pool
-                                LEFT JOIN pools sub_pool
-                                    ON sub_pool.parent_pool_id = pool.id
-                            GROUP BY
-                                pool.id
-                        ) pool4 ON pool0.id = pool4.id
-                        LEFT JOIN (
-                            SELECT
-                                pool.id,
-                                COUNT(disk.id) disk_count
-                            FROM pools pool
-                                LEFT JOIN disks disk
-                                    ON pool.id = disk.owner_pool_id
-                            GROUP BY
-                                pool.id
-                        ) pool5 ON pool0.id = pool5.id
-                GROUP BY
-                    pool0.id;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW tgts_view AS
-                SELECT
-                    id,
-                        'TGT_PORT_ID_' ||
-                            SUBSTR('{ID_PADDING}' || id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_tgt_id,
-                    port_type,
-                    service_address,
-                    network_address,
-                    physical_address,
-                    physical_name
-                FROM
-                    tgts;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW disks_view AS
-                SELECT
-                    id,
-                        'DISK_ID_' ||
-                            SUBSTR('{ID_PADDING}' || id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_disk_id,
-                        disk_prefix || '_' || id
-                    name,
-                    total_space,
-                    disk_type,
-                    role,
-                    status,
-                    vpd83,
-                    rpm,
-                    link_type,
-                    location,
-                    owner_pool_id
-                FROM
-                    disks;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW volumes_view AS
-                SELECT
-                    id,
-                        'VOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_vol_id,
-                    vpd83,
-                    name,
-                    total_space,
-                    consumed_size,
-                    admin_state,
-                    is_hw_raid_vol,
-                    write_cache_policy,
-                    read_cache_policy,
-                    phy_disk_cache,
-                    pool_id,
-                        'POOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || pool_id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_pool_id
-                FROM
-                    volumes;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW fss_view AS
-                SELECT
-                    id,
-                        'FS_ID_' ||
-                            SUBSTR('{ID_PADDING}' || id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_fs_id,
-                    name,
-                    total_space,
-                    consumed_size,
-                    free_space,
-                    pool_id,
-                        'POOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || pool_id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_pool_id
-                FROM
-                    fss;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW bats_view AS
-                SELECT
-                    id,
-                        'BAT_ID_' ||
-                            SUBSTR('{ID_PADDING}' || id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_bat_id,
-                    name,
-                    type,
-                    status
-                FROM
-                    batteries;
-            """
-        sql_cmd += \
-            """
-            CREATE VIEW fs_snaps_view AS
-                SELECT
-                    id,
-                        'FS_SNAP_ID_' ||
-                            SUBSTR('{ID_PADDING}' || id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_fs_snap_id,
-                    name,
-                    timestamp,
-                    fs_id,
-                        'FS_ID_' ||
-                            SUBSTR('{ID_PADDING}' || fs_id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_fs_id
-                FROM
-                    fs_snaps;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW volumes_by_ag_view AS
-                SELECT
-                    vol.id,
-                        'VOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || vol.id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_vol_id,
-                    vol.vpd83,
-                    vol.name,
-                    vol.total_space,
-                    vol.consumed_size,
-                    vol.pool_id,
-                        'POOL_ID_' ||
-                            SUBSTR('{ID_PADDING}' || vol.pool_id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_pool_id,
-                    vol.admin_state,
-                    vol.is_hw_raid_vol,
-                    vol_mask.ag_id ag_id,
-                    vol.write_cache_policy,
-                    vol.read_cache_policy,
-                    vol.phy_disk_cache
-                FROM
-                    volumes vol
-                        LEFT JOIN vol_masks vol_mask
-                            ON vol_mask.vol_id = vol.id;
-            """
-
-        sql_cmd += \
-            """
-            CREATE VIEW ags_view AS
-                SELECT
-                    ag.id,
-                        'AG_ID_' ||
-                            SUBSTR('{ID_PADDING}' || ag.id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_ag_id,
-                    ag.name,
-                        CASE
-                            WHEN count(DISTINCT init.init_type) = 1
-                                THEN init.init_type
-                            WHEN count(DISTINCT init.init_type) = 2
-                                THEN {AG_INIT_TYPE_MIXED}
-                            ELSE {AG_INIT_TYPE_UNKNOWN}
-                        END
-                    init_type,
-                    group_concat(init.id, '{SPLITTER}') init_ids_str
-                FROM
-                    ags ag
-                        LEFT JOIN inits init
-                            ON ag.id = init.owner_ag_id
-                GROUP BY
-                    ag.id
-                ORDER BY
-                    init.init_type;
-            """
+        sql_cmd += BackStore._POOLS_VIEW
+        sql_cmd += BackStore._VIEWS
 
-        sql_cmd += \
-            """
-            CREATE VIEW ags_by_vol_view AS
-                SELECT
-                    ag_new.id,
-                        'AG_ID_' ||
-                            SUBSTR('{ID_PADDING}' || ag_new.id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_ag_id,
-                    ag_new.name,
-                    ag_new.init_type,
-                    ag_new.init_ids_str,
-                    vol_mask.vol_id vol_id
-                FROM
-                    (
-                        SELECT
-                            ag.id,
-                            ag.name,
-                                CASE
-                                    WHEN count(DISTINCT init.init_type) = 1
-                                        THEN init.init_type
-                                    WHEN count(DISTINCT init.init_type) = 2
-                                        THEN {AG_INIT_TYPE_MIXED}
-                                    ELSE {AG_INIT_TYPE_UNKNOWN}
-                                END
-                            init_type,
-                            group_concat(init.id, '{SPLITTER}') init_ids_str
-                        FROM
-                            ags ag
-                                LEFT JOIN inits init
-                                    ON ag.id = init.owner_ag_id
-                        GROUP BY
-                            ag.id
-                        ORDER BY
-                            init.init_type
-                    ) ag_new
-                        LEFT JOIN vol_masks vol_mask
-                            ON vol_mask.ag_id = ag_new.id
-            ;
-            """
+        sql_cmd += BackStore._INDEXES
+        sql_cmd += BackStore._POOL_TRIGGERS
+        # Only reached when the tables did not exist yet
+        sql_cmd += "PRAGMA user_version = %d;\n" % BackStore.SCHEMA_VERSION
+        sql_cmd += "COMMIT;"
 
-        sql_cmd += \
-            """
-            CREATE VIEW exps_view AS
-                SELECT
-                    exp.id,
-                        'EXP_ID_' ||
-                            SUBSTR('{ID_PADDING}' || exp.id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_exp_id,
-                    exp.fs_id,
-                        'FS_ID_' ||
-                            SUBSTR('{ID_PADDING}' || exp.fs_id,
-                                   -{ID_FMT_LEN}, {ID_FMT_LEN})
-                    lsm_fs_id,
-                    exp.exp_path,
-                    exp.auth_type,
-                    exp.anon_uid,
-                    exp.anon_gid,
-                    exp.options,
-                    exp2.exp_root_hosts_str,
-                    exp3.exp_rw_hosts_str,
-                    exp4.exp_ro_hosts_str
-                FROM
-                    exps exp
-                        LEFT JOIN (
-                            SELECT
-                                exp_t2.id,
-                                    group_concat(
-                                        exp_root_host.host, '{SPLITTER}')
-                                exp_root_hosts_str
-                            FROM
-                                exps exp_t2
-                                LEFT JOIN exp_root_hosts exp_root_host
-                                    ON exp_t2.id = exp_root_host.exp_id
-                            GROUP BY
-                                exp_t2.id
-                        ) exp2
-                            ON exp.id = exp2.id
-                        LEFT JOIN (
-                            SELECT
-                                exp_t3.id,
-                                    group_concat(
-                                        exp_rw_host.host, '{SPLITTER}')
-                                exp_rw_hosts_str
-                            FROM
-                                exps exp_t3
-                                LEFT JOIN exp_rw_hosts exp_rw_host
-                                    ON exp_t3.id = exp_rw_host.exp_id
-                            GROUP BY
-                                exp_t3.id
-                        ) exp3
-                            ON exp.id = exp3.id
-                        LEFT JOIN (
-                            SELECT
-                                exp_t4.id,
-                                    group_concat(
-                                        exp_ro_host.host, '{SPLITTER}')
-                                exp_ro_hosts_str
-                            FROM
-                                exps exp_t4
-                                LEFT JOIN exp_ro_hosts exp_ro_host
-                                    ON exp_t4.id = exp_ro_host.exp_id
-                            GROUP BY
-                                exp_t4.id
-                        ) exp4
-                            ON exp.id = exp4.id
-                GROUP BY
-                    exp.id;
-            ;
-            """
-
-        sql_cmd = sql_cmd.format(**{
-            'ID_PADDING': '0' * BackStore._ID_FMT_LEN,
-            'ID_FMT_LEN': BackStore._ID_FMT_LEN,
-            'AG_INIT_TYPE_MIXED': AccessGroup.INIT_TYPE_ISCSI_WWPN_MIXED,
-            'AG_INIT_TYPE_UNKNOWN': AccessGroup.INIT_TYPE_UNKNOWN,
-            'SPLITTER': BackStore._LIST_SPLITTER,
-        })
+        sql_cmd = BackStore._sql_format(sql_cmd)
 
         sql_cur = self.sql_conn.cursor()
         try:
             sql_cur.executescript(sql_cmd)
         except sqlite3.OperationalError as sql_error:
-            if 'already exists' in str(sql_error):
-                pass
+            # Python 2 does not prepare the script again when another
+            # simulator created the tables meanwhile.
+            if 'already exists' in str(sql_error) or \
+               'database schema has changed' in str(sql_error):
+                self._script_rollback()
             else:
                 raise sql_error
         except sqlite3.DatabaseError as sql_error:
@@ -810,6 +915,57 @@ def __init__(self, statefile, timeout):
                 "Stored simulator state incompatible with "
                 "simulator, please move or delete %s" % self.statefile)
 
+        self._migrate()
+
+    def _script_rollback(self):
+        """
+        Roll back the transaction of a failed executescript(), which some
+        python versions do themselves.
+        """
+        try:
+            self.sql_conn.executescript("ROLLBACK;")
+        except sqlite3.OperationalError:
+            pass
+
+    def _schema_version(self):
+        return self._sql_exec("PRAGMA user_version;")[0]['user_version']
+
+    def _migrate(self):
+        """
+        Brings the schema of the state file to SCHEMA_VERSION.  Each
+        migration runs in a transaction of its own.  When it fails because
+        another simulator did the same migration meanwhile, carry on from
+        the version that one reached.
+        """
+        version = self._schema_version()
+        while version < BackStore.SCHEMA_VERSION:
+            try:
+                self.sql_conn.executescript(
+                    "BEGIN IMMEDIATE TRANSACTION;\n%s\n"
+                    "PRAGMA user_version = %d;\nCOMMIT;" %
+                    (BackStore._sql_format(BackStore._MIGRATIONS[version + 1]),
+                     version + 1))
+            except sqlite3.OperationalError as sql_error:
+                self._script_rollback()
+                if self._schema_version() == version:
+                    raise sql_error
+                version = self._schema_version()
+                continue
+            version += 1
+
+    @staticmethod
+    def _sql_format(sql_cmd):
+        """
+        Fills in the constants used by the SQL of the schema.
+        """
+        return sql_cmd.format(**{
+            'ID_PADDING': '0' * BackStore._ID_FMT_LEN,
+            'ID_FMT_LEN': BackStore._ID_FMT_LEN,
+            'AG_INIT_TYPE_MIXED': AccessGroup.INIT_TYPE_ISCSI_WWPN_MIXED,
+            'AG_INIT_TYPE_UNKNOWN': AccessGroup.INIT_TYPE_UNKNOWN,
+            'SPLITTER': BackStore._LIST_SPLITTER,
+        })
+
     def _check_version(self):
         sim_syss = self.sim_syss()
         if len(sim_syss) == 0 or not sim_syss[0]:
@@ -831,21 +987,18 @@ def check_version_and_init(self):
         """
         # The complex lock workflow is all caused by python sqlite3 do
         # autocommit for "CREATE TABLE" command.
+        # Only lock out the others when the data is missing.
+        self.trans_begin_read()
+        initialized = self._check_version()
+        self.trans_rollback()
+        if initialized:
+            return
         self.trans_begin()
         if self._check_version():
             self.trans_commit()
             return
         else:
-            self._data_add(
-                'systems',
-                {
-                    'id': BackStore.SYS_ID,
-                    'name': BackStore.SYS_NAME,
-                    'status': System.STATUS_OK,
-                    'status_info': "",
-                    'version': BackStore.VERSION_SIGNATURE,
-                    'read_cache_pct': BackStore._DEFAULT_READ_CACHE_PCT
-                })
+            self._sim_sys_add()
 
             size_bytes_2t = size_human_2_size_bytes('2TiB')
             size_bytes_512g = size_human_2_size_bytes('512GiB')
@@ -1019,41 +1172,349 @@ def check_version_and_init(self):
             self.trans_commit()
             return
 
-    def _sql_exec(self, sql_cmd):
+    def _sim_sys_add(self):
+        self._data_add(
+            'systems',
+            {
+                'id': BackStore.SYS_ID,
+                'name': BackStore.SYS_NAME,
+                'status': System.STATUS_OK,
+                'status_info': "",
+                'version': BackStore.VERSION_SIGNATURE,
+                'read_cache_pct': BackStore._DEFAULT_READ_CACHE_PCT
+            })
+
+    def sim_generate(self, seed=0, disks=64, pools=8, volumes=1000, ags=100,
+                     inits=200, masks=1000, fss=100, fs_snaps=100, exps=100):
+        """
+        Fill an empty state file with the given numbers of disks, pools,
+        volumes, access groups, initiators, volume masks, file systems,
+        file system snapshots and NFS exports.  The same seed always gives
+        the same state.  Disks are split evenly among the pools, volumes
+        and file systems take up to half the space of the pools in turn.
+        Rows are added with executemany() in one transaction, objects
+        get the ids 1 to N of their table.
+        """
+        if pools < 1 or disks < pools:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Need at least one pool and one disk per pool")
+        if (inits or masks) and ags < 1:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Initiators and masks need access groups")
+        if inits < ags:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Need at least one initiator per access group")
+        if masks > volumes * ags:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Cannot mask %d volumes to %d access groups %d times" %
+                (volumes, ags, masks))
+        if (fs_snaps or exps) and fss < 1:
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "Snapshots and exports need file systems")
+
+        rng = random.Random(seed)
+        disk_profiles = [
+            ("2TiB SATA Disk", size_human_2_size_bytes('2TiB'),
+             Disk.TYPE_SATA, 7200, Disk.LINK_TYPE_ATA),
+            ("2TiB SAS Disk", size_human_2_size_bytes('2TiB'),
+             Disk.TYPE_SAS, 15000, Disk.LINK_TYPE_SAS),
+            ("512GiB SSD Disk", size_human_2_size_bytes('512GiB'),
+             Disk.TYPE_SSD, Disk.RPM_NON_ROTATING_MEDIUM, Disk.LINK_TYPE_ATA),
+            ("2TiB SSD Disk", size_human_2_size_bytes('2TiB'),
+             Disk.TYPE_SSD, Disk.RPM_NON_ROTATING_MEDIUM, Disk.LINK_TYPE_SAS)]
+
+        # Only getrandbits() gives the same numbers on python 2 and 3.
+        def below(number):
+            return rng.getrandbits(48) % number
+
+        def vpd83():
+            return '50%014x' % rng.getrandbits(56)
+
+        self.trans_begin()
+        if self.sim_syss():
+            self.trans_rollback()
+            raise LsmError(
+                ErrorNumber.INVALID_ARGUMENT,
+                "State file %s is not empty" % self.statefile)
+        self._sim_sys_add()
+
+        # Disks of a pool share a profile.
+        pool_disk_count = int_div(disks, pools)
+        disk_rows = []
+        for sim_disk_id in range(1, disks + 1):
+            pool_index = min(int_div(sim_disk_id - 1, pool_disk_count),
+                             pools - 1)
+            (prefix, size, disk_type, rpm, link_type) = disk_profiles[
+                pool_index % len(disk_profiles)]
+            disk_rows.append(
+                (sim_disk_id, prefix, size, disk_type, Disk.STATUS_OK,
+                 vpd83(), rpm, link_type,
+                 "Port: %d Box: %d Bay: %d" %
+                 (sim_disk_id % 24, int_div(sim_disk_id, 24) + 1,
+                  int_div(sim_disk_id, 24 * 16) + 1)))
+        self._data_add_many(
+            'disks', ('id', 'disk_prefix', 'total_space', 'disk_type',
+                      'status', 'vpd83', 'rpm', 'link_type', 'location'),
+            disk_rows)
+
+        for pool_index in range(pools):
+            sim_disk_ids = list(range(
+                pool_index * pool_disk_count + 1,
+                disks + 1 if pool_index == pools - 1 else
+                (pool_index + 1) * pool_disk_count + 1))
+            raid_types = [
+                t for t in (Volume.RAID_TYPE_RAID0, Volume.RAID_TYPE_RAID1,
+                            Volume.RAID_TYPE_RAID5, Volume.RAID_TYPE_RAID6,
+                            Volume.RAID_TYPE_RAID10)
+                if PoolRAID._RAID_DISK_CHK[t](len(sim_disk_ids))]
+            raid_type = raid_types[below(len(raid_types))]
+            self.sim_pool_create_from_disk(
+                name='Pool %d' % (pool_index + 1),
+                sim_disk_ids=sim_disk_ids, raid_type=raid_type,
+                element_type=Pool.ELEMENT_TYPE_FS |
+                Pool.ELEMENT_TYPE_VOLUME | Pool.ELEMENT_TYPE_DELTA)
+
+        # Volume i and file system i are allocated from pool i % pools.
+        sizes = {}
+        for sim_pool in self.sim_pools():
+            share = int_div(
+                int_div(sim_pool['free_space'], 2),
+                max(1, int_div(volumes + pools - sim_pool['id'], pools) +
+                    int_div(fss + pools - sim_pool['id'], pools)))
+            if share < BackStore.BLK_SIZE:
+                self.trans_rollback()
+                raise LsmError(
+                    ErrorNumber.NOT_ENOUGH_SPACE,
+                    "Not enough disks for %d volumes and %d file systems" %
+                    (volumes, fss))
+            sizes[sim_pool['id']] = int_div(share, BackStore.BLK_SIZE)
+
+        def size_of(index):
+            blocks = sizes[index % pools + 1]
+            return (blocks - below(int_div(blocks + 1, 2))) * \
+                BackStore.BLK_SIZE
+
+        def vol_rows():
+            for sim_vol_id in range(1, volumes + 1):
+                size = size_of(sim_vol_id - 1)
+                yield (sim_vol_id, vpd83(), 'volume_%d' % sim_vol_id, size,
+                       size, Volume.ADMIN_STATE_ENABLED, 0,
+                       BackStore.DEFAULT_WRITE_CACHE_POLICY,
+                       BackStore.DEFAULT_READ_CACHE_POLICY,
+                       BackStore.DEFAULT_PHYSICAL_DISK_CACHE,
+                       (sim_vol_id - 1) % pools + 1)
+
+        self._data_add_many(
+            'volumes', ('id', 'vpd83', 'name', 'total_space',
+                        'consumed_size', 'admin_state', 'is_hw_raid_vol',
+                        'write_cache_policy', 'read_cache_policy',
+                        'phy_disk_cache', 'pool_id'),
+            vol_rows())
+
+        def fs_rows():
+            for sim_fs_id in range(1, fss + 1):
+                size = size_of(sim_fs_id - 1)
+                yield (sim_fs_id, 'fs_%d' % sim_fs_id, size, size, size,
+                       (sim_fs_id - 1) % pools + 1)
+
+        self._data_add_many(
+            'fss', ('id', 'name', 'total_space', 'consumed_size',
+                    'free_space', 'pool_id'),
+            fs_rows())
+
+        self._data_add_many(
+            'ags', ('id', 'name'),
+            ((sim_ag_id, 'ag_%d' % sim_ag_id)
+             for sim_ag_id in range(1, ags + 1)))
+
+        # Access groups of odd id get iSCSI initiators, the others WWPNs.
+        def init_rows():
+            for init_index in range(inits):
+                sim_ag_id = init_index % ags + 1
+                if sim_ag_id % 2:
+                    yield ('iqn.2017-01.com.example:sim-%08d' % init_index,
+                           AccessGroup.INIT_TYPE_ISCSI_IQN, sim_ag_id)
+                else:
+                    wwpn = '%016x' % (0x5001438000000000 + init_index)
+                    yield (':'.join(wwpn[i:i + 2] for i in range(0, 16, 2)),
+                           AccessGroup.INIT_TYPE_WWPN, sim_ag_id)
+
+        self._data_add_many(
+            'inits', ('id', 'init_type', 'owner_ag_id'), init_rows())
+
+        # Every volume in turn is masked to a further access group, starting
+        # from a random one.
+        ag_offsets = [below(ags) for _ in range(
+            min(volumes, masks))]
+
+        def mask_rows():
+            for mask_index in range(masks):
+                vol_index = mask_index % volumes
+                yield (vol_index + 1,
+                       (ag_offsets[vol_index] +
+                        int_div(mask_index, volumes)) % ags + 1)
+
+        self._data_add_many('vol_masks', ('vol_id', 'ag_id'), mask_rows())
+
+        self._data_add_many(
+            'fs_snaps', ('id', 'name', 'fs_id', 'timestamp'),
+            ((sim_fs_snap_id, 'fs_snap_%d' % sim_fs_snap_id,
+              (sim_fs_snap_id - 1) % fss + 1,
+              BackStore._GENERATE_TIMESTAMP + sim_fs_snap_id)
+             for sim_fs_snap_id in range(1, fs_snaps + 1)))
+
+        self._data_add_many(
+            'exps', ('id', 'fs_id', 'exp_path', 'auth_type', 'anon_uid',
+                     'anon_gid', 'options'),
+            ((sim_exp_id, (sim_exp_id - 1) % fss + 1,
+              '/nfs_exp_%d' % sim_exp_id, 'standard',
+              NfsExport.ANON_UID_GID_NA, NfsExport.ANON_UID_GID_NA, '')
+             for sim_exp_id in range(1, exps + 1)))
+        self._data_add_many(
+            'exp_rw_hosts', ('host', 'exp_id'),
+            (('host%d.example.com' % (below(254) + 1), sim_exp_id)
+             for sim_exp_id in range(1, exps + 1)))
+
+        self.trans_commit()
+
+    def sim_copy_to(self, bs_obj):
         """
-        Execute sql command and get all output.
+        Copy the whole state into bs_obj, which holds no data yet.
+        """
+        bs_obj.trans_begin()
+        # Tables are created in the order of their foreign keys.
+        for sim_table in self._sql_exec(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND "
+                "name NOT LIKE 'sqlite_%' ORDER BY rowid;"):
+            sql_cur = self._sql_iter("SELECT * FROM %s;" % sim_table['name'])
+            keys = [column[0] for column in sql_cur.description]
+            bs_obj._data_add_many(
+                sim_table['name'], keys,
+                (tuple(row[k] for k in keys) for row in sql_cur))
+        # The triggers added the space of volumes and others on top.
+        bs_obj.sim_pools_space_recount()
+        bs_obj.trans_commit()
+
+    def _sql_exec(self, sql_cmd, params=()):
+        """
+        Execute sql command with the values of its '?' placeholders in
+        params and get all output.  Values are never formatted into the
+        command, so that sqlite3 can reuse the statement it prepared for
+        the same command.
         """
         sql_cur = self.sql_conn.cursor()
-        sql_cur.execute(sql_cmd)
+        sql_cur.execute(sql_cmd, params)
         self.lastrowid = sql_cur.lastrowid
         return sql_cur.fetchall()
 
+    def _sql_iter(self, sql_cmd, params=()):
+        """
+        Execute sql command with params like _sql_exec() and return a
+        cursor to iterate the output without fetching all of it first.
+        """
+        sql_cur = self.sql_conn.cursor()
+        sql_cur.execute(sql_cmd, params)
+        return sql_cur
+
     def _get_table(self, table_name):
         sql_cmd = "SELECT * FROM %s" % table_name
         return self._sql_exec(sql_cmd)
 
+    @staticmethod
+    def _select_cmd(table_name, condition=None):
+        sql_cmd = "SELECT * FROM %s" % table_name
+        if condition is not None:
+            sql_cmd += " WHERE %s" % condition
+        return sql_cmd
+
     def trans_begin(self):
-        self.sql_conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+        if not self._in_batch:
+            self.sql_conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+
+    def trans_begin_read(self):
+        """
+        Begin a transaction which only reads the state.  It takes no lock
+        until the first read and, in WAL journal mode, none at all.
+        """
+        if not self._in_batch:
+            self.sql_conn.execute("BEGIN DEFERRED TRANSACTION;")
 
     def trans_commit(self):
-        self.sql_conn.commit()
+        if not self._in_batch:
+            self.sql_conn.commit()
 
     def trans_rollback(self):
-        self.sql_conn.rollback()
+        if not self._in_batch:
+            self.sql_conn.rollback()
+
+    def time_out_set(self, timeout):
+        """
+        Change how long to wait for the lock on the state file, in
+        milliseconds.  The state in memory is kept.
+        """
+        self.sql_conn.execute("PRAGMA busy_timeout = %d;" % int(timeout))
+
+    def close(self):
+        self.sql_conn.close()
+
+    def batch(self, calls):
+        """
+        Runs calls, a list of functions returning a dict with an 'error' key
+        on failure, in a single transaction so that the state file is only
+        synced once.  Each call runs in a savepoint of its own and a failed
+        call only rolls back its own changes.  The trans_*() methods do
+        nothing meanwhile.
+        """
+        # Python sqlite3 would commit before a SAVEPOINT statement in its
+        # default mode, take care of the transaction ourselves.
+        self.sql_conn.isolation_level = None
+        self._in_batch = True
+        try:
+            self.sql_conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+            results = []
+            try:
+                for call in calls:
+                    self.sql_conn.execute("SAVEPOINT batch_call;")
+                    rc = call()
+                    if 'error' in rc:
+                        self.sql_conn.execute("ROLLBACK TO batch_call;")
+                    self.sql_conn.execute("RELEASE batch_call;")
+                    results.append(rc)
+                self.sql_conn.execute("COMMIT;")
+            except Exception:
+                self.sql_conn.execute("ROLLBACK;")
+                raise
+            return results
+        finally:
+            self._in_batch = False
+            self.sql_conn.isolation_level = "IMMEDIATE"
 
     def _data_add(self, table_name, data_dict):
-        keys = list(data_dict.keys())
-        values = ['' if v is None else str(v) for v in list(data_dict.values())]
+        keys = sorted(data_dict.keys())
+        values = tuple('' if data_dict[k] is None else data_dict[k]
+                       for k in keys)
+
+        sql_cmd = "INSERT INTO %s (%s) VALUES (%s);" % \
+                  (table_name, ", ".join(keys), ", ".join(["?"] * len(keys)))
+        self._sql_exec(sql_cmd, values)
 
+    def _data_add_many(self, table_name, keys, rows):
+        """
+        Insert the tuples of values in the order of keys from the rows
+        iterable, all with the same prepared statement.
+        """
         sql_cmd = "INSERT INTO %s (%s) VALUES (%s);" % \
-                  (table_name,
-                   "'%s'" % ("', '".join(keys)),
-                   "'%s'" % ("', '".join(values)))
-        self._sql_exec(sql_cmd)
+                  (table_name, ", ".join(keys), ", ".join(["?"] * len(keys)))
+        self.sql_conn.executemany(sql_cmd, rows)
 
-    def _data_find(self, table, condition, flag_unique=False):
+    def _data_find(self, table, condition, params=(), flag_unique=False):
         sql_cmd = "SELECT * FROM %s WHERE %s" % (table, condition)
-        sim_datas = self._sql_exec(sql_cmd)
+        sim_datas = self._sql_exec(sql_cmd, params)
         if flag_unique:
             if len(sim_datas) == 0:
                 return None
@@ -1070,24 +1531,26 @@ def _data_update(self, table, data_id, column_name, value):
         if value is None:
             value = ''
 
-        sql_cmd = "UPDATE %s SET %s='%s' WHERE id='%s'" % \
-            (table, column_name, value, data_id)
+        sql_cmd = "UPDATE %s SET %s=? WHERE id=?" % (table, column_name)
 
-        self._sql_exec(sql_cmd)
+        self._sql_exec(sql_cmd, (value, data_id))
 
-    def _data_delete(self, table, condition):
+    def _data_delete(self, table, condition, params=()):
         sql_cmd = "DELETE FROM %s WHERE %s;" % (table, condition)
-        self._sql_exec(sql_cmd)
+        self._sql_exec(sql_cmd, params)
 
-    def sim_job_create(self, job_data_type=None, data_id=None):
+    def sim_job_create(self, job_data_type=None, data_id=None,
+                       extra_duration=0):
         """
-        Return a job id(Integer)
+        Return a job id(Integer).  The job takes LSM_SIM_TIME plus
+        extra_duration seconds.
         """
         self._data_add(
             "jobs",
             {
-                "duration": os.getenv(
-                    "LSM_SIM_TIME", BackStore.JOB_DEFAULT_DURATION),
+                "duration": float(os.getenv(
+                    "LSM_SIM_TIME", BackStore.JOB_DEFAULT_DURATION)) +
+                extra_duration,
                 "timestamp": time.time(),
                 "data_type": job_data_type,
                 "data_id": data_id,
@@ -1095,14 +1558,26 @@ def sim_job_create(self, job_data_type=None, data_id=None):
         return self.lastrowid
 
     def sim_job_delete(self, sim_job_id):
-        self._data_delete('jobs', 'id="%s"' % sim_job_id)
+        self._data_delete('jobs', 'id=?', (sim_job_id,))
+
+    def sim_job_time_left(self, sim_job_id):
+        """
+        Return the number of seconds until the job completes.
+        """
+        sim_job = self._data_find('jobs', 'id=?', (sim_job_id,),
+                                  flag_unique=True)
+        if sim_job is None:
+            raise LsmError(
+                ErrorNumber.NOT_FOUND_JOB, "Job not found")
+        return max(float(sim_job['timestamp']) + sim_job['duration'] -
+                   time.time(), 0)
 
     def sim_job_status(self, sim_job_id):
         """
         Return (progress, data_type, data) tuple.
         progress is the integer of percent.
         """
-        sim_job = self._data_find('jobs', 'id=%s' % sim_job_id,
+        sim_job = self._data_find('jobs', 'id=?', (sim_job_id,),
                                   flag_unique=True)
         if sim_job is None:
             raise LsmError(
@@ -1142,19 +1617,23 @@ def lsm_disk_ids_of_pool(self, sim_pool_id):
         return list(
             d['lsm_disk_id']
             for d in self._data_find(
-                'disks_view', 'owner_pool_id="%s"' % sim_pool_id))
+                'disks_view', 'owner_pool_id=?', (sim_pool_id,)))
 
-    def sim_disks(self):
+    def sim_disks(self, condition=None, params=()):
         """
-        Return a list of sim_disk dict.
+        Return a list of sim_disk dict, only those matching the SQL condition
+        with params if defined.
         """
-        return self._get_table('disks_view')
+        return self._sql_exec(
+            BackStore._select_cmd('disks_view', condition), params)
 
-    def sim_pools(self):
+    def sim_pools(self, condition=None, params=()):
         """
-        Return a list of sim_pool dict.
+        Return a list of sim_pool dict, only those matching the SQL condition
+        with params if defined.
         """
-        return self._get_table('pools_view')
+        return self._sql_exec(
+            BackStore._select_cmd('pools_view', condition), params)
 
     def sim_pool_of_id(self, sim_pool_id):
         return self._sim_data_of_id(
@@ -1200,6 +1679,10 @@ def sim_pool_create_from_disk(self, name, sim_disk_ids, raid_type,
             self._data_update(
                 'disks', sim_disk_id, 'role', 'PARITY')
 
+        self._sql_exec(
+            "UPDATE pools SET total_space = %s WHERE id=?;" %
+            BackStore._POOL_DATA_SPACE, (sim_pool_id,))
+
         return sim_pool_id
 
     def sim_pool_create_sub_pool(self, name, parent_pool_id, size,
@@ -1219,15 +1702,46 @@ def sim_pool_create_sub_pool(self, name, parent_pool_id, size,
             })
         return self.lastrowid
 
+    def sim_pools_check(self):
+        """
+        Return a list of (sim_pool_id, column, stored value, expected value)
+        for the space counters of pools which differ from the sum of the
+        disks, volumes, file systems and sub-pools they account for.
+        """
+        rc = []
+        for p in self._sql_exec(
+                "SELECT id, parent_pool_id, total_space, consumed_space, "
+                "%s data_space, %s expected_consumed_space FROM pools;" %
+                (BackStore._POOL_DATA_SPACE, BackStore._POOL_CONSUMED_SPACE)):
+            if p['parent_pool_id'] is None and \
+               p['total_space'] != p['data_space']:
+                rc.append((p['id'], 'total_space', p['total_space'],
+                           p['data_space']))
+            if p['consumed_space'] != p['expected_consumed_space']:
+                rc.append((p['id'], 'consumed_space', p['consumed_space'],
+                           p['expected_consumed_space']))
+        return rc
+
+    def sim_pools_space_recount(self):
+        """
+        Recompute the space counters of all pools.
+        """
+        self._sql_exec(
+            "UPDATE pools SET total_space = %s WHERE parent_pool_id IS NULL;"
+            % BackStore._POOL_DATA_SPACE)
+        self._sql_exec(
+            "UPDATE pools SET consumed_space = %s;" %
+            BackStore._POOL_CONSUMED_SPACE)
+
     def sim_pool_disks_count(self, sim_pool_id):
         return self._sql_exec(
-            "SELECT COUNT(id) FROM disks WHERE owner_pool_id=%s;" %
-            sim_pool_id)[0][0]
+            "SELECT COUNT(id) FROM disks WHERE owner_pool_id=?;",
+            (sim_pool_id,))[0][0]
 
     def sim_pool_data_disks_count(self, sim_pool_id=None):
         return self._sql_exec(
             "SELECT COUNT(id) FROM disks WHERE "
-            "owner_pool_id=%s and role='DATA';" % sim_pool_id)[0][0]
+            "owner_pool_id=? and role='DATA';", (sim_pool_id,))[0][0]
 
     def sim_vols(self, sim_ag_id=None):
         """
@@ -1235,13 +1749,21 @@ def sim_vols(self, sim_ag_id=None):
         """
         if sim_ag_id:
             return self._data_find(
-                'volumes_by_ag_view', 'ag_id=%s' % sim_ag_id)
+                'volumes_by_ag_view', 'ag_id=?', (sim_ag_id,))
         else:
             return self._get_table('volumes_view')
 
+    def sim_vols_iter(self, condition=None, params=()):
+        """
+        Return an iterator of sim_vol dict, only those matching the SQL
+        condition with params if defined.
+        """
+        return self._sql_iter(
+            BackStore._select_cmd('volumes_view', condition), params)
+
     def _sim_data_of_id(self, table_name, data_id, lsm_error_no, data_name):
         sim_data = self._data_find(
-            table_name, 'id=%s' % data_id, flag_unique=True)
+            table_name, 'id=?', (data_id,), flag_unique=True)
         if sim_data is None:
             if lsm_error_no:
                 raise LsmError(
@@ -1317,16 +1839,15 @@ def sim_vol_delete(self, sim_vol_id):
                         "Requested volume is a replication source")
         if sim_vol['is_hw_raid_vol']:
             # Delete the parent pool instead if found a HW RAID volume.
-            self._data_delete("pools", 'id="%s"' % sim_vol['pool_id'])
+            self._data_delete("pools", 'id=?', (sim_vol['pool_id'],))
         else:
-            self._data_delete("volumes", 'id="%s"' % sim_vol_id)
+            self._data_delete("volumes", 'id=?', (sim_vol_id,))
 
     def sim_vol_mask(self, sim_vol_id, sim_ag_id):
         self.sim_vol_of_id(sim_vol_id)
         self.sim_ag_of_id(sim_ag_id)
         exist_mask = self._data_find(
-            'vol_masks', 'ag_id="%s" AND vol_id="%s"' %
-            (sim_ag_id, sim_vol_id))
+            'vol_masks', 'ag_id=? AND vol_id=?', (sim_ag_id, sim_vol_id))
         if exist_mask:
             raise LsmError(
                 ErrorNumber.NO_STATE_CHANGE,
@@ -1340,10 +1861,11 @@ def sim_vol_mask(self, sim_vol_id, sim_ag_id):
     def sim_vol_unmask(self, sim_vol_id, sim_ag_id):
         self.sim_vol_of_id(sim_vol_id)
         self.sim_ag_of_id(sim_ag_id)
-        condition = 'ag_id="%s" AND vol_id="%s"' % (sim_ag_id, sim_vol_id)
-        exist_mask = self._data_find('vol_masks', condition)
+        condition = 'ag_id=? AND vol_id=?'
+        params = (sim_ag_id, sim_vol_id)
+        exist_mask = self._data_find('vol_masks', condition, params)
         if exist_mask:
-            self._data_delete('vol_masks', condition)
+            self._data_delete('vol_masks', condition, params)
         else:
             raise LsmError(
                 ErrorNumber.NO_STATE_CHANGE,
@@ -1353,12 +1875,12 @@ def sim_vol_unmask(self, sim_vol_id, sim_ag_id):
     def _sim_vol_ids_of_masked_ag(self, sim_ag_id):
         return list(
             m['vol_id'] for m in self._data_find(
-                'vol_masks', 'ag_id="%s"' % sim_ag_id))
+                'vol_masks', 'ag_id=?', (sim_ag_id,)))
 
     def _sim_ag_ids_of_masked_vol(self, sim_vol_id):
         return list(
             m['ag_id'] for m in self._data_find(
-                'vol_masks', 'vol_id="%s"' % sim_vol_id))
+                'vol_masks', 'vol_id=?', (sim_vol_id,)))
 
     def sim_vol_resize(self, sim_vol_id, new_size_bytes):
         org_new_size_bytes = new_size_bytes
@@ -1408,7 +1930,7 @@ def dst_sim_vol_ids_of_src(self, src_sim_vol_id):
         self.sim_vol_of_id(src_sim_vol_id)
         return list(
             d['dst_vol_id'] for d in self._data_find(
-                'vol_reps', 'src_vol_id="%s"' % src_sim_vol_id))
+                'vol_reps', 'src_vol_id=?', (src_sim_vol_id,)))
 
     def sim_vol_replica(self, src_sim_vol_id, dst_sim_vol_id, rep_type,
                         blk_ranges=None):
@@ -1419,7 +1941,7 @@ def sim_vol_replica(self, src_sim_vol_id, dst_sim_vol_id, rep_type,
         #                type.
         cur_src_sim_vol_ids = list(
             r['src_vol_id'] for r in self._data_find(
-                'vol_reps', 'dst_vol_id="%s"' % dst_sim_vol_id))
+                'vol_reps', 'dst_vol_id=?', (dst_sim_vol_id,)))
         if len(cur_src_sim_vol_ids) == 1 and \
            cur_src_sim_vol_ids[0] == src_sim_vol_id:
             # src and dst match. Maybe user are overriding old setting.
@@ -1451,7 +1973,7 @@ def sim_vol_src_replica_break(self, src_sim_vol_id):
                 "Provided volume is not a replication source")
 
         self._data_delete(
-            'vol_reps', 'src_vol_id="%s"' % src_sim_vol_id)
+            'vol_reps', 'src_vol_id=?', (src_sim_vol_id,))
 
     def sim_vol_state_change(self, sim_vol_id, new_admin_state):
         sim_vol = self.sim_vol_of_id(sim_vol_id)
@@ -1476,7 +1998,7 @@ def _sim_ag_format(sim_ag):
     def sim_ags(self, sim_vol_id=None):
         if sim_vol_id:
             sim_ags = self._data_find(
-                'ags_by_vol_view', 'vol_id=%s' % sim_vol_id)
+                'ags_by_vol_view', 'vol_id=?', (sim_vol_id,))
         else:
             sim_ags = self._get_table('ags_view')
 
@@ -1523,7 +2045,7 @@ def sim_ag_delete(self, sim_ag_id):
                 ErrorNumber.IS_MASKED,
                 "Access group has volume masked to")
 
-        self._data_delete('ags', 'id="%s"' % sim_ag_id)
+        self._data_delete('ags', 'id=?', (sim_ag_id,))
 
     def sim_ag_init_add(self, sim_ag_id, init_id, init_type):
         sim_ag = self.sim_ag_of_id(sim_ag_id)
@@ -1552,7 +2074,7 @@ def sim_ag_init_delete(self, sim_ag_id, init_id):
                 ErrorNumber.LAST_INIT_IN_ACCESS_GROUP,
                 "Refused to remove the last initiator from access group")
 
-        self._data_delete('inits', 'id="%s"' % init_id)
+        self._data_delete('inits', 'id=?', (init_id,))
 
     def sim_ag_of_id(self, sim_ag_id):
         sim_ag = self._sim_data_of_id(
@@ -1567,6 +2089,14 @@ def sim_fss(self):
         """
         return self._get_table('fss_view')
 
+    def sim_fss_iter(self, condition=None, params=()):
+        """
+        Return an iterator of sim_fs dict, only those matching the SQL
+        condition with params if defined.
+        """
+        return self._sql_iter(
+            BackStore._select_cmd('fss_view', condition), params)
+
     def sim_fs_of_id(self, sim_fs_id, raise_error=True):
         lsm_error_no = ErrorNumber.NOT_FOUND_FS
         if not raise_error:
@@ -1608,14 +2138,14 @@ def sim_fs_delete(self, sim_fs_id):
                 ErrorNumber.PLUGIN_BUG,
                 "Requested file system has snapshot attached")
 
-        if self._data_find('exps', 'fs_id="%s"' % sim_fs_id):
+        if self._data_find('exps', 'fs_id=?', (sim_fs_id,)):
             # TODO(Gris Ge): API does not have dedicate error for this
             #                scenario
             raise LsmError(
                 ErrorNumber.PLUGIN_BUG,
                 "Requested file system is exported via NFS")
 
-        self._data_delete("fss", 'id="%s"' % sim_fs_id)
+        self._data_delete("fss", 'id=?', (sim_fs_id,))
 
     def sim_fs_resize(self, sim_fs_id, new_size_bytes):
         org_new_size_bytes = new_size_bytes
@@ -1649,7 +2179,7 @@ def sim_fs_resize(self, sim_fs_id, new_size_bytes):
 
     def sim_fs_snaps(self, sim_fs_id):
         self.sim_fs_of_id(sim_fs_id)
-        return self._data_find('fs_snaps_view', 'fs_id="%s"' % sim_fs_id)
+        return self._data_find('fs_snaps_view', 'fs_id=?', (sim_fs_id,))
 
     def sim_fs_snap_of_id(self, sim_fs_snap_id, sim_fs_id=None):
         sim_fs_snap = self._sim_data_of_id(
@@ -1690,11 +2220,10 @@ def sim_fs_snap_restore(self, sim_fs_id, sim_fs_snap_id, files,
     def sim_fs_snap_delete(self, sim_fs_snap_id, sim_fs_id):
         self.sim_fs_of_id(sim_fs_id)
         self.sim_fs_snap_of_id(sim_fs_snap_id, sim_fs_id)
-        self._data_delete('fs_snaps', 'id="%s"' % sim_fs_snap_id)
+        self._data_delete('fs_snaps', 'id=?', (sim_fs_snap_id,))
 
     def sim_fs_snap_del_by_fs(self, sim_fs_id):
-        sql_cmd = "DELETE FROM fs_snaps WHERE fs_id='%s';" % sim_fs_id
-        self._sql_exec(sql_cmd)
+        self._data_delete('fs_snaps', 'fs_id=?', (sim_fs_id,))
 
     def sim_fs_clone(self, src_sim_fs_id, dst_sim_fs_id, sim_fs_snap_id):
         self.sim_fs_of_id(src_sim_fs_id)
@@ -1729,10 +2258,10 @@ def clone_dst_sim_fs_ids_of_src(self, src_sim_fs_id):
         self.sim_fs_of_id(src_sim_fs_id)
         return list(
             d['dst_fs_id'] for d in self._data_find(
-                'fs_clones', 'src_fs_id="%s"' % src_sim_fs_id))
+                'fs_clones', 'src_fs_id=?', (src_sim_fs_id,)))
 
     def sim_fs_src_clone_break(self, src_sim_fs_id):
-        self._data_delete('fs_clones', 'src_fs_id="%s"' % src_sim_fs_id)
+        self._data_delete('fs_clones', 'src_fs_id=?', (src_sim_fs_id,))
 
     def _sim_exp_format(self, sim_exp):
         for key_name in ['root_hosts', 'rw_hosts', 'ro_hosts']:
@@ -1807,7 +2336,7 @@ def sim_exp_create(self, sim_fs_id, exp_path, root_hosts, rw_hosts,
 
     def sim_exp_delete(self, sim_exp_id):
         self.sim_exp_of_id(sim_exp_id)
-        self._data_delete('exps', 'id="%s"' % sim_exp_id)
+        self._data_delete('exps', 'id=?', (sim_exp_id,))
 
     def sim_tgts(self):
         """
@@ -1838,13 +2367,42 @@ class SimArray(object):
     SIM_DATA_FILE = os.getenv("LSM_SIM_DATA",
                               tempfile.gettempdir() + '/lsm_sim_data')
 
+    @staticmethod
+    def _sim_id_of_lsm_id(lsm_id):
+        """
+        Return the sim id the lsm id ends with, raise ValueError if none.
+        """
+        return int(lsm_id[len(lsm_id.rstrip(string.digits)):])
+
     @staticmethod
     def _lsm_id_to_sim_id(lsm_id, lsm_error):
         try:
-            return int(lsm_id[-BackStore._ID_FMT_LEN:])
+            return SimArray._sim_id_of_lsm_id(lsm_id)
         except ValueError:
             raise lsm_error
 
+    @staticmethod
+    def _search_condition(search_key, search_value, id_columns):
+        """
+        Return (condition, params), the SQL condition selecting the data
+        whose search_key property might be search_value and the values of
+        its placeholders, or (None, ()) to select everything.  The
+        id_columns is a dict of search key => column holding the sim id of
+        that lsm id.  Caller should still check the exact value of the
+        property.
+        """
+        if search_key is None:
+            return (None, ())
+        if search_key == 'system_id':
+            if search_value == BackStore.SYS_ID:
+                return (None, ())
+            return ('0', ())
+        try:
+            return ('%s=?' % id_columns[search_key],
+                    (SimArray._sim_id_of_lsm_id(search_value),))
+        except (ValueError, TypeError, AttributeError):
+            return ('0', ())
+
     @staticmethod
     def _sim_job_id_of(job_id):
         return SimArray._lsm_id_to_sim_id(
@@ -1889,18 +2447,56 @@ def _sim_ag_id_of(ag_id):
                 "File system export not found"))
 
     @_handle_errors
-    def __init__(self, statefile, timeout):
+    def __init__(self, statefile, timeout, wal=False, snapshot=None,
+                 profile=None):
+        """
+        With the statefile BackStore.MEMORY_STATEFILE the state only lives
+        as long as this SimArray.  It starts as a copy of the snapshot
+        file if there is one, and close() writes it back there.  The
+        SimProfile profile, if any, lengthens the jobs.
+        """
         if statefile is None:
             statefile = SimArray.SIM_DATA_FILE
 
-        self.bs_obj = BackStore(statefile, timeout)
-        self.bs_obj.check_version_and_init()
+        self.profile = profile
+
+        self.bs_obj = BackStore(statefile, timeout, wal=wal)
         self.statefile = statefile
         self.timeout = timeout
+        self.snapshot = None
+        if statefile == BackStore.MEMORY_STATEFILE and snapshot is not None:
+            self.snapshot = snapshot
+            if os.path.exists(snapshot):
+                snap_bs_obj = BackStore(snapshot, timeout)
+                snap_bs_obj.check_version_and_init()
+                snap_bs_obj.sim_copy_to(self.bs_obj)
+                snap_bs_obj.close()
+        self.bs_obj.check_version_and_init()
+
+    @_handle_errors
+    def close(self):
+        if self.snapshot is not None:
+            # Replace the snapshot at once, it might be in use by others.
+            (tmp_fd, tmp_file) = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.snapshot)))
+            os.close(tmp_fd)
+            try:
+                os.chmod(tmp_file, 0o666)
+                snap_bs_obj = BackStore(tmp_file, self.timeout)
+                self.bs_obj.sim_copy_to(snap_bs_obj)
+                snap_bs_obj.close()
+                os.rename(tmp_file, self.snapshot)
+            except Exception:
+                os.unlink(tmp_file)
+                raise
+        self.bs_obj.close()
 
     def _job_create(self, data_type=None, sim_data_id=None):
+        extra_duration = 0
+        if self.profile is not None:
+            extra_duration = self.profile.job_duration()
         sim_job_id = self.bs_obj.sim_job_create(
-            data_type, sim_data_id)
+            data_type, sim_data_id, extra_duration)
         return "JOB_ID_%0*d" % (BackStore._ID_FMT_LEN, sim_job_id)
 
     @_handle_errors
@@ -1923,6 +2519,14 @@ def job_status(self, job_id, flags=0):
 
         return (status, progress, data)
 
+    @_handle_errors
+    def job_time_left(self, job_id):
+        return self.bs_obj.sim_job_time_left(SimArray._sim_job_id_of(job_id))
+
+    @_handle_errors
+    def batch(self, calls):
+        return self.bs_obj.batch(calls)
+
     @_handle_errors
     def job_free(self, job_id, flags=0):
         self.bs_obj.trans_begin()
@@ -1932,7 +2536,7 @@ def job_free(self, job_id, flags=0):
 
     @_handle_errors
     def time_out_set(self, ms, flags=0):
-        self.bs_obj = BackStore(self.statefile, int(int_div(ms, 1000)))
+        self.bs_obj.time_out_set(ms)
         self.timeout = ms
         return None
 
@@ -1977,9 +2581,13 @@ def _sim_vol_2_lsm(sim_vol):
                       sim_vol['lsm_pool_id'])
 
     @_handle_errors
-    def volumes(self):
-        return list(
-            SimArray._sim_vol_2_lsm(v) for v in self.bs_obj.sim_vols())
+    def volumes(self, search_key=None, search_value=None):
+        (condition, params) = SimArray._search_condition(
+            search_key, search_value, {'id': 'id', 'pool_id': 'pool_id'})
+        return search_property(
+            (SimArray._sim_vol_2_lsm(v)
+             for v in self.bs_obj.sim_vols_iter(condition, params)),
+            search_key, search_value)
 
     @staticmethod
     def _sim_pool_2_lsm(sim_pool):
@@ -1997,12 +2605,15 @@ def _sim_pool_2_lsm(sim_pool):
             free_space, status, status_info, sys_id)
 
     @_handle_errors
-    def pools(self, flags=0):
-        self.bs_obj.trans_begin()
-        sim_pools = self.bs_obj.sim_pools()
+    def pools(self, search_key=None, search_value=None, flags=0):
+        (condition, params) = SimArray._search_condition(
+            search_key, search_value, {'id': 'id'})
+        self.bs_obj.trans_begin_read()
+        sim_pools = self.bs_obj.sim_pools(condition, params)
         self.bs_obj.trans_rollback()
-        return list(
-            SimArray._sim_pool_2_lsm(sim_pool) for sim_pool in sim_pools)
+        return search_property(
+            [SimArray._sim_pool_2_lsm(sim_pool) for sim_pool in sim_pools],
+            search_key, search_value)
 
     @staticmethod
     def _sim_disk_2_lsm(sim_disk):
@@ -2020,10 +2631,13 @@ def _sim_disk_2_lsm(sim_disk):
             _rpm=sim_disk['rpm'], _link_type=sim_disk['link_type'])
 
     @_handle_errors
-    def disks(self):
-        return list(
-            SimArray._sim_disk_2_lsm(sim_disk)
-            for sim_disk in self.bs_obj.sim_disks())
+    def disks(self, search_key=None, search_value=None):
+        (condition, params) = SimArray._search_condition(
+            search_key, search_value, {'id': 'id'})
+        return search_property(
+            [SimArray._sim_disk_2_lsm(sim_disk)
+             for sim_disk in self.bs_obj.sim_disks(condition, params)],
+            search_key, search_value)
 
     @_handle_errors
     def volume_create(self, pool_id, vol_name, size_bytes, thinp, flags=0,
@@ -2177,8 +2791,13 @@ def _sim_fs_2_lsm(sim_fs):
                           sim_fs['lsm_pool_id'], BackStore.SYS_ID)
 
     @_handle_errors
-    def fs(self):
-        return list(SimArray._sim_fs_2_lsm(f) for f in self.bs_obj.sim_fss())
+    def fs(self, search_key=None, search_value=None):
+        (condition, params) = SimArray._search_condition(
+            search_key, search_value, {'id': 'id', 'pool_id': 'pool_id'})
+        return search_property(
+            (SimArray._sim_fs_2_lsm(f)
+             for f in self.bs_obj.sim_fss_iter(condition, params)),
+            search_key, search_value)
 
     @_handle_errors
     def fs_create(self, pool_id, fs_name, size_bytes, flags=0,
@@ -2306,7 +2925,7 @@ def fs_snapshot_restore(self, fs_id, snap_id, files, restore_files,
     @_handle_errors
     def fs_child_dependency(self, fs_id, files, flags=0):
         sim_fs_id = SimArray._sim_fs_id_of(fs_id)
-        self.bs_obj.trans_begin()
+        self.bs_obj.trans_begin_read()
         if self.bs_obj.clone_dst_sim_fs_ids_of_src(sim_fs_id) == [] and \
            self.bs_obj.sim_fs_snaps(sim_fs_id) == []:
             self.bs_obj.trans_rollback()
@@ -2320,17 +2939,17 @@ def fs_child_dependency_rm(self, fs_id, files, flags=0):
         Assuming API defination is break all clone relationship and remove
         all snapshot of this source file system.
         """
-        self.bs_obj.trans_begin()
         if self.fs_child_dependency(fs_id, files) is False:
             raise LsmError(
                 ErrorNumber.NO_STATE_CHANGE,
                 "No snapshot or fs clone target found for this file system")
 
+        self.bs_obj.trans_begin()
         src_sim_fs_id = SimArray._sim_fs_id_of(fs_id)
         self.bs_obj.sim_fs_src_clone_break(src_sim_fs_id)
         self.bs_obj.sim_fs_snap_del_by_fs(src_sim_fs_id)
         job_id = self._job_create()
-        self.bs_obj.trans_begin()
+        self.bs_obj.trans_commit()
         return job_id
 
     @staticmethod
@@ -2431,7 +3050,7 @@ def volume_unmask(self, ag_id, vol_id, flags=0):
 
     @_handle_errors
     def volumes_accessible_by_access_group(self, ag_id, flags=0):
-        self.bs_obj.trans_begin()
+        self.bs_obj.trans_begin_read()
 
         sim_vols = self.bs_obj.sim_vols(
             sim_ag_id=SimArray._sim_ag_id_of(ag_id))
@@ -2441,7 +3060,7 @@ def volumes_accessible_by_access_group(self, ag_id, flags=0):
 
     @_handle_errors
     def access_groups_granted_to_volume(self, vol_id, flags=0):
-        self.bs_obj.trans_begin()
+        self.bs_obj.trans_begin_read()
         sim_ags = self.bs_obj.sim_ags(
             sim_vol_id=SimArray._sim_vol_id_of(vol_id))
         self.bs_obj.trans_rollback()
@@ -0,0 +1,273 @@
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Profiles making the simulator behave like a slow array, given with
+"sim://?profile=<file>".  The file holds a JSON object like:
+
+    {
+        "seed": 1,
+        "concurrency": 4,
+        "methods": {
+            "*": {
+                "latency": {"type": "lognormal", "mu": -4.6, "sigma": 0.5}
+            },
+            "volume_create": {
+                "latency": {"type": "uniform", "min": 0.2, "max": 1.0},
+                "error_rate": 0.01,
+                "error": "NETWORK_ERROR",
+                "job_duration": {"type": "fixed", "seconds": 5}
+            }
+        }
+    }
+
+The settings of "*" apply to the methods without settings of their own:
+
+    latency         Seconds each call takes before it runs.
+    error_rate      Share of the calls failing with the error instead of
+                    running, 0 to 1.
+    error           Name of the lsm.ErrorNumber of those, NETWORK_ERROR by
+                    default.
+    job_duration    Seconds the jobs of the call take on top of
+                    LSM_SIM_TIME.
+
+Durations are "fixed" (seconds), "uniform" (min, max) or "lognormal" (mu,
+sigma of the logarithm of the seconds).  "concurrency" limits how many calls
+all the plug-in processes using the same profile file run at once, the
+others wait for their turn up to the timeout of their connection.  A call
+returning a generator keeps its turn until the generator is used up.  The
+turns are lock files in the private directory <file>.slots, the directory
+of the profile file must be writable for it.  "seed" makes the random
+durations and errors repeatable.
+"""
+
+import os
+import json
+import stat
+import time
+import types
+import errno
+import fcntl
+import random
+
+from lsm import LsmError, ErrorNumber
+
+
+class SimProfile(object):
+    # Duration type => (parameters, function returning the seconds)
+    _DURATIONS = {
+        'fixed': (('seconds',), lambda rng, d: d['seconds']),
+        'uniform': (('min', 'max'),
+                    lambda rng, d: rng.uniform(d['min'], d['max'])),
+        'lognormal': (('mu', 'sigma'),
+                      lambda rng, d: rng.lognormvariate(d['mu'], d['sigma'])),
+    }
+    _METHOD_KEYS = ('latency', 'error_rate', 'error', 'job_duration')
+    _DEFAULT_ERROR = 'NETWORK_ERROR'
+    # Seconds between two attempts to get a slot of the concurrency limit.
+    _SLOT_POLL_INTERVAL = 0.01
+
+    def __init__(self, profile_file):
+        try:
+            with open(profile_file) as profile_fd:
+                profile = json.load(profile_fd)
+        except (IOError, OSError, ValueError) as error:
+            raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                           "Failed to load simulator profile %s: %s" %
+                           (profile_file, error))
+        SimProfile._check(profile)
+
+        self._rng = random.Random(profile.get('seed'))
+        self._methods = profile.get('methods', {})
+        # Name of the method running, for job_duration().
+        self._running = None
+
+        # One lock file per call allowed at once, shared by all the
+        # plug-ins using this profile.
+        self._slot_fds = []
+        if profile.get('concurrency'):
+            self._slots_open(os.path.abspath(profile_file) + '.slots',
+                             profile['concurrency'])
+
+    def _slots_open(self, slot_dir, concurrency):
+        """
+        Opens the lock files of the slots in slot_dir, a directory only the
+        plug-in user can write to.
+        """
+        try:
+            try:
+                os.mkdir(slot_dir, 0o700)
+            except OSError as os_error:
+                if os_error.errno != errno.EEXIST:
+                    raise
+            # Someone else could have made it, or a symlink to elsewhere.
+            dir_stat = os.lstat(slot_dir)
+            if not stat.S_ISDIR(dir_stat.st_mode) or \
+               dir_stat.st_uid != os.geteuid() or \
+               dir_stat.st_mode & 0o077:
+                raise LsmError(
+                    ErrorNumber.INVALID_ARGUMENT,
+                    "Simulator profile slot directory %s is not a private "
+                    "directory of the plug-in user" % slot_dir)
+            for slot in range(concurrency):
+                self._slot_fds.append(os.open(
+                    os.path.join(slot_dir, str(slot)),
+                    os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600))
+        except OSError as os_error:
+            self.close()
+            raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                           "Failed to create simulator profile slots in "
+                           "%s: %s" % (slot_dir, os_error))
+        except LsmError:
+            self.close()
+            raise
+
+    @staticmethod
+    def _check(profile):
+        def invalid(msg):
+            return LsmError(ErrorNumber.INVALID_ARGUMENT,
+                            "Invalid simulator profile: %s" % msg)
+
+        def is_number(value):
+            return isinstance(value, (int, float)) and \
+                not isinstance(value, bool)
+
+        if not isinstance(profile, dict):
+            raise invalid("not a JSON object")
+        concurrency = profile.get('concurrency')
+        if concurrency is not None and \
+           not (isinstance(concurrency, int) and concurrency > 0):
+            raise invalid("concurrency should be a positive integer")
+        methods = profile.get('methods', {})
+        if not isinstance(methods, dict):
+            raise invalid("methods should be an object")
+
+        for (method, settings) in methods.items():
+            if not isinstance(settings, dict):
+                raise invalid("settings of %s should be an object" % method)
+            for key in settings:
+                if key not in SimProfile._METHOD_KEYS:
+                    raise invalid("unknown setting %s of %s" % (key, method))
+            for key in ('latency', 'job_duration'):
+                if key not in settings:
+                    continue
+                duration = settings[key]
+                if not isinstance(duration, dict) or \
+                   duration.get('type') not in SimProfile._DURATIONS:
+                    raise invalid(
+                        "%s of %s should have a type out of %s" %
+                        (key, method,
+                         ', '.join(sorted(SimProfile._DURATIONS))))
+                for param in SimProfile._DURATIONS[duration['type']][0]:
+                    if not is_number(duration.get(param)):
+                        raise invalid("%s of %s needs a number %s" %
+                                      (key, method, param))
+            error_rate = settings.get('error_rate', 0)
+            if not is_number(error_rate) or not 0 <= error_rate <= 1:
+                raise invalid("error_rate of %s should be between 0 and 1" %
+                              method)
+            error = settings.get('error', SimProfile._DEFAULT_ERROR)
+            if not isinstance(getattr(ErrorNumber, str(error), None), int):
+                raise invalid("unknown error %s of %s" % (error, method))
+
+    def _settings(self, method):
+        settings = dict(self._methods.get('*', {}))
+        settings.update(self._methods.get(method, {}))
+        return settings
+
+    def _duration(self, duration):
+        if duration is None:
+            return 0
+        return max(0, SimProfile._DURATIONS[duration['type']][1](
+            self._rng, duration))
+
+    def _slot_get(self, timeout):
+        """
+        Wait for a free slot up to timeout seconds, return its lock file.
+        """
+        deadline = time.time() + timeout
+        while True:
+            for slot_fd in self._slot_fds:
+                try:
+                    fcntl.flock(slot_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot_fd
+                except (IOError, OSError):
+                    pass
+            if time.time() >= deadline:
+                raise LsmError(
+                    ErrorNumber.TIMEOUT,
+                    "Simulated array is busy with %d calls" %
+                    len(self._slot_fds))
+            time.sleep(SimProfile._SLOT_POLL_INTERVAL)
+
+    @staticmethod
+    def _slot_put(slot_fd):
+        if slot_fd is not None:
+            fcntl.flock(slot_fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _holding(slot_fd, items):
+        """
+        Generator yielding the items, the slot is given back once they are
+        all yielded or the generator is closed.  It is primed by call(), so
+        that closing it before the first item also gives the slot back.
+        """
+        try:
+            yield None
+            for item in items:
+                yield item
+        finally:
+            SimProfile._slot_put(slot_fd)
+
+    def call(self, method, timeout, func, *args, **kwargs):
+        """
+        Runs func for the plug-in method as the profile says, waiting at
+        most timeout seconds for the concurrency limit.
+        """
+        settings = self._settings(method)
+        slot_fd = None
+        if self._slot_fds:
+            slot_fd = self._slot_get(timeout)
+        try:
+            time.sleep(self._duration(settings.get('latency')))
+            if self._rng.random() < settings.get('error_rate', 0):
+                error = settings.get('error', SimProfile._DEFAULT_ERROR)
+                raise LsmError(getattr(ErrorNumber, error),
+                               "Simulated %s error of %s" % (error, method))
+            self._running = method
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self._running = None
+            if isinstance(result, types.GeneratorType):
+                # The work is done while the result is iterated.
+                result = SimProfile._holding(slot_fd, result)
+                next(result)
+                slot_fd = None
+            return result
+        finally:
+            SimProfile._slot_put(slot_fd)
+
+    def job_duration(self):
+        """
+        Return the seconds to add to the duration of a job created by the
+        method running.
+        """
+        return self._duration(
+            self._settings(self._running).get('job_duration'))
+
+    def close(self):
+        for slot_fd in self._slot_fds:
+            os.close(slot_fd)
+        self._slot_fds = []
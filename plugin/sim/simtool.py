@@ -0,0 +1,136 @@
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Maintenance of simulator state files:
+
+    python -m lsm.plugin.sim.simtool check [--repair] [STATEFILE]
+    python -m lsm.plugin.sim.simtool generate [--seed N] [--volumes N] ...
+        STATEFILE
+
+check compares the space counters of the pools with the sum of the disks,
+volumes, file systems and sub-pools they account for, and exits with 1
+when they differ.  With --repair the counters are recomputed.  STATEFILE
+defaults to the one the simulator plug-in uses.
+
+generate writes a new STATEFILE holding the given numbers of disks, pools,
+volumes and so on, to try lsmcli and the library on a large array:
+
+    python -m lsm.plugin.sim.simtool generate --volumes 1000000 \\
+        --disks 512 /tmp/big.db
+    lsmcli -u 'sim://?statefile=/tmp/big.db' list --type volumes
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from lsm import LsmError
+from lsm.plugin.sim.simarray import BackStore, SimArray
+
+
+def check(bs_obj, repair=False):
+    """
+    Prints the pool counters which are off, returns how many there were.
+    """
+    bs_obj.trans_begin()
+    errors = bs_obj.sim_pools_check()
+    for (sim_pool_id, column, stored, expected) in errors:
+        sys.stdout.write("Pool %d: %s is %s instead of %s\n" %
+                         (sim_pool_id, column, stored, expected))
+    if errors and repair:
+        bs_obj.sim_pools_space_recount()
+        bs_obj.trans_commit()
+        sys.stdout.write("Pool counters repaired\n")
+    else:
+        bs_obj.trans_rollback()
+    return len(errors)
+
+
+# Arguments of BackStore.sim_generate() given as --<name> options.
+_GENERATE_COUNTS = [
+    ('disks', 64, 'disks'),
+    ('pools', 8, 'pools'),
+    ('volumes', 1000, 'volumes'),
+    ('ags', 100, 'access groups'),
+    ('inits', 200, 'initiators'),
+    ('masks', 1000, 'volume masks'),
+    ('fss', 100, 'file systems'),
+    ('fs_snaps', 100, 'file system snapshots'),
+    ('exps', 100, 'NFS exports'),
+]
+
+
+def generate(args):
+    if os.path.exists(args.statefile):
+        sys.stderr.write("%s already exists\n" % args.statefile)
+        return 1
+
+    start = time.time()
+    bs_obj = BackStore(args.statefile, 30000)
+    try:
+        bs_obj.sim_generate(
+            seed=args.seed,
+            **dict((name, getattr(args, name))
+                   for (name, _, _) in _GENERATE_COUNTS))
+    except LsmError as lsm_err:
+        os.unlink(args.statefile)
+        sys.stderr.write("%s\n" % lsm_err.msg)
+        return 1
+    sys.stdout.write("Wrote %s in %.1f seconds\n" %
+                     (args.statefile, time.time() - start))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='libStorageMgmt simulator state file maintenance')
+    sub_parsers = parser.add_subparsers(dest='command')
+
+    check_parser = sub_parsers.add_parser(
+        'check', help='Check the pool space counters')
+    check_parser.add_argument('--repair', action='store_true',
+                              help='Recompute the counters found wrong')
+    check_parser.add_argument('statefile', nargs='?',
+                              default=SimArray.SIM_DATA_FILE,
+                              help='State file, default %s' %
+                                   SimArray.SIM_DATA_FILE)
+
+    generate_parser = sub_parsers.add_parser(
+        'generate', help='Write a state file of a large array')
+    generate_parser.add_argument('--seed', type=int, default=0,
+                                 help='Random seed, default 0')
+    for (name, default, what) in _GENERATE_COUNTS:
+        generate_parser.add_argument(
+            '--%s' % name.replace('_', '-'), type=int, default=default,
+            help='Number of %s, default %d' % (what, default))
+    generate_parser.add_argument('statefile', help='State file to create')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("no command given")
+
+    if args.command == 'generate':
+        return generate(args)
+
+    bs_obj = BackStore(args.statefile, 30000)
+    errors = check(bs_obj, args.repair)
+    if errors and not args.repair:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
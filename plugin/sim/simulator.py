@@ -15,20 +15,30 @@
 # Author: tasleson
 #         Gris Ge <fge@redhat.com>
 
+import functools
+import time
+
 from lsm import (uri_parse, VERSION, Capabilities, INfs,
-                 IStorageAreaNetwork, search_property, Client)
+                 IStorageAreaNetwork, search_property, search_pushdown,
+                 Client)
 
 from lsm.plugin.sim.simarray import SimArray
+from lsm.plugin.sim.simprofile import SimProfile
 
 
 class SimPlugin(INfs, IStorageAreaNetwork):
     """
     Simple class that implements enough to allow the framework to be exercised.
     """
+    # Methods the profile is not applied to, the methods a batch runs are.
+    _UNPROFILED = ('plugin_register', 'plugin_unregister', 'batch',
+                   'time_out_set', 'time_out_get')
+
     def __init__(self):
         self.uri = None
         self.password = None
         self.sim_array = None
+        self.profile = None
 
     def plugin_register(self, uri, password, timeout, flags=0):
         self.uri = uri
@@ -37,16 +47,34 @@ def plugin_register(self, uri, password, timeout, flags=0):
         # The caller may want to start clean, so we allow the caller to specify
         # a file to store and retrieve individual state.
         qp = uri_parse(uri)
-        if 'parameters' in qp and 'statefile' in qp['parameters'] \
-                and qp['parameters']['statefile'] is not None:
-            self.sim_array = SimArray(qp['parameters']['statefile'], timeout)
-        else:
-            self.sim_array = SimArray(None, timeout)
+        parameters = qp.get('parameters', {})
+        if parameters.get('profile') is not None:
+            self.profile = SimProfile(parameters['profile'])
+        self.sim_array = SimArray(
+            parameters.get('statefile'), timeout,
+            wal=parameters.get('wal') == 'yes',
+            snapshot=parameters.get('snapshot'), profile=self.profile)
+
+        if self.profile is not None:
+            for name in dir(self):
+                method = getattr(self, name)
+                if not name.startswith('_') and callable(method) and \
+                   name not in SimPlugin._UNPROFILED:
+                    setattr(self, name,
+                            functools.partial(self._profiled, name, method))
 
         return None
 
+    def _profiled(self, name, method, *args, **kwargs):
+        return self.profile.call(
+            name, self.sim_array.time_out_get() / 1000.0, method, *args,
+            **kwargs)
+
     def plugin_unregister(self, flags=0):
-        pass
+        if self.sim_array is not None:
+            self.sim_array.close()
+        if self.profile is not None:
+            self.profile.close()
 
     def job_status(self, job_id, flags=0):
         return self.sim_array.job_status(job_id, flags)
@@ -54,6 +82,22 @@ def job_status(self, job_id, flags=0):
     def job_free(self, job_id, flags=0):
         return self.sim_array.job_free(job_id, flags)
 
+    def jobs_wait(self, job_ids, timeout_ms=None, flags=0):
+        # Jobs finish at a known time, sleep until the first one does.
+        if job_ids:
+            left = min(self.sim_array.job_time_left(j) for j in job_ids)
+            if timeout_ms is not None:
+                left = min(left, timeout_ms / 1000.0)
+                timeout_ms -= left * 1000
+            time.sleep(left)
+        return INfs.jobs_wait(self, job_ids, timeout_ms, flags)
+
+    def batch(self, requests, flags=0):
+        # Single transaction for the whole batch.
+        return self.sim_array.batch(
+            [functools.partial(self._batch_call, method, params)
+             for (method, params) in requests])
+
     @staticmethod
     def _sim_data_2_lsm(sim_data):
         """
@@ -75,10 +119,6 @@ def time_out_get(self, flags=0):
     def capabilities(self, system, flags=0):
         rc = Capabilities()
         rc.enable_all()
-        rc.set(Capabilities.POOLS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.VOLUMES_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.DISKS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
-        rc.set(Capabilities.FS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
         rc.set(Capabilities.ACCESS_GROUPS_QUICK_SEARCH,
                Capabilities.UNSUPPORTED)
         rc.set(Capabilities.NFS_EXPORTS_QUICK_SEARCH, Capabilities.UNSUPPORTED)
@@ -104,23 +144,20 @@ def systems(self, flags=0):
     def system_read_cache_pct_update(self, system, read_pct, flags=0):
         return self.sim_array.system_read_cache_pct_update(system, read_pct)
 
+    @search_pushdown(['id', 'system_id'])
     def pools(self, search_key=None, search_value=None, flags=0):
-        sim_pools = self.sim_array.pools(flags)
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(p) for p in sim_pools],
-            search_key, search_value)
+        sim_pools = self.sim_array.pools(search_key, search_value, flags)
+        return [SimPlugin._sim_data_2_lsm(p) for p in sim_pools]
 
+    @search_pushdown(['id', 'system_id', 'pool_id'])
     def volumes(self, search_key=None, search_value=None, flags=0):
-        sim_vols = self.sim_array.volumes()
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(v) for v in sim_vols],
-            search_key, search_value)
+        sim_vols = self.sim_array.volumes(search_key, search_value)
+        return (SimPlugin._sim_data_2_lsm(v) for v in sim_vols)
 
+    @search_pushdown(['id', 'system_id'])
     def disks(self, search_key=None, search_value=None, flags=0):
-        sim_disks = self.sim_array.disks()
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(d) for d in sim_disks],
-            search_key, search_value)
+        sim_disks = self.sim_array.disks(search_key, search_value)
+        return [SimPlugin._sim_data_2_lsm(d) for d in sim_disks]
 
     def volume_create(self, pool, volume_name, size_bytes, provisioning,
                       flags=0):
@@ -215,11 +252,10 @@ def volume_child_dependency(self, volume, flags=0):
     def volume_child_dependency_rm(self, volume, flags=0):
         return self.sim_array.volume_child_dependency_rm(volume.id, flags)
 
+    @search_pushdown(['id', 'system_id', 'pool_id'])
     def fs(self, search_key=None, search_value=None, flags=0):
-        sim_fss = self.sim_array.fs()
-        return search_property(
-            [SimPlugin._sim_data_2_lsm(f) for f in sim_fss],
-            search_key, search_value)
+        sim_fss = self.sim_array.fs(search_key, search_value)
+        return (SimPlugin._sim_data_2_lsm(f) for f in sim_fss)
 
     def fs_create(self, pool, name, size_bytes, flags=0):
         sim_fs = self.sim_array.fs_create(pool.id, name, size_bytes)
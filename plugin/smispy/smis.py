@@ -204,6 +204,10 @@ def job_status(self, job_id, flags=0):
         cim_job = self._c.cim_job_of_job_id(job_id, cim_job_pros)
 
         job_state = cim_job['JobState']
+        if job_state not in (dmtf.JOB_STATE_NEW, dmtf.JOB_STATE_STARTING,
+                             dmtf.JOB_STATE_RUNNING):
+            # Whatever the job did is not in the cached replies yet
+            self._c.cache_invalidate()
 
         try:
             if job_state in (dmtf.JOB_STATE_NEW, dmtf.JOB_STATE_STARTING,
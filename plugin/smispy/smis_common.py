@@ -23,11 +23,11 @@
 
 import os
 import datetime
-import time
 import sys
 import six
 
-from lsm import LsmError, ErrorNumber, md5
+from lsm import (LsmError, ErrorNumber, md5, poll_with_backoff,
+                 trace_span, PluginCache)
 
 from lsm.plugin.smispy.WBEM import wbem
 from lsm.plugin.smispy.utils import merge_list
@@ -183,7 +183,10 @@ class SmisCommon(object):
     IAAN_WBEM_HTTP_PORT = 5988
     IAAN_WBEM_HTTPS_PORT = 5989
 
-    _INVOKE_MAX_LOOP_COUNT = 60
+    # Jobs are checked after 0.5s, 1s, 2s, 4s and then every 5s, for 300s
+    # at most.
+    _INVOKE_TIMEOUT = 300
+    _INVOKE_FIRST_CHECK_INTERVAL = 0.5
     _INVOKE_CHECK_INTERVAL = 5
 
     def __init__(self, url, username, password,
@@ -195,6 +198,8 @@ def __init__(self, url, username, password,
         self._vendor_product = None     # For vendor workaround codes.
         self.system_list = system_list
         self._debug_path = debug_path
+        # Replies of the enumerations and associations
+        self._cache = PluginCache()
 
         if namespace is None:
             namespace = dmtf.DEFAULT_NAMESPACE
@@ -270,7 +275,7 @@ def profile_check(self, profile_name, spec_ver, raise_error=False):
 
     def _vendor_namespace(self):
         if self.root_blk_cim_rp:
-            cim_syss_path = self._wbem_conn.AssociatorNames(
+            cim_syss_path = self.AssociatorNames(
                 self.root_blk_cim_rp.path,
                 ResultClass='CIM_ComputerSystem',
                 AssocClass='CIM_ElementConformsToProfile')
@@ -286,37 +291,96 @@ def _vendor_namespace(self):
                 ErrorNumber.PLUGIN_BUG,
                 "_vendor_namespace(): self.root_blk_cim_rp not set yet")
 
+    @staticmethod
+    def _span(operation, cim_name, params=None):
+        """
+        Returns the trace span of a request to the SMI-S provider, see
+        lsm.trace_span().
+        """
+        attributes = {'class_name': getattr(cim_name, 'classname', cim_name)}
+        if params and 'ResultClass' in params:
+            attributes['result_class'] = params['ResultClass']
+        return trace_span('smis.' + operation, **attributes)
+
+    def _cached(self, operation, cim_name, namespace, params, fetch):
+        """
+        Returns a copy of the list fetch() returns for a request to the SMI-S
+        provider, cached for a while.  Requests about jobs are not cached,
+        as jobs change on their own.
+        """
+        names = (getattr(cim_name, 'classname', cim_name),
+                 params.get('ResultClass'), params.get('AssocClass'))
+        if any(n and 'Job' in n for n in names):
+            with SmisCommon._span(operation, cim_name, params):
+                return fetch()
+
+        def _fetch():
+            with SmisCommon._span(operation, cim_name, params):
+                return fetch()
+
+        key = (operation, repr(cim_name), namespace,
+               self._wbem_conn.default_namespace,
+               repr(sorted(params.items())))
+        return list(self._cache.get(key, _fetch))
+
+    def cache_invalidate(self):
+        """
+        Drops the cached replies of the provider.  Done for every
+        InvokeMethod() and DeleteInstance(), needed as well when a job is
+        seen finished.
+        """
+        self._cache.invalidate()
+
     def EnumerateInstances(self, ClassName, namespace=None, **params):
         if self._wbem_conn.default_namespace in dmtf.INTEROP_NAMESPACES:
             # We have to enumerate in vendor namespace
             self._wbem_conn.default_namespace = self._vendor_namespace()
         params['LocalOnly'] = False
-        return self._wbem_conn.EnumerateInstances(
-            ClassName, namespace, **params)
+        return self._cached(
+            'EnumerateInstances', ClassName, namespace, params,
+            lambda: self._wbem_conn.EnumerateInstances(
+                ClassName, namespace, **params))
 
     def EnumerateInstanceNames(self, ClassName, namespace=None, **params):
         if self._wbem_conn.default_namespace in dmtf.INTEROP_NAMESPACES:
             # We have to enumerate in vendor namespace
             self._wbem_conn.default_namespace = self._vendor_namespace()
         params['LocalOnly'] = False
-        return self._wbem_conn.EnumerateInstanceNames(
-            ClassName, namespace, **params)
+        return self._cached(
+            'EnumerateInstanceNames', ClassName, namespace, params,
+            lambda: self._wbem_conn.EnumerateInstanceNames(
+                ClassName, namespace, **params))
 
     def Associators(self, ObjectName, **params):
-        return self._wbem_conn.Associators(ObjectName, **params)
+        return self._cached(
+            'Associators', ObjectName, None, params,
+            lambda: self._wbem_conn.Associators(ObjectName, **params))
 
     def AssociatorNames(self, ObjectName, **params):
-        return self._wbem_conn.AssociatorNames(ObjectName, **params)
+        return self._cached(
+            'AssociatorNames', ObjectName, None, params,
+            lambda: self._wbem_conn.AssociatorNames(ObjectName, **params))
 
     def GetInstance(self, InstanceName, **params):
         params['LocalOnly'] = False
-        return self._wbem_conn.GetInstance(InstanceName, **params)
+        with SmisCommon._span('GetInstance', InstanceName):
+            return self._wbem_conn.GetInstance(InstanceName, **params)
 
     def DeleteInstance(self, InstanceName, **params):
-        return self._wbem_conn.DeleteInstance(InstanceName, **params)
+        self._cache.invalidate()
+        with SmisCommon._span('DeleteInstance', InstanceName):
+            return self._wbem_conn.DeleteInstance(InstanceName, **params)
 
     def References(self, ObjectName, **params):
-        return self._wbem_conn.References(ObjectName, **params)
+        with SmisCommon._span('References', ObjectName, params):
+            return self._wbem_conn.References(ObjectName, **params)
+
+    def InvokeMethod(self, MethodName, ObjectName, **params):
+        self._cache.invalidate()
+        with SmisCommon._span('InvokeMethod', ObjectName) as attributes:
+            attributes['method'] = MethodName
+            return self._wbem_conn.InvokeMethod(
+                MethodName, ObjectName, **params)
 
     def is_megaraid(self):
         return self._vendor_product == SmisCommon._PRODUCT_MEGARAID
@@ -436,8 +500,7 @@ def invoke_method(self, cmd, cim_path, in_params, out_handler=None,
         if retrieve_data is None:
             retrieve_data = SmisCommon.JOB_RETRIEVE_NONE
         try:
-            (rc, out) = self._wbem_conn.InvokeMethod(
-                cmd, cim_path, **in_params)
+            (rc, out) = self.InvokeMethod(cmd, cim_path, **in_params)
 
             # Check to see if operation is done
             if rc == SmisCommon.SNIA_INVOKE_OK:
@@ -483,8 +546,7 @@ def invoke_method_wait(self, cmd, cim_path, in_params,
             CIMInstanceName # expect_class
         If flag_out_array is True, return the first element of out[out_key].
         """
-        cim_job = dict()
-        (rc, out) = self._wbem_conn.InvokeMethod(cmd, cim_path, **in_params)
+        (rc, out) = self.InvokeMethod(cmd, cim_path, **in_params)
 
         try:
             if rc == SmisCommon.SNIA_INVOKE_OK:
@@ -507,47 +569,47 @@ def invoke_method_wait(self, cmd, cim_path, in_params,
                                    "in out %s" % (out_key, list(out.items())))
 
             elif rc == SmisCommon.SNIA_INVOKE_ASYNC:
-                cim_job = {}
                 cim_job_path = out['Job']
-                loop_counter = 0
                 job_pros = ['JobState', 'ErrorDescription',
                             'OperationalStatus']
-                cim_xxxs_path = []
-                while loop_counter <= SmisCommon._INVOKE_MAX_LOOP_COUNT:
+
+                def check():
                     cim_job = self.GetInstance(cim_job_path,
                                                PropertyList=job_pros)
                     job_state = cim_job['JobState']
                     if job_state in (dmtf.JOB_STATE_NEW,
                                      dmtf.JOB_STATE_STARTING,
                                      dmtf.JOB_STATE_RUNNING):
-                        loop_counter += 1
-                        time.sleep(SmisCommon._INVOKE_CHECK_INTERVAL)
-                        continue
+                        return None
                     elif job_state == dmtf.JOB_STATE_COMPLETED:
-                        if not SmisCommon.cim_job_completed_ok(cim_job):
-                            raise LsmError(
-                                ErrorNumber.PLUGIN_BUG,
-                                str(cim_job['ErrorDescription']))
-                        if expect_class is None:
-                            return None
-                        cim_xxxs_path = self.AssociatorNames(
-                            cim_job.path,
-                            AssocClass='CIM_AffectedJobElement',
-                            ResultClass=expect_class)
-                        break
+                        return cim_job
                     else:
                         raise LsmError(
                             ErrorNumber.PLUGIN_BUG,
                             "invoke_method_wait(): Got unknown job state "
                             "%d: %s" % (job_state, list(cim_job.items())))
 
-                if loop_counter > SmisCommon._INVOKE_MAX_LOOP_COUNT:
+                cim_job = poll_with_backoff(
+                    check, SmisCommon._INVOKE_TIMEOUT,
+                    SmisCommon._INVOKE_FIRST_CHECK_INTERVAL,
+                    SmisCommon._INVOKE_CHECK_INTERVAL)
+                self._cache.invalidate()
+                if cim_job is None:
                     raise LsmError(
                         ErrorNumber.TIMEOUT,
                         "The job generated by %s() failed to finish in %ds" %
-                        (cmd,
-                         SmisCommon._INVOKE_CHECK_INTERVAL *
-                         SmisCommon._INVOKE_MAX_LOOP_COUNT))
+                        (cmd, SmisCommon._INVOKE_TIMEOUT))
+
+                if not SmisCommon.cim_job_completed_ok(cim_job):
+                    raise LsmError(
+                        ErrorNumber.PLUGIN_BUG,
+                        str(cim_job['ErrorDescription']))
+                if expect_class is None:
+                    return None
+                cim_xxxs_path = self.AssociatorNames(
+                    cim_job.path,
+                    AssocClass='CIM_AffectedJobElement',
+                    ResultClass=expect_class)
 
                 if len(cim_xxxs_path) == 1:
                     return cim_xxxs_path[0]
@@ -17,7 +17,6 @@
 
 import copy
 import json
-import time
 import socket
 import re
 import base64
@@ -27,15 +26,12 @@
                  IStorageAreaNetwork, INfs, FileSystem, FsSnapshot, NfsExport,
                  LsmError, ErrorNumber, uri_parse, md5, VERSION,
                  common_urllib2_error_handler, search_property,
-                 AccessGroup, int_div)
+                 AccessGroup, int_div, poll_with_backoff, trace_span,
+                 PluginCache)
 
 try:
-    from urllib.request import (Request,
-                                urlopen)
     from urllib.parse import (urlunsplit)
 except ImportError:
-    from urllib2 import (Request,
-                         urlopen)
     from urlparse import (urlunsplit)
 
 if six.PY3:
@@ -122,6 +118,8 @@ def __init__(self):
         self.url = None
         self.headers = None
         self._flag_ag_support = True
+        # Replies of the targetd list methods
+        self._cache = PluginCache()
         self.system = System("targetd", "targetd storage appliance",
                              System.STATUS_UNKNOWN, '')
 
@@ -963,18 +961,38 @@ def _default_error_handler(error_code, msg):
             raise LsmError(ec, msg_d)
 
     def _jsonrequest(self, method, params=None, default_error_handler=True):
+        # The list methods only read, except async_list which is polled for
+        # the state of jobs.  Anything else might change what they return.
+        if method.endswith('_list') and method != 'async_list':
+            return self._cache.get(
+                (method, json.dumps(params, sort_keys=True)),
+                lambda: self._jsonrequest_send(
+                    method, params, default_error_handler))
+        if method != 'async_list':
+            self._cache.invalidate()
+        return self._jsonrequest_send(method, params, default_error_handler)
+
+    def _jsonrequest_send(self, method, params, default_error_handler):
         data = json.dumps(dict(id=self.rpc_id, method=method,
                                params=params, jsonrpc="2.0"))
         self.rpc_id += 1
 
+        # Imported on first use, loading the plug-in doesn't need it
         try:
-            request = Request(self.url, data.encode('utf-8'), self.headers)
-            response_obj = urlopen(request)
-        except socket.error:
-            raise LsmError(ErrorNumber.NETWORK_ERROR,
-                           "Unable to connect to targetd, uri right?")
-
-        response_data = response_obj.read().decode('utf-8')
+            from urllib.request import (Request, urlopen)
+        except ImportError:
+            from urllib2 import (Request, urlopen)
+
+        with trace_span('targetd.' + method):
+            try:
+                request = Request(self.url, data.encode('utf-8'),
+                                  self.headers)
+                response_obj = urlopen(request)
+            except socket.error:
+                raise LsmError(ErrorNumber.NETWORK_ERROR,
+                               "Unable to connect to targetd, uri right?")
+
+            response_data = response_obj.read().decode('utf-8')
         response = json.loads(response_data)
         if response.get('error', None) is None:
             return response.get('result')
@@ -994,12 +1012,18 @@ def _jsonrequest(self, method, params=None, default_error_handler=True):
             else:  # +code is async execution id
                 # Async completion, polling for results
                 async_code = response['error']['code']
-                while True:
-                    time.sleep(1)
+
+                def check():
                     results = self._jsonrequest('async_list')
                     status = results.get(str(async_code), None)
-                    if status:
-                        if status[0]:
-                            raise LsmError(
-                                ErrorNumber.PLUGIN_BUG,
-                                "%d has error %d" % (async_code, status[0]))
+                    if status is None:
+                        # targetd drops the jobs which finished fine
+                        return True
+                    if status[0]:
+                        raise LsmError(
+                            ErrorNumber.PLUGIN_BUG,
+                            "%d has error %d" % (async_code, status[0]))
+                    return None
+
+                poll_with_backoff(check, interval=0.25)
+                return None
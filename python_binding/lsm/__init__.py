@@ -12,21 +12,57 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; If not, see <http://www.gnu.org/licenses/>.
 
+import os as _os
+import sys as _sys
+import importlib as _importlib
+
+if _os.getenv('LSM_IMPORT_PROFILE'):
+    from lsm._import_profile import start as _start_import_profile
+    _start_import_profile(_os.getenv('LSM_IMPORT_PROFILE'))
+
 from lsm.version import VERSION
 
-from lsm._common import error, info, LsmError, ErrorNumber, \
-    JobStatus, uri_parse, md5, Proxy, size_bytes_2_size_human, \
-    common_urllib2_error_handler, size_human_2_size_bytes, int_div
+# The public names and the modules they live in, in import order.  On python
+# 3.7 or later a module is only imported when one of its names is first used,
+# so that "import lsm" does not load the client, the plug-in side code and
+# the C extension for a caller using only some of them.
+_MODULES = (
+    ('lsm._common', ('error', 'info', 'LsmError', 'ErrorNumber', 'JobStatus',
+                     'uri_parse', 'md5', 'Proxy', 'size_bytes_2_size_human',
+                     'common_urllib2_error_handler', 'size_human_2_size_bytes',
+                     'int_div', 'poll_with_backoff')),
+    ('lsm._tracing', ('trace_span', 'trace_sink_set')),
+    ('lsm._local_disk', ('LocalDisk',)),
+    ('lsm._data', ('Disk', 'Volume', 'Pool', 'System', 'FileSystem',
+                   'FsSnapshot', 'NfsExport', 'BlockRange', 'AccessGroup',
+                   'TargetPort', 'Capabilities', 'Battery', 'ColumnTable')),
+    ('lsm._iplugin', ('IPlugin', 'IStorageAreaNetwork',
+                      'INetworkAttachedStorage', 'INfs')),
+    ('lsm._client', ('Client', 'ClientPool', 'PooledClient', 'Batch',
+                     'ClientCache', 'MultiClient')),
+    ('lsm._pluginrunner', ('PluginRunner', 'PluginCache', 'search_property',
+                           'search_pushdown')),
+)
 
-from lsm._local_disk import LocalDisk
+_LAZY = dict((name, module) for (module, names) in _MODULES
+             for name in names)
 
-from lsm._data import (Disk, Volume, Pool, System, FileSystem, FsSnapshot,
-                    NfsExport, BlockRange, AccessGroup, TargetPort,
-                    Capabilities, Battery)
-from lsm._iplugin import IPlugin, IStorageAreaNetwork, \
-    INetworkAttachedStorage, INfs
+if _sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _LAZY:
+            raise AttributeError("module 'lsm' has no attribute '%s'" % name)
+        value = getattr(_importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
 
-from lsm._client import Client
-from lsm._pluginrunner import PluginRunner, search_property
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY))
+else:
+    # No module __getattr__() (PEP 562), import everything now.
+    for (_module, _names) in _MODULES:
+        _module = _importlib.import_module(_module)
+        for _name in _names:
+            globals()[_name] = getattr(_module, _name)
+    del _module, _names, _name
 
 __all__ = []
@@ -14,15 +14,23 @@
 #
 # Author: tasleson
 import os
+import json
+import time
+import threading
+import collections
+import contextlib
+import functools
 from lsm import (Volume, NfsExport, Capabilities, Pool, System, Battery,
                  Disk, AccessGroup, FileSystem, FsSnapshot,
-                 uri_parse, LsmError, ErrorNumber,
+                 uri_parse, LsmError, ErrorNumber, JobStatus,
                  INetworkAttachedStorage, TargetPort)
 
 from lsm._common import return_requires as _return_requires
 from lsm._common import UDS_PATH as _UDS_PATH
 from lsm._transport import TransPort as _TransPort
 from lsm._data import IData as _IData
+from lsm._data import DataEncoder as _DataEncoder
+from lsm._data import ColumnTable
 
 import six
 
@@ -74,6 +82,12 @@ class Client(INetworkAttachedStorage):
 
     """
     Client side class used for managing storage that utilises RPC mechanism.
+
+    A Client can be shared by many threads.  Their requests are multiplexed
+    on the single plug-in connection, each thread waiting for its own reply,
+    but the plug-in serves them one at a time.  For requests to run in
+    parallel, use a lsm.PooledClient which gives each call a plug-in
+    connection of its own.
     """
     # Method added so that the interface for the client RPC and the plug-in
     # itself match.
@@ -212,6 +226,50 @@ def available_plugins(field_sep=':', flags=FLAG_RSVD):
 
         return rc
 
+    # Runs many requests in a single round trip to the plug-in
+    # @param    self    The this pointer
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns  Batch to record the requests on
+    @contextlib.contextmanager
+    def batch(self, flags=FLAG_RSVD):
+        """
+        Returns a lsm.Batch to record requests on, they are sent to the
+        plug-in in a single request at the end of the with block:
+
+            with client.batch() as b:
+                for name in names:
+                    b.volume_create(pool, name, size,
+                                    lsm.Volume.PROVISION_DEFAULT)
+            for (job, vol) in b.results:
+                ...
+
+        The plug-in runs the requests one after the other.  With plug-ins
+        which do not support batches (C plug-ins) the requests are sent
+        without waiting for each reply instead.  Nothing is sent when the
+        with block raises.
+        """
+        b = Batch()
+        yield b
+        b.results = self._tp.rpc_batch(b.requests, flags)
+
+    @property
+    def cache(self):
+        """
+        The lsm.ClientCache the replies of this client go through, None when
+        they are not cached, which is the default.  Set it to a ClientCache
+        to cache them, or to None to stop.
+        """
+        return getattr(self._tp, 'cache', None)
+
+    @cache.setter
+    def cache(self, cache):
+        tp = getattr(self._tp, 'tp', self._tp)
+        if cache is None:
+            self._tp = tp
+        else:
+            cache._attach(tp)
+            self._tp = _CachedTransPort(tp, cache)
+
     # Sets the timeout for the plug-in
     # @param    self    The this pointer
     # @param    ms      Time-out in ms
@@ -268,6 +326,80 @@ def job_free(self, job_id, flags=FLAG_RSVD):
         """
         return self._tp.rpc('job_free', _del_self(locals()))
 
+    # Waits for a job to finish
+    # @param    self        The this pointer
+    # @param    job_id      Job id to wait for
+    # @param    timeout_ms  Maximum time to wait in ms, None waits forever
+    # @param    flags       Reserved for future use, must be zero.
+    # @returns  (status, percent, item) like job_status()
+    @_return_requires(int, int, _IData)
+    def job_wait(self, job_id, timeout_ms=None, flags=FLAG_RSVD):
+        """
+        Waits for the job to finish or timeout_ms to pass, None waits forever.
+        The plug-in checks the job itself, so this takes a single round trip
+        instead of a job_status() call every so often.
+
+        Returns the job_status() tuple of the job, the status is still
+        JobStatus.INPROGRESS on time out.  The job still needs job_free().
+        """
+        try:
+            return self._tp.rpc('job_wait', _del_self(locals()))
+        except LsmError as lsm_err:
+            if lsm_err.code != ErrorNumber.NO_SUPPORT:
+                raise
+        # Plug-in without job_wait(), check the job from here
+        return INetworkAttachedStorage.job_wait(self, job_id, timeout_ms,
+                                                flags)
+
+    # Waits for any of many jobs to finish
+    # @param    self        The this pointer
+    # @param    job_ids     Job ids to wait for
+    # @param    timeout_ms  Maximum time to wait in ms, None waits forever
+    # @param    flags       Reserved for future use, must be zero.
+    # @returns  List of [job_id, status, percent, item] of the finished jobs
+    @_return_requires([[six.string_types[0], int, int, _IData]])
+    def jobs_wait(self, job_ids, timeout_ms=None, flags=FLAG_RSVD):
+        """
+        Waits for at least one of the jobs to finish or timeout_ms to pass,
+        None waits forever.
+
+        Returns a list of [job_id, status, percent, item] of the jobs which
+        are not JobStatus.INPROGRESS any more, empty on time out.  See
+        jobs_wait_iter() to wait for all the jobs.
+        """
+        try:
+            return self._tp.rpc('jobs_wait', _del_self(locals()))
+        except LsmError as lsm_err:
+            if lsm_err.code != ErrorNumber.NO_SUPPORT:
+                raise
+        return INetworkAttachedStorage.jobs_wait(self, job_ids, timeout_ms,
+                                                 flags)
+
+    def jobs_wait_iter(self, job_ids, timeout_ms=None, flags=FLAG_RSVD):
+        """
+        Same as jobs_wait(), but waits for all the jobs: yields
+        (job_id, status, percent, item) for each job in the order the jobs
+        finish.  Stops early when timeout_ms passed, the jobs still in
+        progress are not yielded.
+        """
+        if timeout_ms is not None:
+            end = time.time() + timeout_ms / 1000.0
+
+        pending = list(job_ids)
+        while pending:
+            left_ms = None
+            if timeout_ms is not None:
+                left_ms = max(int((end - time.time()) * 1000), 0)
+
+            done = self.jobs_wait(pending, left_ms, flags)
+            if not done:
+                return
+
+            for (job_id, status, percent, item) in done:
+                yield (job_id, status, percent, item)
+            done_ids = set(d[0] for d in done)
+            pending = [j for j in pending if j not in done_ids]
+
     # Gets the capabilities of the array.
     # @param    self    The this pointer
     # @param    system  The system of interest
@@ -293,6 +425,26 @@ def plugin_info(self, flags=FLAG_RSVD):
         """
         return self._tp.rpc('plugin_info', _del_self(locals()))
 
+    # Gets the per method statistics of the plug-in
+    # @param    self    The this pointer
+    # @param    flags   Reserved for future use, must be zero.
+    # @returns  Dictionary {method: {field: total}}
+    @_return_requires(dict)
+    def stats(self, flags=FLAG_RSVD):
+        """
+        Returns statistics of the requests the plug-in served on this
+        connection so far, per method:
+            {'volumes': {'calls': 2, 'errors': 0, 'read_time': 0.0001,
+                         'call_time': 0.02, 'send_time': 0.003,
+                         'bytes_in': 146, 'bytes_out': 52113,
+                         'objects': 400}, ...}
+        Times are in seconds.  read_time is spent receiving and parsing the
+        requests, call_time in the plug-in method and send_time serializing
+        and sending the replies.  objects is the number of items in the
+        replies.  Only python plug-ins support this.
+        """
+        return self._tp.rpc('plugin_stats', _del_self(locals()))
+
     # Returns an array of pool objects.
     # @param    self            The this pointer
     # @param    search_key      Search key
@@ -308,6 +460,22 @@ def pools(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, Pool.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('pools', _del_self(locals()))
 
+    # Returns the pools as a table of columns
+    # @param    self            The this pointer
+    # @param    search_key      Search key
+    # @param    search_value    Search value
+    # @param    flags           Same as pools()
+    # @returns A ColumnTable of pools.
+    def pools_columns(self, search_key=None, search_value=None,
+                      flags=FLAG_RSVD):
+        """
+        Same as pools(), but returns a lsm.ColumnTable holding one list per
+        pool attribute, built from the reply without creating Pool objects.
+        """
+        _check_search_key(search_key, Pool.SUPPORTED_SEARCH_KEYS)
+        return ColumnTable(
+            Pool, self._tp.rpc('pools', _del_self(locals()), raw=True))
+
     # Returns an array of system objects.
     # @param    self    The this pointer
     # @param    flags   Reserved for future use, must be zero.
@@ -394,6 +562,39 @@ def volumes(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, Volume.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('volumes', _del_self(locals()))
 
+    # Returns the volumes as a table of columns
+    # @param    self            The this pointer
+    # @param    search_key      Search key
+    # @param    search_value    Search value
+    # @param    flags           Same as volumes()
+    # @returns A ColumnTable of volumes.
+    def volumes_columns(self, search_key=None, search_value=None,
+                        flags=FLAG_RSVD):
+        """
+        Same as volumes(), but returns a lsm.ColumnTable holding one list per
+        volume attribute, built from the reply without creating Volume
+        objects.
+        """
+        _check_search_key(search_key, Volume.SUPPORTED_SEARCH_KEYS)
+        return ColumnTable(
+            Volume, self._tp.rpc('volumes', _del_self(locals()), raw=True))
+
+    # Returns a generator of volume objects
+    # @param    self            The this pointer
+    # @param    search_key      Search key to use
+    # @param    search_value    Search value
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns A generator of volume objects.
+    def volumes_iter(self, search_key=None, search_value=None,
+                     flags=FLAG_RSVD):
+        """
+        Same as volumes(), but returns a generator which yields the volume
+        objects as they arrive from a plug-in which streams its results,
+        instead of waiting for the whole list.
+        """
+        _check_search_key(search_key, Volume.SUPPORTED_SEARCH_KEYS)
+        return self._tp.rpc_iter('volumes', _del_self(locals()))
+
     # Creates a volume
     # @param    self            The this pointer
     # @param    pool            The pool object to allocate storage from
@@ -549,6 +750,37 @@ def disks(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, Disk.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('disks', _del_self(locals()))
 
+    # Returns the disks as a table of columns
+    # @param    self            The this pointer
+    # @param    search_key      Search key
+    # @param    search_value    Search value
+    # @param    flags           Same as disks()
+    # @returns A ColumnTable of disks.
+    def disks_columns(self, search_key=None, search_value=None,
+                      flags=FLAG_RSVD):
+        """
+        Same as disks(), but returns a lsm.ColumnTable holding one list per
+        disk attribute, built from the reply without creating Disk objects.
+        """
+        _check_search_key(search_key, Disk.SUPPORTED_SEARCH_KEYS)
+        return ColumnTable(
+            Disk, self._tp.rpc('disks', _del_self(locals()), raw=True))
+
+    # Returns a generator of disk objects
+    # @param    self            The this pointer
+    # @param    search_key      Search Key
+    # @param    search_value    Search value
+    # @param    flags           Same as disks()
+    # @returns A generator of disk objects.
+    def disks_iter(self, search_key=None, search_value=None,
+                   flags=FLAG_RSVD):
+        """
+        Same as disks(), but returns a generator which yields the disk
+        objects as they arrive from the plug-in.
+        """
+        _check_search_key(search_key, Disk.SUPPORTED_SEARCH_KEYS)
+        return self._tp.rpc_iter('disks', _del_self(locals()))
+
     # Access control for allowing an access group to access a volume
     # @param    self            The this pointer
     # @param    access_group    The access group
@@ -733,6 +965,20 @@ def fs(self, search_key=None, search_value=None, flags=FLAG_RSVD):
         _check_search_key(search_key, FileSystem.SUPPORTED_SEARCH_KEYS)
         return self._tp.rpc('fs', _del_self(locals()))
 
+    # Returns a generator of file system objects.
+    # @param    self            The this pointer
+    # @param    search_key      Search Key
+    # @param    search_value    Search value
+    # @param    flags           Reserved for future use, must be zero.
+    # @returns A generator of FS objects.
+    def fs_iter(self, search_key=None, search_value=None, flags=FLAG_RSVD):
+        """
+        Same as fs(), but returns a generator which yields the file system
+        objects as they arrive from the plug-in.
+        """
+        _check_search_key(search_key, FileSystem.SUPPORTED_SEARCH_KEYS)
+        return self._tp.rpc_iter('fs', _del_self(locals()))
+
     # Deletes a file system
     # @param    self    The this pointer
     # @param    fs      The file system to delete
@@ -1784,3 +2030,816 @@ def volume_read_cache_policy_update(self, volume, rcp, flags=FLAG_RSVD):
                            "Volume.READ_CACHE_POLICY_DISABLED")
         return self._tp.rpc('volume_read_cache_policy_update',
                             _del_self(locals()))
+
+
+class Batch(object):
+    """
+    Requests recorded by Client.batch().  Batch has the methods of Client,
+    taking the same arguments, but they only record the request and return
+    its index in results.
+
+    Once the batch ran, results holds the outcome of each request in order:
+    what the Client method would have returned, or the LsmError it would have
+    raised.  A failed request does not stop the following ones.
+    """
+
+    # Client methods which cannot be part of a batch.
+    _EXCLUDED = ('plugin_register', 'plugin_unregister', 'close', 'batch',
+                 'available_plugins', 'stats')
+
+    def __init__(self):
+        self.requests = []
+        self.results = None
+        # The undecorated Client methods are called with this object as self,
+        # they check their arguments and hand the request to self._tp.rpc().
+        self._tp = self
+
+    def rpc(self, method, args, raw=False):
+        self.requests.append((method, args))
+        return len(self.requests) - 1
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in Batch._EXCLUDED or \
+                name.endswith(('_iter', '_columns')) or \
+                not callable(getattr(Client, name, None)):
+            raise AttributeError("'Batch' object has no attribute '%s'" %
+                                 name)
+        func = six.get_unbound_function(getattr(Client, name))
+        return functools.partial(getattr(func, '__wrapped__', func), self)
+
+
+class ClientPool(object):
+    """
+    Thread safe pool of connected Client objects, keyed by the URI and
+    password they were created with.  Returning a Client to the pool instead
+    of closing it keeps the plug-in process (and its session to the storage
+    array) running, so the next user of the same URI skips the plug-in start
+    up and plugin_register:
+
+        pool = lsm.ClientPool()
+        with pool.client('sim://') as c:
+            c.volumes()
+
+    Clients idle for more than a second are checked with time_out_get()
+    before being handed out, they are closed once they are idle for more
+    than idle_timeout seconds.  At most max_size clients are open at the
+    same time, a checkout waits for one to be returned when the pool is
+    full.
+    """
+
+    # Errors after which a client is not put back in the pool.
+    _BROKEN_ERRORS = (ErrorNumber.TRANSPORT_COMMUNICATION,
+                      ErrorNumber.TRANSPORT_SERIALIZATION,
+                      ErrorNumber.TRANSPORT_INVALID_ARG)
+
+    # Clients idle for less seconds than this are handed out unchecked.
+    _CHECK_IDLE = 1.0
+
+    def __init__(self, max_size=16, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self._cond = threading.Condition()
+        # (uri, password) => list of (client, time returned), last returned
+        # at the end.
+        self._idle = {}
+        # Client => (uri, password) of every open client.
+        self._keys = {}
+        # Clients handed out by checkout() and not given back yet.
+        self._checked_out = set()
+        # Clients being created by checkout().
+        self._creating = 0
+        self._closed = False
+
+    @staticmethod
+    def _close_client(client):
+        # The plug-in might be gone already, nothing else to do about it.
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def _expired(self):
+        """
+        Removes the clients idle for too long and returns them, must be
+        called with self._cond held.
+        """
+        rc = []
+        oldest = time.time() - self.idle_timeout
+        for key, idle in list(self._idle.items()):
+            while idle and idle[0][1] < oldest:
+                rc.append(idle.pop(0)[0])
+            if not idle:
+                del self._idle[key]
+        for client in rc:
+            del self._keys[client]
+        return rc
+
+    def _least_recent(self):
+        """
+        Removes the least recently returned idle client and returns it, or
+        None if there is no idle client.  Must be called with self._cond held.
+        """
+        if not self._idle:
+            return None
+        key = min(self._idle, key=lambda k: self._idle[k][0][1])
+        client = self._idle[key].pop(0)[0]
+        if not self._idle[key]:
+            del self._idle[key]
+        del self._keys[client]
+        return client
+
+    def checkout(self, uri, plain_text_password=None, timeout_ms=30000,
+                 flags=0):
+        """
+        Returns a connected Client for uri and plain_text_password, an idle
+        one if available, else a new one created with timeout_ms and flags.
+        The client must be given back with checkin() or discard().
+        """
+        key = (uri, plain_text_password)
+
+        while True:
+            client = None
+            idle_since = None
+            to_close = []
+            with self._cond:
+                if self._closed:
+                    raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                                   "ClientPool is closed")
+                to_close = self._expired()
+                while True:
+                    if self._idle.get(key):
+                        (client, idle_since) = self._idle[key].pop()
+                        if not self._idle[key]:
+                            del self._idle[key]
+                        break
+                    if len(self._keys) + self._creating < self.max_size:
+                        break
+                    # Make room by closing an idle client of another key.
+                    lru = self._least_recent()
+                    if lru is not None:
+                        to_close.append(lru)
+                        break
+                    self._cond.wait()
+                    # close() could have run meanwhile.
+                    if self._closed:
+                        break
+
+                closed = self._closed
+                if client is not None:
+                    self._checked_out.add(client)
+                elif not closed:
+                    # Reserve the slot while the client gets created.
+                    self._creating += 1
+
+            for c in to_close:
+                ClientPool._close_client(c)
+
+            if closed:
+                raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                               "ClientPool is closed")
+
+            if client is None:
+                try:
+                    client = Client(uri, plain_text_password, timeout_ms,
+                                    flags)
+                finally:
+                    with self._cond:
+                        self._creating -= 1
+                        if client is not None:
+                            self._keys[client] = key
+                            self._checked_out.add(client)
+                        self._cond.notify()
+                return client
+
+            if time.time() - idle_since < ClientPool._CHECK_IDLE:
+                return client
+            try:
+                client.time_out_get()
+                return client
+            except Exception:
+                self.discard(client)
+
+    def _check_in_use(self, client):
+        """
+        Raises a LsmError unless client is checked out of this pool, then
+        marks it returned.  Must be called with self._cond held.
+        """
+        if client not in self._checked_out:
+            raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                           "Client is not checked out of this ClientPool")
+        self._checked_out.remove(client)
+
+    def checkin(self, client):
+        """
+        Puts a client got from checkout() back in the pool.
+        """
+        with self._cond:
+            self._check_in_use(client)
+            if not self._closed:
+                self._idle.setdefault(self._keys[client], []).append(
+                    (client, time.time()))
+                self._cond.notify()
+                return
+            del self._keys[client]
+            self._cond.notify()
+        ClientPool._close_client(client)
+
+    def discard(self, client):
+        """
+        Closes a client got from checkout() instead of putting it back in the
+        pool, for instance when it is found broken.
+        """
+        with self._cond:
+            self._check_in_use(client)
+            del self._keys[client]
+            self._cond.notify()
+        ClientPool._close_client(client)
+
+    @contextlib.contextmanager
+    def client(self, uri, plain_text_password=None, timeout_ms=30000,
+               flags=0):
+        """
+        Context manager doing a checkout() and giving the client back to the
+        pool when done.  The client is discarded if its connection failed or
+        if anything else than a LsmError was raised, as a reply could still
+        be pending.
+        """
+        client = self.checkout(uri, plain_text_password, timeout_ms, flags)
+        try:
+            yield client
+        except LsmError as lsm_err:
+            if lsm_err.code in ClientPool._BROKEN_ERRORS:
+                self.discard(client)
+            else:
+                self.checkin(client)
+            raise
+        except Exception:
+            self.discard(client)
+            raise
+        else:
+            self.checkin(client)
+
+    def close(self):
+        """
+        Closes all the idle clients, clients still checked out get closed
+        when given back.
+        """
+        with self._cond:
+            self._closed = True
+            to_close = [c for idle in self._idle.values() for c, t in idle]
+            self._idle = {}
+            for client in to_close:
+                del self._keys[client]
+            self._cond.notify_all()
+
+        for client in to_close:
+            ClientPool._close_client(client)
+
+
+class PooledClient(object):
+    """
+    Client for many threads to share, with the methods of Client.  Every
+    call is made on a plug-in connection of its own, from a lsm.ClientPool
+    of up to max_connections connections to uri, so that up to that many
+    calls run in parallel in as many plug-in processes:
+
+        c = lsm.PooledClient('sim://', max_connections=8)
+        threads = [threading.Thread(target=c.volumes) for _ in range(8)]
+
+    A call waits for a connection when they are all busy.  A first
+    connection is made right away so that a wrong URI or password is
+    reported here.  The plug-in time out is the timeout_ms given, there is
+    no time_out_set().  Calls of the *_iter() methods hold their connection
+    until the iteration is over.
+    """
+
+    # Client methods which only make sense on a single connection.
+    _EXCLUDED = ('plugin_register', 'plugin_unregister', 'close', 'batch',
+                 'time_out_set', 'stats')
+
+    def __init__(self, uri, plain_text_password=None, timeout_ms=30000,
+                 flags=0, max_connections=4):
+        self._args = (uri, plain_text_password, timeout_ms, flags)
+        self._pool = ClientPool(max_size=max_connections)
+        self._pool.checkin(self._pool.checkout(*self._args))
+
+    def _iter(self, name, args, kwargs):
+        with self._pool.client(*self._args) as client:
+            for item in getattr(client, name)(*args, **kwargs):
+                yield item
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in PooledClient._EXCLUDED or \
+                not callable(getattr(Client, name, None)):
+            raise AttributeError("'PooledClient' object has no attribute "
+                                 "'%s'" % name)
+
+        if name.endswith('_iter'):
+            def _call(*args, **kwargs):
+                return self._iter(name, args, kwargs)
+        else:
+            def _call(*args, **kwargs):
+                with self._pool.client(*self._args) as client:
+                    return getattr(client, name)(*args, **kwargs)
+        _call.__name__ = name
+        _call.__doc__ = getattr(Client, name).__doc__
+        return _call
+
+    def close(self):
+        """
+        Closes the plug-in connections, those in use are closed once the
+        call using them is done.
+        """
+        self._pool.close()
+
+
+class MultiClient(object):
+    """
+    Runs the same query against many storage arrays at the same time and
+    merges the results:
+
+        mc = lsm.MultiClient([('sim://', None), ('ontap://root@na1', pw)],
+                             max_workers=32, timeout=600)
+        (volumes, errors) = mc.query('volumes')
+        for (uri, vol) in volumes:
+            ...
+        for (uri, lsm_err) in errors.items():
+            ...
+
+    arrays is a list of (uri, plain_text_password) pairs, or of URIs for
+    arrays without password.  At most max_workers arrays are queried at the
+    same time, each from a thread of its own with a Client created for the
+    query and closed after it, or got from pool, a lsm.ClientPool, when
+    given.  timeout_ms and flags are passed on to Client.
+
+    An array not done after timeout seconds, None for no limit, counts as
+    failed with ErrorNumber.TIMEOUT.  Its thread is left to finish on its
+    own and no longer counts against max_workers.
+    """
+
+    def __init__(self, arrays, max_workers=16, timeout=None,
+                 timeout_ms=30000, flags=0, pool=None):
+        self.arrays = [(a, None) if isinstance(a, six.string_types)
+                       else tuple(a) for a in arrays]
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timeout_ms = timeout_ms
+        self.flags = flags
+        self.pool = pool
+
+    @staticmethod
+    def _invoke(client, method, args, kwargs):
+        if callable(method):
+            return method(client, *args, **kwargs)
+        return getattr(client, method)(*args, **kwargs)
+
+    def _call(self, uri, password, method, args, kwargs):
+        if self.pool is not None:
+            with self.pool.client(uri, password, self.timeout_ms,
+                                  self.flags) as client:
+                return MultiClient._invoke(client, method, args, kwargs)
+
+        client = Client(uri, password, self.timeout_ms, self.flags)
+        try:
+            return MultiClient._invoke(client, method, args, kwargs)
+        finally:
+            ClientPool._close_client(client)
+
+    def _run(self, method, args, kwargs):
+        """
+        Generator of (index in arrays, result, error) of the arrays as they
+        are done, error is None when the query went fine.
+        """
+        cond = threading.Condition()
+        todo = collections.deque(enumerate(self.arrays))
+        # index => deadline of the arrays being queried
+        running = {}
+        done = collections.deque()
+
+        def worker(index, uri, password):
+            try:
+                rc = (index, self._call(uri, password, method, args, kwargs),
+                      None)
+            except Exception as e:
+                rc = (index, None, e)
+            with cond:
+                # Not there any more when it timed out
+                if running.pop(index, False) is not False:
+                    done.append(rc)
+                    cond.notify()
+
+        left = len(self.arrays)
+        while left:
+            with cond:
+                while todo and len(running) < self.max_workers:
+                    (index, (uri, password)) = todo.popleft()
+                    running[index] = None
+                    if self.timeout is not None:
+                        running[index] = time.time() + self.timeout
+                    t = threading.Thread(target=worker,
+                                         args=(index, uri, password))
+                    t.daemon = True
+                    t.start()
+
+                while not done:
+                    now = time.time()
+                    deadlines = [d for d in running.values()
+                                 if d is not None]
+                    for (index, deadline) in list(running.items()):
+                        if deadline is not None and deadline <= now:
+                            del running[index]
+                            done.append((index, None, LsmError(
+                                ErrorNumber.TIMEOUT,
+                                "Query of %s not done after %s seconds" %
+                                (self.arrays[index][0], self.timeout))))
+                    if not done:
+                        cond.wait(min(deadlines) - now if deadlines else None)
+
+                finished = list(done)
+                done.clear()
+
+            for rc in finished:
+                left -= 1
+                yield rc
+
+    def query_iter(self, method, *args, **kwargs):
+        """
+        Like query() but a generator of (uri, result, error) for each array
+        as soon as it is done, error is the exception the query raised or
+        None.
+        """
+        for (index, result, error) in self._run(method, args, kwargs):
+            yield (self.arrays[index][0], result, error)
+
+    def query(self, method, *args, **kwargs):
+        """
+        Calls method of Client with args and kwargs for every array, method
+        being the name of a method like 'volumes' or a callable taking the
+        Client first.
+
+        Returns (results, errors), results being a list of (uri, item) for
+        every item of the lists the arrays returned, or (uri, result) for
+        the arrays not returning a list, in the order of arrays.  errors is
+        a dictionary of the exception raised, usually a LsmError, by the
+        URI of the arrays which failed.
+        """
+        results = {}
+        errors = {}
+        for (index, result, error) in self._run(method, args, kwargs):
+            if error is None:
+                results[index] = result
+            else:
+                errors[self.arrays[index][0]] = error
+
+        merged = []
+        for index in sorted(results):
+            uri = self.arrays[index][0]
+            if isinstance(results[index], list):
+                merged.extend((uri, item) for item in results[index])
+            else:
+                merged.append((uri, results[index]))
+        return (merged, errors)
+
+
+class ClientCache(object):
+    """
+    Cache of the replies of the read only Client methods, to make repeated
+    calls like systems() or capabilities() skip the round trip to the
+    plug-in, and for plug-ins like megaraid or hpsa, the run of the array
+    command line tool.  Caching is opt-in, per client:
+
+        c = lsm.Client('megaraid://')
+        c.cache = lsm.ClientCache()
+
+    A ClientCache serves a single client, as the replies it holds are those
+    of one array.  Giving it to another client raises a LsmError.
+
+    Replies are keyed by method and arguments and kept for the number of
+    seconds given for the method in ttl, a dictionary merged with
+    DEFAULT_TTL; methods missing from both or with a ttl of 0 are not cached.
+    At most max_size replies are kept, the least recently used ones are
+    dropped first.  NO_SUPPORT errors are cached like replies, as they
+    depend on what the plug-in can do rather than on the state of the array.
+
+    Every cached method depends on some namespaces of the array state
+    (volumes, pools, ...).  Any other method is taken as a change of the
+    array, it drops the replies of the namespaces it changes, or of all
+    namespaces when it is not known.  When a change runs as a job, its
+    namespaces are dropped again once the job is found finished.
+
+    The objects returned for a cached reply are shared with the cache and
+    later hits, they must not be modified.
+    """
+
+    DEFAULT_TTL = {
+        'plugin_info': 600,
+        'capabilities': 300,
+        'systems': 60,
+        'volume_raid_create_cap_get': 300,
+        'volume_replicate_range_block_size': 300,
+        'export_auth': 300,
+        'target_ports': 60,
+        'pools': 10,
+        'pool_member_info': 10,
+        'volumes': 10,
+        'volume_raid_info': 10,
+        'volume_cache_info': 10,
+        'disks': 10,
+        'batteries': 10,
+        'access_groups': 10,
+        'volumes_accessible_by_access_group': 10,
+        'access_groups_granted_to_volume': 10,
+        'fs': 10,
+        'fs_snapshots': 10,
+        'exports': 10,
+    }
+
+    # Namespaces the reply of each cacheable method depends on.
+    _READS = {
+        'plugin_info': (),
+        'capabilities': ('systems',),
+        'systems': ('systems',),
+        'volume_raid_create_cap_get': ('systems',),
+        'volume_replicate_range_block_size': ('systems',),
+        'export_auth': (),
+        'target_ports': ('target_ports',),
+        'pools': ('pools',),
+        'pool_member_info': ('pools',),
+        'volumes': ('volumes',),
+        'volume_raid_info': ('volumes',),
+        'volume_cache_info': ('volumes',),
+        'disks': ('disks',),
+        'batteries': ('batteries',),
+        'access_groups': ('access_groups',),
+        'volumes_accessible_by_access_group': ('volumes', 'access_groups'),
+        'access_groups_granted_to_volume': ('volumes', 'access_groups'),
+        'fs': ('fs',),
+        'fs_snapshots': ('fs',),
+        'exports': ('exports',),
+    }
+
+    # Namespaces changed by each method changing the array.  Methods which
+    # are neither here, in _READS nor in _UNCACHED change everything.
+    _WRITES = {
+        'system_read_cache_pct_update': ('systems',),
+        'iscsi_chap_auth': (),
+        'volume_create': ('volumes', 'pools'),
+        'volume_resize': ('volumes', 'pools'),
+        'volume_replicate': ('volumes', 'pools'),
+        'volume_replicate_range': ('volumes',),
+        'volume_delete': ('volumes', 'pools', 'access_groups'),
+        'volume_enable': ('volumes',),
+        'volume_disable': ('volumes',),
+        'volume_child_dependency_rm': ('volumes', 'pools'),
+        'volume_raid_create': ('volumes', 'pools', 'disks'),
+        'volume_ident_led_on': (),
+        'volume_ident_led_off': (),
+        'volume_physical_disk_cache_update': ('volumes',),
+        'volume_write_cache_policy_update': ('volumes',),
+        'volume_read_cache_policy_update': ('volumes',),
+        'volume_mask': ('access_groups',),
+        'volume_unmask': ('access_groups',),
+        'access_group_create': ('access_groups',),
+        'access_group_delete': ('access_groups',),
+        'access_group_initiator_add': ('access_groups',),
+        'access_group_initiator_delete': ('access_groups',),
+        'fs_create': ('fs', 'pools'),
+        'fs_delete': ('fs', 'pools', 'exports'),
+        'fs_resize': ('fs', 'pools'),
+        'fs_clone': ('fs', 'pools'),
+        'fs_file_clone': ('fs',),
+        'fs_snapshot_create': ('fs',),
+        'fs_snapshot_delete': ('fs',),
+        'fs_snapshot_restore': ('fs',),
+        'fs_child_dependency_rm': ('fs', 'pools'),
+        'export_fs': ('exports',),
+        'export_remove': ('exports',),
+    }
+
+    # Read only methods which are never cached.
+    _UNCACHED = ('time_out_get', 'time_out_set', 'job_status', 'job_wait',
+                 'jobs_wait', 'job_free', 'plugin_stats',
+                 'volume_child_dependency', 'fs_child_dependency')
+
+    _ALL = None
+
+    def __init__(self, ttl=None, max_size=1024):
+        self.ttl = dict(ClientCache.DEFAULT_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._lock = threading.Lock()
+        # (method, raw, arguments) => (expiry time, result or LsmError), the
+        # least recently used first.
+        self._entries = collections.OrderedDict()
+        # Method => [hits, misses]
+        self._methods = {}
+        # Bumped by every invalidation, a reply is only stored if nothing
+        # got invalidated while it was on its way.
+        self._epoch = 0
+        # Id of the jobs started by a change => namespaces it changes
+        self._jobs = {}
+        # Transport of the client the cache belongs to.
+        self._tp = None
+
+    def _attach(self, tp):
+        """
+        Makes the cache the one of the client using the transport tp.
+        """
+        with self._lock:
+            if self._tp is not None and self._tp is not tp:
+                raise LsmError(ErrorNumber.INVALID_ARGUMENT,
+                               "ClientCache is used by another client")
+            self._tp = tp
+
+    def stats(self):
+        """
+        Returns {method: {'hits': n, 'misses': n}} of the cached methods
+        called so far.  The totals are in the hits, misses, evictions and
+        invalidations attributes.
+        """
+        with self._lock:
+            return dict((m, {'hits': h, 'misses': mi})
+                        for (m, (h, mi)) in self._methods.items())
+
+    def clear(self):
+        """
+        Drops every cached reply.
+        """
+        self.invalidate(ClientCache._ALL)
+
+    def invalidate(self, namespaces):
+        """
+        Drops the cached replies depending on any of namespaces, a list of
+        names like 'volumes' or 'pools', or on anything when None.
+        """
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            for key in list(self._entries):
+                if namespaces is ClientCache._ALL or \
+                        set(ClientCache._READS[key[0]]) & set(namespaces):
+                    del self._entries[key]
+
+    def _count(self, method, hit):
+        counts = self._methods.setdefault(method, [0, 0])
+        if hit:
+            self.hits += 1
+            counts[0] += 1
+        else:
+            self.misses += 1
+            counts[1] += 1
+
+    def _lookup(self, key):
+        """
+        Returns (hit, entry), must be called with self._lock held.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return False, None
+        # Most recently used goes last
+        del self._entries[key]
+        self._entries[key] = entry
+        return True, entry[1]
+
+    def _store(self, key, ttl, epoch, value):
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @staticmethod
+    def _returned(value):
+        if isinstance(value, LsmError):
+            raise value
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def rpc(self, tp, method, args, raw=False):
+        """
+        Does tp.rpc(method, args, raw), through the cache.
+        """
+        ttl = self.ttl.get(method) if method in ClientCache._READS else None
+        if ttl:
+            key = (method, raw,
+                   json.dumps(args, cls=_DataEncoder, sort_keys=True))
+            with self._lock:
+                (hit, value) = self._lookup(key)
+                self._count(method, hit)
+                epoch = self._epoch
+            if hit:
+                return ClientCache._returned(value)
+
+            try:
+                result = tp.rpc(method, args, raw)
+            except LsmError as lsm_err:
+                if lsm_err.code == ErrorNumber.NO_SUPPORT:
+                    self._store(key, ttl, epoch, lsm_err)
+                raise
+            self._store(key, ttl, epoch, result)
+            return ClientCache._returned(result)
+
+        result = None
+        try:
+            result = tp.rpc(method, args, raw)
+        finally:
+            self._changed(method, args, result)
+        return result
+
+    def rpc_batch(self, tp, requests, flags=0):
+        """
+        Does tp.rpc_batch(requests, flags), dropping what the requests
+        changed.  Batches are never answered from the cache.
+        """
+        results = [None] * len(requests)
+        try:
+            results = tp.rpc_batch(requests, flags)
+        finally:
+            for ((method, args), result) in zip(requests, results):
+                self._changed(method, args, result)
+        return results
+
+    def _changed(self, method, args, result):
+        """
+        Drops what a request which was not answered from the cache changed,
+        result is None when it is not known.
+        """
+        if method in ClientCache._READS or method in ClientCache._UNCACHED:
+            self._jobs_done(method, args, result)
+            return
+
+        namespaces = ClientCache._WRITES.get(method, ClientCache._ALL)
+        if namespaces == ():
+            return
+        self.invalidate(namespaces)
+        job_id = ClientCache._job_id(result)
+        if job_id is not None:
+            with self._lock:
+                self._jobs[job_id] = namespaces
+
+    @staticmethod
+    def _job_id(result):
+        if isinstance(result, six.string_types):
+            return result
+        if isinstance(result, (list, tuple)) and result and \
+                isinstance(result[0], six.string_types):
+            return result[0]
+        return None
+
+    def _jobs_done(self, method, args, result):
+        """
+        Drops the namespaces changed by the jobs which the result of a job
+        status method shows finished, or which may have finished when the
+        result is not known.
+        """
+        if method in ('job_status', 'job_wait'):
+            if isinstance(result, (list, tuple)) and \
+                    result[0] == JobStatus.INPROGRESS:
+                return
+            done = [args['job_id']]
+        elif method == 'jobs_wait':
+            if isinstance(result, list):
+                done = [r[0] for r in result]
+            else:
+                done = args['job_ids']
+        else:
+            return
+
+        with self._lock:
+            namespaces = [self._jobs.pop(job_id, ()) for job_id in done]
+        for n in namespaces:
+            if n != ():
+                self.invalidate(n)
+
+
+class _CachedTransPort(object):
+    """
+    Transport of a Client with a ClientCache, sends rpc() through the cache.
+    """
+
+    def __init__(self, tp, cache):
+        self.tp = tp
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.tp, name)
+
+    def rpc(self, method, args, raw=False):
+        return self.cache.rpc(self.tp, method, args, raw)
+
+    def rpc_batch(self, requests, flags=0):
+        return self.cache.rpc_batch(self.tp, requests, flags)
@@ -17,20 +17,18 @@
 import hashlib
 
 import os
-import unittest
 import re
 
 import sys
 import syslog
+import time
 import collections
 import inspect
+import types
 
 try:
-    from urllib.error import (URLError, HTTPError)
     from urllib.parse import urlparse
 except ImportError:
-    from urllib2 import (URLError,
-                         HTTPError)
     from urlparse import urlparse
 import functools
 import traceback
@@ -62,6 +60,11 @@ def decorator(cls):
 
 
 def common_urllib2_error_handler(exp):
+    # Only plug-ins talking http need urllib, don't import it for everyone
+    try:
+        from urllib.error import (URLError, HTTPError)
+    except ImportError:
+        from urllib2 import (URLError, HTTPError)
 
     if isinstance(exp, HTTPError):
         raise LsmError(ErrorNumber.PLUGIN_AUTH_FAILED, str(exp))
@@ -125,8 +128,13 @@ def __getattr__(self, name):
     def _present(self, _proxy_method_name, *args, **kwargs):
         """
         Method which is called to invoke the actual method of interest.
+        Plug-in methods may return a generator to stream their result, the
+        caller always gets a list.
         """
-        return getattr(self.proxied_obj, _proxy_method_name)(*args, **kwargs)
+        rc = getattr(self.proxied_obj, _proxy_method_name)(*args, **kwargs)
+        if isinstance(rc, types.GeneratorType):
+            return list(rc)
+        return rc
 
 # variable in client and specified on the command line for the daemon
 UDS_PATH = '/var/run/lsm/ipc'
@@ -331,6 +339,32 @@ def int_div(a, b):
         return a / b
 
 
+def poll_with_backoff(check, timeout=None, interval=0.05, max_interval=2.0):
+    """
+    Calls check() until it returns something else than None and returns that.
+    The first wait between two calls is interval seconds, it doubles up to
+    max_interval so that quick operations are noticed quickly while long ones
+    do not cost a check every interval.  Returns None once timeout seconds
+    passed, None waits forever.
+    """
+    if timeout is not None:
+        end = time.time() + timeout
+
+    while True:
+        rc = check()
+        if rc is not None:
+            return rc
+
+        if timeout is not None:
+            left = end - time.time()
+            if left <= 0:
+                return None
+            interval = min(interval, left)
+
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
 # Converts a list of arguments to string.
 # @param    args    Args to join
 # @return string of arguments joined together.
@@ -571,37 +605,61 @@ def inner(*args, **kwargs):
                 type_compare(func.__name__, types[0], r)
 
             return r
+        # functools.wraps() only sets this on python 3, lsm.Batch needs the
+        # undecorated method.
+        inner.__wrapped__ = func
         return inner
     return outer
 
 
-class TestCommon(unittest.TestCase):
-    def setUp(self):
-        pass
+if __name__ == '__main__':
+    import unittest
 
-    def test_simple(self):
+    class TestCommon(unittest.TestCase):
+        def setUp(self):
+            pass
 
-        try:
-            raise SocketEOF()
-        except SocketEOF as e:
-            self.assertTrue(isinstance(e, SocketEOF))
+        def test_simple(self):
 
-        try:
-            raise LsmError(10, 'Message', 'Data')
-        except LsmError as e:
-            self.assertTrue(e.code == 10 and e.msg == 'Message' and
-                            e.data == 'Data')
+            try:
+                raise SocketEOF()
+            except SocketEOF as e:
+                self.assertTrue(isinstance(e, SocketEOF))
 
-        ed = addl_error_data('domain', 'level', 'exception', 'debug',
-                             'debug_data')
-        self.assertTrue(ed['domain'] == 'domain' and ed['level'] == 'level' and
-                        ed['debug'] == 'debug' and
-                        ed['exception'] == 'exception' and
-                        ed['debug_data'] == 'debug_data')
+            try:
+                raise LsmError(10, 'Message', 'Data')
+            except LsmError as e:
+                self.assertTrue(e.code == 10 and e.msg == 'Message' and
+                                e.data == 'Data')
 
-    def tearDown(self):
-        pass
+            ed = addl_error_data('domain', 'level', 'exception', 'debug',
+                                 'debug_data')
+            self.assertTrue(ed['domain'] == 'domain' and
+                            ed['level'] == 'level' and
+                            ed['debug'] == 'debug' and
+                            ed['exception'] == 'exception' and
+                            ed['debug_data'] == 'debug_data')
+
+        def test_poll_with_backoff(self):
+            calls = []
+
+            def check():
+                calls.append(time.time())
+                if len(calls) == 4:
+                    return 'done'
+                return None
+
+            self.assertTrue(poll_with_backoff(check, interval=0.01) == 'done')
+            self.assertTrue(len(calls) == 4)
+            # The interval doubles each time
+            self.assertTrue(calls[3] - calls[2] > calls[1] - calls[0])
+
+            start = time.time()
+            self.assertTrue(poll_with_backoff(lambda: None, 0.1, 0.01) is None)
+            self.assertTrue(0.1 <= time.time() - start < 1)
+
+        def tearDown(self):
+            pass
 
 
-if __name__ == '__main__':
     unittest.main()
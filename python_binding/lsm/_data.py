@@ -27,9 +27,12 @@
 except ImportError:
     import json
 
-from json.decoder import WHITESPACE
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-from lsm._common import get_class, default_property, ErrorNumber, LsmError
+from lsm._common import default_property, ErrorNumber, LsmError
 
 import six
 
@@ -49,60 +52,145 @@ def default(self, my_class):
 class DataDecoder(json.JSONDecoder):
     """
     Custom json decoder for objects derived from ILsmData
+
+    Objects are created by IData._factory() from the object_hook while json
+    parses the message, so no second walk over the decoded data is needed.
     """
 
-    @staticmethod
-    def __process_dict(d):
-        """
-        Processes a dictionary
-        """
-        rc = {}
+    def __init__(self, *args, **kwargs):
+        kwargs['object_hook'] = IData._factory
+        json.JSONDecoder.__init__(self, *args, **kwargs)
 
-        if 'class' in d:
-            rc = IData._factory(d)
-        else:
-            for (k, v) in d.items():
-                rc[k] = DataDecoder.__decode(v)
 
-        return rc
+class MsgPackCodec(object):
+    """
+    Compact binary alternative to DataEncoder/DataDecoder, only available
+    when the msgpack module (with its C extension) is installed.
+
+    Objects derived from IData are packed as msgpack extension types holding
+    a schema index followed by the attribute values in schema order.  The
+    first object of each schema in a message also carries the class name and
+    the attribute names, every later object of the same schema only carries
+    the values.  As msgpack packs and unpacks in the same order, the decoder
+    always sees the schema definition before it is used.
+    """
+
+    _EXT_IDATA = 1
+    _EXT_IDATA_SCHEMA = 2
+
+    # Which classes have their own _to_dict()
+    _custom_to_dict = {}
+
+    @staticmethod
+    def available():
+        # The pure python fallback of msgpack is slower than json, only use
+        # msgpack when its C extension is present.
+        return msgpack is not None and \
+            msgpack.Packer.__module__ != 'msgpack.fallback'
 
     @staticmethod
-    def __process_list(l):
+    def _unpack_args():
+        if msgpack.version >= (0, 5, 2):
+            return {'raw': False}
+        return {'encoding': 'utf-8'}
+
+    @staticmethod
+    def dumps(obj):
         """
-        Processes a list
+        Returns the packed bytes of obj.
         """
-        rc = []
-        for elem, value in enumerate(l):
-            if type(value) is list:
-                rc.append(DataDecoder.__process_list(value))
-            elif type(value) is dict:
-                rc.append(DataDecoder.__process_dict(value))
+        schemas = {}
+
+        def default(o):
+            if not isinstance(o, IData):
+                raise ValueError('incorrect class type:' + str(type(o)))
+
+            cls = type(o)
+            custom = MsgPackCodec._custom_to_dict.get(cls)
+            if custom is None:
+                custom = any('_to_dict' in c.__dict__
+                             for c in cls.__mro__ if c is not IData)
+                MsgPackCodec._custom_to_dict[cls] = custom
+
+            if custom:
+                d = o._to_dict()
+                del d['class']
+                keys = tuple(d)
+                values = [d[k] for k in keys]
             else:
-                rc.append(value)
-        return rc
+                keys = cls.__slots__
+                values = [getattr(o, k) for k in keys]
+
+            schema = (cls.__name__, keys)
+
+            if schema in schemas:
+                return msgpack.ExtType(
+                    MsgPackCodec._EXT_IDATA,
+                    msgpack.packb([schemas[schema]] + values,
+                                  default=default, use_bin_type=False))
+
+            schemas[schema] = len(schemas)
+            if custom:
+                names = list(keys)
+            else:
+                names = [k[1:] for k in keys]
+            return msgpack.ExtType(
+                MsgPackCodec._EXT_IDATA_SCHEMA,
+                msgpack.packb([schemas[schema], cls.__name__, names] + values,
+                              default=default, use_bin_type=False))
+
+        # Strings are always sent as msgpack raw and decoded as UTF-8 text on
+        # the other side, which is what json does too.
+        return msgpack.packb(obj, default=default, use_bin_type=False)
 
     @staticmethod
-    def __decode(e):
+    def loads(data, raw=False):
         """
-        Decodes the parsed json
+        Returns the object unpacked from data.  When raw is True, IData
+        objects are returned as dictionaries in the form of their _to_dict().
         """
-        if type(e) is dict:
-            return DataDecoder.__process_dict(e)
-        elif type(e) is list:
-            return DataDecoder.__process_list(e)
-        else:
-            return e
+        # Index => (class, constructor argument names), or (class name,
+        # attribute names) when raw
+        schemas = {}
+        args = MsgPackCodec._unpack_args()
+
+        def ext_hook(code, packed):
+            if code == MsgPackCodec._EXT_IDATA:
+                values = msgpack.unpackb(packed, ext_hook=ext_hook, **args)
+                cls, names = schemas[values[0]]
+                values = values[1:]
+            elif code == MsgPackCodec._EXT_IDATA_SCHEMA:
+                values = msgpack.unpackb(packed, ext_hook=ext_hook, **args)
+                if raw:
+                    cls, names = values[1], values[2]
+                else:
+                    cls, arg_names = IData._class_table[values[1]]
+                    names = [arg_names.get(n) or '_' + n for n in values[2]]
+                schemas[values[0]] = (cls, names)
+                values = values[3:]
+            else:
+                return msgpack.ExtType(code, packed)
+
+            if raw:
+                d = dict(zip(names, values))
+                d['class'] = cls
+                return d
+            return cls(**dict(zip(names, values)))
 
-    def decode(self, json_string, _w=WHITESPACE.match):
-        return DataDecoder.__decode(json.loads(json_string))
+        return msgpack.unpackb(bytes(data), ext_hook=ext_hook, **args)
 
 
 class IData(with_metaclass(_ABCMeta, object)):
     """
     Base class functionality of serializable
     classes.
+
+    Classes derived from IData list their attributes in __slots__ instead of
+    having a per instance __dict__, which keeps large inventories compact.
     """
 
+    __slots__ = ()
+
     def _to_dict(self):
         """
         Represent the class as a dictionary
@@ -111,7 +199,8 @@ def _to_dict(self):
 
         # If one of the attributes is another IData we will
         # process that too, is there a better way to handle this?
-        for (k, v) in list(self.__dict__.items()):
+        for k in self.__slots__:
+            v = getattr(self, k)
             if isinstance(v, IData):
                 rc[k[1:]] = v._to_dict()
             else:
@@ -119,25 +208,45 @@ def _to_dict(self):
 
         return rc
 
+    # Class name => (class, {dictionary key: constructor argument name}),
+    # filled by _class_table_init() once all the classes are defined.
+    _class_table = {}
+
+    @staticmethod
+    def _class_table_init():
+        for c in IData.__subclasses__():
+            code = six.get_unbound_function(c.__init__).__code__
+            args = code.co_varnames[1:code.co_argcount]
+            IData._class_table[c.__name__] = \
+                (c, dict((a[1:], a) for a in args))
+
     @staticmethod
     def _factory(d):
         """
         Factory for creating the appropriate class given a dictionary.
-        This only works for objects that inherit from IData
+        This only works for objects that inherit from IData, any IData held
+        by the dictionary must already be created.  Dictionaries without a
+        'class' key are returned unchanged.
         """
-        if 'class' in d:
-            class_name = d['class']
-            del d['class']
-            c = get_class(__name__ + '.' + class_name)
-
-            # If any of the parameters are themselves an IData process them
-            for k, v in list(d.items()):
-                if isinstance(v, dict) and 'class' in v:
-                    d['_' + k] = IData._factory(d.pop(k))
-                else:
-                    d['_' + k] = d.pop(k)
+        class_name = d.pop('class', None)
+        if class_name is None:
+            return d
 
-            return c(**d)
+        c, args = IData._class_table[class_name]
+        return c(**dict((args.get(k) or '_' + k, v) for k, v in d.items()))
+
+    @staticmethod
+    def _factory_all(o):
+        """
+        Returns o with every IData dictionary it holds, at any depth,
+        replaced by the IData object.
+        """
+        if isinstance(o, list):
+            return [IData._factory_all(v) for v in o]
+        if isinstance(o, dict):
+            return IData._factory(dict((k, IData._factory_all(v))
+                                       for k, v in o.items()))
+        return o
 
     def __str__(self):
         """
@@ -247,6 +356,10 @@ class Disk(IData):
     HEALTH_STATUS_WARN = 1
     HEALTH_STATUS_GOOD = 2
 
+    __slots__ = ('_id', '_name', '_disk_type', '_block_size', '_num_of_blocks',
+                 '_status', '_system_id', '_plugin_data', '_vpd83',
+                 '_location', '_rpm', '_link_type')
+
     def __init__(self, _id, _name, _disk_type, _block_size, _num_of_blocks,
                  _status, _system_id, _plugin_data=None, _vpd83='',
                  _location='', _rpm=RPM_NO_SUPPORT,
@@ -462,6 +575,9 @@ class Volume(IData):
     PHYSICAL_DISK_CACHE_DISABLED = 3
     PHYSICAL_DISK_CACHE_USE_DISK_SETTING = 4
 
+    __slots__ = ('_id', '_name', '_vpd83', '_block_size', '_num_of_blocks',
+                 '_admin_state', '_system_id', '_pool_id', '_plugin_data')
+
     def __init__(self, _id, _name, _vpd83, _block_size, _num_of_blocks,
                  _admin_state, _system_id, _pool_id, _plugin_data=None):
         self._id = _id                        # Identifier
@@ -520,6 +636,9 @@ class System(IData):
     READ_CACHE_PCT_NO_SUPPORT = -2
     READ_CACHE_PCT_UNKNOWN = -1
 
+    __slots__ = ('_id', '_name', '_status', '_status_info', '_plugin_data',
+                 '_fw_version', '_read_cache_pct', '_mode')
+
     def __init__(self, _id, _name, _status, _status_info, _plugin_data=None,
                  _fw_version='', _mode=None, _read_cache_pct=None):
         self._id = _id
@@ -639,6 +758,10 @@ class Pool(IData):
     MEMBER_TYPE_DISK = 2
     MEMBER_TYPE_POOL = 3
 
+    __slots__ = ('_id', '_name', '_element_type', '_unsupported_actions',
+                 '_total_space', '_free_space', '_status', '_status_info',
+                 '_system_id', '_plugin_data')
+
     def __init__(self, _id, _name, _element_type, _unsupported_actions,
                  _total_space, _free_space,
                  _status, _status_info, _system_id, _plugin_data=None):
@@ -667,6 +790,9 @@ def __init__(self, _id, _name, _element_type, _unsupported_actions,
 class FileSystem(IData):
     SUPPORTED_SEARCH_KEYS = ['id', 'system_id', 'pool_id']
 
+    __slots__ = ('_id', '_name', '_total_space', '_free_space', '_pool_id',
+                 '_system_id', '_plugin_data')
+
     def __init__(self, _id, _name, _total_space, _free_space, _pool_id,
                  _system_id, _plugin_data=None):
         self._id = _id
@@ -684,6 +810,8 @@ def __init__(self, _id, _name, _total_space, _free_space, _pool_id,
 @default_property("plugin_data", doc="Private plugin data")
 class FsSnapshot(IData):
 
+    __slots__ = ('_id', '_name', '_ts', '_plugin_data')
+
     def __init__(self, _id, _name, _ts, _plugin_data=None):
         self._id = _id
         self._name = _name
@@ -707,6 +835,9 @@ class NfsExport(IData):
     ANON_UID_GID_NA = -1
     ANON_UID_GID_ERROR = -2
 
+    __slots__ = ('_id', '_fs_id', '_export_path', '_auth', '_root', '_rw',
+                 '_ro', '_anonuid', '_anongid', '_options', '_plugin_data')
+
     def __init__(self, _id, _fs_id, _export_path, _auth, _root, _rw, _ro,
                  _anonuid, _anongid, _options, _plugin_data=None):
         assert (_fs_id is not None)
@@ -729,6 +860,8 @@ def __init__(self, _id, _fs_id, _export_path, _auth, _root, _rw, _ro,
 @default_property('dest_block', doc="Destination logical block address")
 @default_property('block_count', doc="Number of blocks")
 class BlockRange(IData):
+    __slots__ = ('_src_block', '_dest_block', '_block_count')
+
     def __init__(self, _src_block, _dest_block, _block_count):
         self._src_block = _src_block
         self._dest_block = _dest_block
@@ -750,6 +883,9 @@ class AccessGroup(IData):
     INIT_TYPE_ISCSI_IQN = 5
     INIT_TYPE_ISCSI_WWPN_MIXED = 7
 
+    __slots__ = ('_id', '_name', '_init_ids', '_init_type', '_system_id',
+                 '_plugin_data')
+
     def __init__(self, _id, _name, _init_ids, _init_type, _system_id,
                  _plugin_data=None):
         self._id = _id
@@ -863,6 +999,10 @@ class TargetPort(IData):
     TYPE_FCOE = 3
     TYPE_ISCSI = 4
 
+    __slots__ = ('_id', '_port_type', '_service_address', '_network_address',
+                 '_physical_address', '_physical_name', '_system_id',
+                 '_plugin_data')
+
     def __init__(self, _id, _port_type, _service_address,
                  _network_address, _physical_address, _physical_name,
                  _system_id, _plugin_data=None):
@@ -1014,6 +1154,8 @@ def _to_dict(self):
         return {'class': self.__class__.__name__,
                 'cap': ''.join(['%02x' % b for b in self._cap])}
 
+    __slots__ = ('_cap',)
+
     def __init__(self, _cap=None):
         if _cap is not None:
             self._cap = bytearray(binascii.unhexlify(_cap))
@@ -1090,6 +1232,9 @@ class Battery(IData):
     STATUS_DEGRADED = 1 << 6
     STATUS_ERROR = 1 << 7
 
+    __slots__ = ('_id', '_name', '_type', '_status', '_system_id',
+                 '_plugin_data')
+
     def __init__(self, _id, _name, _type, _status, _system_id,
                  _plugin_data=None):
         self._id = _id
@@ -1100,6 +1245,166 @@ def __init__(self, _id, _name, _type, _status, _system_id,
         self._plugin_data = _plugin_data
 
 
+class ColumnTable(object):
+    """
+    Column oriented list of lsm data objects of one class, as returned by
+    lsm.Client.volumes_columns() and friends.  Values are kept in one list
+    per attribute instead of one object per item, which is much cheaper to
+    build and to aggregate for large results, e.g. space used per pool:
+
+        t = client.volumes_columns()
+        used = {}
+        for pool_id, bs, nob in zip(t['pool_id'], t['block_size'],
+                                    t['num_of_blocks']):
+            used[pool_id] = used.get(pool_id, 0) + bs * nob
+
+    Columns hold the attribute values as sent by the plug-in, so values which
+    the object properties would check (e.g. Disk.vpd83 being '' when not
+    supported) are returned as is.
+    """
+
+    # Class => {attribute name: constructor default}
+    _defaults = {}
+
+    @staticmethod
+    def _class_defaults(cls):
+        if cls not in ColumnTable._defaults:
+            init = six.get_unbound_function(cls.__init__)
+            args = init.__code__.co_varnames[1:init.__code__.co_argcount]
+            defaults = init.__defaults__ or ()
+            ColumnTable._defaults[cls] = dict(
+                (a[1:], d) for a, d in zip(args[len(args) - len(defaults):],
+                                           defaults))
+        return ColumnTable._defaults[cls]
+
+    def __init__(self, cls, items):
+        """
+        Creates the table of class cls from items, a list of dictionaries in
+        the form of IData._to_dict().  Keys missing from an item get the
+        default value of the class constructor.
+        """
+        self.cls = cls
+        self.names = [a[1:] for a in cls.__slots__]
+        self._len = len(items)
+
+        defaults = ColumnTable._class_defaults(cls)
+        self._columns = {}
+        for n in self.names:
+            default = defaults.get(n)
+            self._columns[n] = [i.get(n, default) for i in items]
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, name):
+        """
+        Returns the list of values of attribute name.
+        """
+        return self._columns[name]
+
+    def objects(self):
+        """
+        Generator yielding the items as objects of the table class.
+        """
+        args = ['_' + n for n in self.names]
+        for values in six.moves.zip(*[self._columns[n] for n in self.names]):
+            yield self.cls(**dict(zip(args, values)))
+
+    def numpy(self):
+        """
+        Returns a dictionary of attribute name => numpy array of its values,
+        raises LsmError ErrorNumber.NO_SUPPORT if numpy is not installed.
+        """
+        # numpy is slow to import, only do so when asked for.
+        try:
+            import numpy
+        except ImportError:
+            raise LsmError(ErrorNumber.NO_SUPPORT,
+                           "The numpy module is not installed")
+        return dict((n, numpy.array(c)) for n, c in self._columns.items())
+
+
+IData._class_table_init()
+
+
 if __name__ == '__main__':
-    # TODO Need some unit tests that encode/decode all the types with nested
-    pass
+    import unittest
+
+    class _TestCodec(unittest.TestCase):
+        def setUp(self):
+            cap = Capabilities()
+            cap.set(Capabilities.VOLUMES)
+            self.msg = {
+                'id': 1,
+                'result': [
+                    Volume('VOL_1', 'vol_1',
+                           '600508b1001c0000000000000000000a', 512, 2 ** 40,
+                           Volume.ADMIN_STATE_ENABLED, 'sys', 'p1'),
+                    Volume('VOL_2', u'vol_\u00e9', '', 4096, 1,
+                           Volume.ADMIN_STATE_DISABLED, 'sys', 'p1', 'data'),
+                    AccessGroup('AG_1', 'ag', ['iqn.1994-05.com.domain:01.a'],
+                                AccessGroup.INIT_TYPE_ISCSI_IQN, 'sys'),
+                    cap, None, [1, 'two', {'three': 3.0}]]}
+
+        def _check(self, msg):
+            vol_1, vol_2, ag, cap, none, misc = msg['result']
+            self.assertTrue(msg['id'] == 1)
+            self.assertTrue(isinstance(vol_1, Volume))
+            self.assertTrue(vol_1.num_of_blocks == 2 ** 40)
+            self.assertTrue(vol_2.name == u'vol_\u00e9')
+            self.assertTrue(vol_2.plugin_data == 'data')
+            self.assertTrue(ag.init_ids == ['iqn.1994-05.com.domain:01.a'])
+            self.assertTrue(cap.supported(Capabilities.VOLUMES))
+            self.assertFalse(cap.supported(Capabilities.VOLUME_CREATE))
+            self.assertTrue(none is None)
+            self.assertTrue(misc == [1, 'two', {'three': 3.0}])
+
+        def test_json(self):
+            self._check(json.loads(json.dumps(self.msg, cls=DataEncoder),
+                                   cls=DataDecoder))
+
+        def test_msgpack(self):
+            if msgpack is None:
+                return
+            self._check(MsgPackCodec.loads(MsgPackCodec.dumps(self.msg)))
+
+        def test_msgpack_raw(self):
+            if msgpack is None:
+                return
+            msg = MsgPackCodec.loads(MsgPackCodec.dumps(self.msg), raw=True)
+            self.assertTrue(
+                msg['result'][0] == self.msg['result'][0]._to_dict())
+            self._check(IData._factory_all(msg))
+
+        def test_columns(self):
+            vols = [v._to_dict() for v in self.msg['result'][:2]]
+            t = ColumnTable(Volume, vols)
+            self.assertTrue(len(t) == 2)
+            self.assertTrue(t['id'] == ['VOL_1', 'VOL_2'])
+            self.assertTrue(t['num_of_blocks'] == [2 ** 40, 1])
+            self.assertTrue(t['plugin_data'] == [None, 'data'])
+            self.assertTrue([v.block_size for v in t.objects()] == [512, 4096])
+
+            # Missing keys get the constructor default
+            disk = Disk('DISK_1', 'disk', Disk.TYPE_SSD, 512, 1024,
+                        Disk.STATUS_OK, 'sys')._to_dict()
+            del disk['rpm']
+            t = ColumnTable(Disk, [disk])
+            self.assertTrue(t['rpm'] == [Disk.RPM_NO_SUPPORT])
+
+            self.assertTrue(len(ColumnTable(Pool, [])['total_space']) == 0)
+
+        def test_slots(self):
+            vol = self.msg['result'][0]
+            self.assertFalse(hasattr(vol, '__dict__'))
+            self.assertTrue(vol._to_dict() == {
+                'class': 'Volume', 'id': 'VOL_1', 'name': 'vol_1',
+                'vpd83': '600508b1001c0000000000000000000a', 'block_size': 512,
+                'num_of_blocks': 2 ** 40,
+                'admin_state': Volume.ADMIN_STATE_ENABLED,
+                'system_id': 'sys', 'pool_id': 'p1', 'plugin_data': None})
+            vol.name = 'renamed'
+            self.assertTrue(vol.name == 'renamed')
+
+
+    unittest.main()
@@ -0,0 +1,105 @@
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import time profiling, enabled by the LSM_IMPORT_PROFILE environment variable
+when lsm is imported:
+
+    LSM_IMPORT_PROFILE=1 lsmcli list --type PLUGINS
+    LSM_IMPORT_PROFILE=/tmp/lsm_imports.txt lsmd ...
+
+Every import loading modules from then on is timed.  At exit the imports are
+reported the way python 3.7 "-X importtime" does, self and cumulative time in
+microseconds with nested imports indented above their parent, to stderr or
+appended to the file named by the variable.  Unlike "-X importtime" this works
+on python 2 and for the plug-ins started by lsmd.
+"""
+
+import os
+import sys
+import time
+import atexit
+
+from six.moves import builtins
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# (depth, name, self seconds, cumulative seconds) in the order imports finish
+_records = []
+# [start, seconds spent in nested imports] of the imports in progress
+_stack = []
+_pid = None
+
+
+def _profiled(orig_import):
+    def _import(name, *args, **kwargs):
+        loaded = len(sys.modules)
+        frame = [_timer(), 0.0]
+        _stack.append(frame)
+        try:
+            return orig_import(name, *args, **kwargs)
+        finally:
+            _stack.pop()
+            # Imports of modules loaded already take no time, skip them
+            if len(sys.modules) != loaded:
+                cumulative = _timer() - frame[0]
+                fromlist = args[2] if len(args) > 2 else \
+                    kwargs.get('fromlist')
+                if fromlist:
+                    name = '%s (%s)' % (name, ', '.join(fromlist))
+                _records.append((len(_stack), name, cumulative - frame[1],
+                                 cumulative))
+                if _stack:
+                    _stack[-1][1] += cumulative
+    return _import
+
+
+def report(out):
+    """
+    Writes the imports timed so far to file object out.
+    """
+    out.write("import time: self [us] | cumulative | imported package\n")
+    for (depth, name, self_time, cumulative) in _records:
+        out.write("import time: %9d | %10d | %s%s\n" %
+                  (self_time * 1e6, cumulative * 1e6, '  ' * depth, name))
+    out.flush()
+
+
+def _report_at_exit(dest):
+    # Forked processes, like the children of a plug-in zygote, inherit the
+    # records, only report them once.
+    if os.getpid() != _pid:
+        return
+
+    if dest in ('1', 'stderr'):
+        report(sys.stderr)
+        return
+    try:
+        with open(dest, 'a') as out:
+            report(out)
+    except (IOError, OSError):
+        report(sys.stderr)
+
+
+def start(dest):
+    """
+    Starts timing imports and reports them at exit to dest, a file name or
+    '1' for stderr.
+    """
+    global _pid
+    if _pid is not None:
+        return
+    _pid = os.getpid()
+    builtins.__import__ = _profiled(builtins.__import__)
+    atexit.register(_report_at_exit, dest)
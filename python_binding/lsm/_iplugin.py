@@ -16,7 +16,9 @@
 
 from abc import ABCMeta as _ABCMeta
 from abc import abstractmethod as _abstractmethod
-from lsm import LsmError, ErrorNumber
+import traceback
+import types
+from lsm import LsmError, ErrorNumber, JobStatus, error, poll_with_backoff
 from six import with_metaclass
 
 
@@ -87,6 +89,44 @@ def job_free(self, job_id, flags=0):
         """
         pass
 
+    def job_wait(self, job_id, timeout_ms=None, flags=0):
+        """
+        Waits for the job to finish or timeout_ms to pass, None waits forever.
+
+        Returns the job_status() tuple of the job, the status is still
+        JobStatus.INPROGRESS on time out.  The job still needs job_free().
+        """
+        done = self.jobs_wait([job_id], timeout_ms, flags)
+        if done:
+            return tuple(done[0][1:])
+        return self.job_status(job_id, flags)
+
+    def jobs_wait(self, job_ids, timeout_ms=None, flags=0):
+        """
+        Waits for at least one of the jobs to finish or timeout_ms to pass,
+        None waits forever.
+
+        Returns a list of [job_id, status, percent, item] of the jobs which
+        are not JobStatus.INPROGRESS any more, empty on time out.
+
+        The default checks job_status() with a growing interval, plug-ins
+        should override it when the array can tell when a job finishes.
+        """
+        def check():
+            done = []
+            for job_id in job_ids:
+                (status, percent, item) = self.job_status(job_id, flags)
+                if status != JobStatus.INPROGRESS:
+                    done.append([job_id, status, percent, item])
+            return done or None
+
+        if not job_ids:
+            return []
+        timeout = None
+        if timeout_ms is not None:
+            timeout = timeout_ms / 1000.0
+        return poll_with_backoff(check, timeout) or []
+
     @_abstractmethod
     def capabilities(self, system, flags=0):
         """
@@ -125,6 +165,46 @@ def systems(self, flags=0):
         """
         pass
 
+    def batch(self, requests, flags=0):
+        """
+        Runs the requests of a batch, a list of [method, params], one after
+        the other.  Returns a list holding the outcome of each request in
+        order, {'result': value} or {'error': {'code': ..., 'message': ...,
+        'data': ...}}.  A failed request does not stop the following ones.
+
+        Plug-ins can override this to run a batch more efficiently, e.g. in a
+        single transaction, and use _batch_call() to run each request.
+        """
+        return [self._batch_call(method, params)
+                for (method, params) in requests]
+
+    def _batch_call(self, method, params):
+        """
+        Runs a single request of a batch, returns its outcome as described in
+        batch().
+        """
+        try:
+            if method in ('plugin_register', 'plugin_unregister', 'batch') \
+                    or method.startswith('_') or not hasattr(self, method):
+                raise LsmError(ErrorNumber.NO_SUPPORT,
+                               "Unsupported operation in a batch: %s" %
+                               method)
+            if params is None:
+                result = getattr(self, method)()
+            else:
+                result = getattr(self, method)(**params)
+            if isinstance(result, types.GeneratorType):
+                result = list(result)
+            return {'result': result}
+        except LsmError as lsm_err:
+            return {'error': {'code': lsm_err.code, 'message': lsm_err.msg,
+                              'data': lsm_err.data}}
+        except Exception:
+            error(traceback.format_exc())
+            return {'error': {'code': ErrorNumber.PLUGIN_BUG,
+                              'message': "Unhandled exception in plug-in",
+                              'data': traceback.format_exc()}}
+
 
 class IStorageAreaNetwork(IPlugin):
 
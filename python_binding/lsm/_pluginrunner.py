@@ -14,31 +14,241 @@
 #
 # Author: tasleson
 
+import os
 import socket
+import signal
+import random
+import struct
+import syslog
+import time
 import traceback
 import sys
+import types
+import functools
 from lsm import LsmError, error, ErrorNumber
-from lsm.lsmcli import cmd_line_wrapper
 import six
 
 from lsm._common import SocketEOF as _SocketEOF
+from lsm._common import post_msg as _post_msg
 from lsm._transport import TransPort
+from lsm import _tracing
+
+_FD = struct.Struct('i')
+
+
+def _send_fd(sock, fd):
+    """
+    Passes the file descriptor fd over the unix domain socket sock.
+    """
+    if hasattr(sock, 'sendmsg'):
+        sock.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                 _FD.pack(fd))])
+    else:
+        import _multiprocessing
+        _multiprocessing.sendfd(sock.fileno(), fd)
+
+
+def _recv_fd(sock):
+    """
+    Returns the file descriptor passed over the unix domain socket sock, or
+    None when the other end closed the socket.
+    """
+    while True:
+        if hasattr(sock, 'recvmsg'):
+            (data, ancdata, _, _) = sock.recvmsg(1, socket.CMSG_LEN(_FD.size))
+            if not data:
+                return None
+            for (level, cmsg_type, cmsg_data) in ancdata:
+                if level == socket.SOL_SOCKET and \
+                        cmsg_type == socket.SCM_RIGHTS:
+                    return _FD.unpack(cmsg_data[:_FD.size])[0]
+        else:
+            # _multiprocessing.recvfd() does not tell about end of file
+            if not sock.recv(1, socket.MSG_PEEK):
+                return None
+            import _multiprocessing
+            return _multiprocessing.recvfd(sock.fileno())
+
 
 def search_property(lsm_objs, search_key, search_value):
     """
     This method does not check whether lsm_obj contain requested property.
     The method caller should do the check.
+    If lsm_objs is a generator, a generator is returned.
     """
     if search_key is None:
         return lsm_objs
-    return list(lsm_obj for lsm_obj in lsm_objs
-                if getattr(lsm_obj, search_key) == search_value)
+    rc = (lsm_obj for lsm_obj in lsm_objs
+          if getattr(lsm_obj, search_key) == search_value)
+    if isinstance(lsm_objs, types.GeneratorType):
+        return rc
+    return list(rc)
+
+
+def search_pushdown(native_keys):
+    """
+    Decorator for the plug-in methods taking search_key and search_value,
+    like volumes().  native_keys is the list of search keys the method can
+    evaluate by itself, e.g. with a query to the array, so that a search does
+    not need to list everything.  The method only gets search keys out of
+    native_keys, for any other search key it is called with search_key None
+    and its result is filtered by search_property().
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, search_key=None, search_value=None, *args,
+                    **kwargs):
+            if search_key is None or search_key in native_keys:
+                return method(self, search_key, search_value, *args,
+                              **kwargs)
+            return search_property(
+                method(self, None, None, *args, **kwargs),
+                search_key, search_value)
+
+        wrapper.native_search_keys = native_keys
+        return wrapper
+    return decorator
+
+
+class PluginCache(object):
+    """
+    Per session cache of the raw data a plug-in fetches from the storage
+    array, for plug-ins which fetch the same data over and over within a
+    session, like capabilities() calling systems() again or volumes()
+    enumerating every system and pool:
+
+        def __init__(self):
+            self._cache = PluginCache()
+
+        def _show(self, cmds):
+            return self._cache.get(tuple(cmds), lambda: self._run(cmds))
+
+        def volume_delete(self, volume, flags=0):
+            self._cache.invalidate()
+            ...
+
+    Data is kept for max_age seconds, by default MAX_AGE or the value of the
+    LSM_PLUGIN_CACHE_MAX_AGE environment variable, 0 disables caching.  The
+    plug-in must call invalidate() whenever it changes the array, and when
+    it sees a job finish.  The data returned is shared with the cache and
+    must not be modified.  Counts of the lookups served from the cache and
+    of those which fetched are kept in hits and misses.
+    """
+    MAX_AGE = 5
+
+    # Expired entries are only dropped once there are this many entries.
+    _PURGE_SIZE = 256
+
+    def __init__(self, max_age=None):
+        if max_age is None:
+            max_age = float(os.getenv('LSM_PLUGIN_CACHE_MAX_AGE',
+                                      PluginCache.MAX_AGE))
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        # key => (expiry time, data)
+        self._entries = {}
+
+    def get(self, key, fetch):
+        """
+        Returns the data cached for the hashable key, or what fetch() returns
+        after caching it.  Nothing is cached when fetch() raises.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        data = fetch()
+        if self.max_age > 0:
+            if len(self._entries) >= PluginCache._PURGE_SIZE:
+                self._entries = dict(
+                    (k, e) for (k, e) in self._entries.items() if e[0] > now)
+            self._entries[key] = (now + self.max_age, data)
+        return data
+
+    def invalidate(self):
+        """
+        Drops all the cached data.
+        """
+        self._entries.clear()
+
+
+class _RpcStats(object):
+    """
+    Per method statistics of the requests served by a plug-in process.
+    """
+    # Fields kept per method, times are in seconds:
+    #   read_time   from the request starting to arrive until it is parsed
+    #   call_time   in the plug-in method
+    #   send_time   serializing and sending the reply, for a streamed reply
+    #               this includes the plug-in producing the items
+    #   bytes_in    request bytes, bytes_out reply bytes
+    #   objects     items in the replies, 1 for a result which is not a list
+    FIELDS = ('calls', 'errors', 'read_time', 'call_time', 'send_time',
+              'bytes_in', 'bytes_out', 'objects')
+
+    def __init__(self):
+        self.methods = {}
+
+    def record(self, method, values):
+        """
+        Adds values, a tuple with an item for each field in FIELDS, to the
+        totals of method.
+        """
+        totals = self.methods.get(method)
+        if totals is None:
+            self.methods[method] = list(values)
+        else:
+            for i, v in enumerate(values):
+                totals[i] += v
+
+    def to_dict(self):
+        """
+        Returns {method: {field: total}}
+        """
+        return dict((m, dict(zip(_RpcStats.FIELDS, totals)))
+                    for (m, totals) in self.methods.items())
+
+    def summary(self):
+        """
+        Returns a single line with the busiest methods first.
+        """
+        busiest = sorted(
+            self.methods.items(),
+            key=lambda i: i[1][2] + i[1][3] + i[1][4], reverse=True)
+        return '; '.join(
+            '%s: %d calls %d errors read %.3fs call %.3fs send %.3fs '
+            '%d/%d bytes %d objects' % ((m, ) + tuple(t))
+            for (m, t) in busiest)
+
+
+def _objects(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
 
 
 class PluginRunner(object):
     """
     Plug-in side common code which uses the passed in plugin to do meaningful
     work.
+
+    The runner keeps statistics of the requests it serves, per method, which
+    the client can get with the plugin_stats request, see lsm.Client.stats().
+    When the LSM_PLUGIN_STATS_INTERVAL environment variable is set, they are
+    logged every that many seconds too.
+
+    A request carrying a trace context, or any request when tracing is set
+    up in the plug-in process (see lsm.trace_span()), runs in a span named
+    lsm.plugin.<method>, the spans the plug-in opens for its calls to the
+    array are its children.  The spans of a traced request are sent back
+    with the reply.  For a streamed reply the span only covers the plug-in
+    method returning its generator.
     """
 
     @staticmethod
@@ -52,66 +262,182 @@ def _is_number(val):
         except ValueError:
             return False
 
+    ZYGOTE_ARG = '--zygote'
+
     def __init__(self, plugin, args):
         self.cmdline = False
+        self.plugin_class = plugin
+        self._zygote_sock = None
+        self.stats = _RpcStats()
+        self._stats_interval = float(
+            os.getenv('LSM_PLUGIN_STATS_INTERVAL', 0))
+        self._stats_logged = time.time()
+
         if len(args) == 2 and PluginRunner._is_number(args[1]):
+            self._setup(int(args[1]))
+        elif len(args) == 3 and args[1] == PluginRunner.ZYGOTE_ARG and \
+                PluginRunner._is_number(args[2]):
+            # lsmd passes us the client connections over this socket
+            self._zygote_sock = socket.fromfd(
+                int(args[2]), socket.AF_UNIX, socket.SOCK_STREAM)
+            os.close(int(args[2]))
+        else:
+            # Plug-ins started by lsmd don't need the command line code
+            from lsm.lsmcli import cmd_line_wrapper
+            self.cmdline = True
+            cmd_line_wrapper(plugin)
+
+    def _setup(self, fd):
+        """
+        Creates the transport over client connection fd and the plug-in.
+        """
+        try:
+            self.tp = TransPort(
+                socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM))
+
+            # At this point we can return errors to the client, so we can
+            # inform the client if the plug-in fails to create itself
             try:
-                fd = int(args[1])
-                self.tp = TransPort(
-                    socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM))
+                self.plugin = self.plugin_class()
+            except Exception as e:
+                ec_info = sys.exc_info()
 
-                # At this point we can return errors to the client, so we can
-                # inform the client if the plug-in fails to create itself
-                try:
-                    self.plugin = plugin()
-                except Exception as e:
-                    ec_info = sys.exc_info()
+                self.tp.send_error(0, -32099,
+                                   'Error instantiating plug-in ' + str(e))
+                raise six.reraise(*ec_info)
 
-                    self.tp.send_error(0, -32099,
-                                       'Error instantiating plug-in ' + str(e))
-                    raise six.reraise(*ec_info)
+        except Exception:
+            error(traceback.format_exc())
+            error('Plug-in exiting.')
+            sys.exit(2)
 
-            except Exception:
+    def _zygote(self):
+        """
+        Zygote mode: lsm and the plug-in module are loaded already, fork a
+        child for each client connection passed by lsmd instead of having lsmd
+        exec the plug-in for each.  Returns in the forked children only, the
+        zygote exits when lsmd closes the socket.
+        """
+        # Let the kernel reap the children
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+        while True:
+            fd = _recv_fd(self._zygote_sock)
+            if fd is None:
+                sys.exit(0)
+
+            try:
+                pid = os.fork()
+            except OSError:
                 error(traceback.format_exc())
-                error('Plug-in exiting.')
-                sys.exit(2)
+                os.close(fd)
+                continue
 
-        else:
-            self.cmdline = True
-            cmd_line_wrapper(plugin)
+            if pid == 0:
+                self._zygote_sock.close()
+                self._zygote_sock = None
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                # Don't let all the children share the zygote random state
+                random.seed()
+                self._setup(fd)
+                return
+            os.close(fd)
+
+    def _record(self, method, read_end, call_end, sent, objects, failed):
+        """
+        Adds a request which was read by read_end to the statistics.
+        """
+        end = time.time()
+        if call_end is None:
+            call_end = end
+        self.stats.record(method, (
+            1, int(failed), read_end - self.tp.recv_start,
+            call_end - read_end, end - call_end, self.tp.recv_len,
+            self.tp.bytes_sent - sent, objects))
+
+        if self._stats_interval and \
+                end - self._stats_logged >= self._stats_interval:
+            self._stats_logged = end
+            _post_msg(syslog.LOG_INFO, os.path.basename(sys.argv[0]),
+                      'plug-in stats: ' + self.stats.summary())
+
+    def _call(self, method, params):
+        """
+        Runs the plug-in method for a request, returns its result.
+        """
+        # Check to see if this plug-in implements this operation
+        # if not return the expected error.
+        if method == 'plugin_stats':
+            return self.stats.to_dict()
+        if not hasattr(self.plugin, method):
+            raise LsmError(ErrorNumber.NO_SUPPORT, "Unsupported operation")
+        if params is None:
+            return getattr(self.plugin, method)()
+        return getattr(self.plugin, method)(**params)
 
     def run(self):
         # Don't need to invoke this when running stand alone as a cmdline
         if self.cmdline:
             return
 
+        if self._zygote_sock is not None:
+            self._zygote()
+
         need_shutdown = False
-        msg_id = 0
 
         try:
             while True:
+                # Stays None when the request could not be parsed.
+                msg_id = None
+                method = None
+                objects = 0
+                failed = True
+                read_end = call_end = None
+                spans = None
+                sent = self.tp.bytes_sent
                 try:
-                    # result = None
-
                     msg = self.tp.read_req()
+                    read_end = time.time()
 
                     method = msg['method']
                     msg_id = msg['id']
                     params = msg['params']
 
-                    # Check to see if this plug-in implements this operation
-                    # if not return the expected error.
-                    if hasattr(self.plugin, method):
-                        if params is None:
-                            result = getattr(self.plugin, method)()
+                    trace = msg.get('trace')
+                    try:
+                        if trace is None and not _tracing.enabled():
+                            result = self._call(method, params)
                         else:
-                            result = getattr(self.plugin, method)(
-                                **msg['params'])
-                    else:
-                        raise LsmError(ErrorNumber.NO_SUPPORT,
-                                       "Unsupported operation")
+                            with _tracing.collect() as collected:
+                                with _tracing.span(
+                                        'lsm.plugin.' + method, trace,
+                                        {'id': msg_id}):
+                                    # Only the client which asked gets them
+                                    if trace is not None:
+                                        spans = collected
+                                    result = self._call(method, params)
+                    finally:
+                        call_end = time.time()
 
-                    self.tp.send_resp(result)
+                    if isinstance(result, types.GeneratorType):
+                        if TransPort.FEATURE_STREAM in self.tp.features:
+                            objects = self.tp.send_resp_stream(
+                                result, msg_id, spans)
+                            failed = False
+                            continue
+                        result = list(result)
+
+                    if 'features' in msg:
+                        # Client told us what optional protocol features it
+                        # can handle, reply with the ones we agree to use.
+                        features = [f for f in msg['features']
+                                    if f in TransPort.SUPPORTED_FEATURES]
+                        self.tp.send_resp(result, msg_id, features)
+                        self.tp.features = features
+                    else:
+                        self.tp.send_resp(result, msg_id, spans=spans)
+                    objects = _objects(result)
+                    failed = False
 
                     if method == 'plugin_register':
                         need_shutdown = True
@@ -124,13 +450,17 @@ def run(self):
 
                 except ValueError as ve:
                     error(traceback.format_exc())
-                    self.tp.send_error(msg_id, -32700, str(ve))
+                    self.tp.send_error(msg_id, -32700, str(ve), spans=spans)
                 except AttributeError as ae:
                     error(traceback.format_exc())
-                    self.tp.send_error(msg_id, -32601, str(ae))
+                    self.tp.send_error(msg_id, -32601, str(ae), spans=spans)
                 except LsmError as lsm_err:
                     self.tp.send_error(msg_id, lsm_err.code, lsm_err.msg,
-                                       lsm_err.data)
+                                       lsm_err.data, spans)
+                finally:
+                    if method is not None:
+                        self._record(method, read_end, call_end, sent,
+                                     objects, failed)
         except _SocketEOF:
             # Client went away and didn't meet our expectations for protocol,
             # this error message should not be seen as it shouldn't be
@@ -0,0 +1,222 @@
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Optional tracing of where the time of a request goes, from the client through
+the plug-in down to the calls the plug-in makes to the storage array.
+
+Tracing is off until a sink is set, with trace_sink_set() or the
+LSM_TRACE_FILE environment variable naming a file.  Every finished span is
+then handed to the sink as a dictionary:
+
+    {"trace_id": "<32 hex digits>", "span_id": "<16 hex digits>",
+     "parent_id": "<16 hex digits>" or null, "name": "lsm.plugin.volumes",
+     "start": <seconds since the epoch>, "duration": <seconds>,
+     "pid": <process id>, "attributes": {...}, "error": "<exception>"}
+
+with "error" only present when the span ended with an exception.  A file
+sink gets a JSON line per span.
+
+The client sends the trace context of the current span along with its
+requests when the plug-in agreed to the 'trace' protocol feature, the
+plug-in then runs the request in a child span and sends the spans it
+finished back with the reply, so the client sink sees the whole trace.
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import contextlib
+
+_sinks = []
+_local = threading.local()
+
+
+class _FileSink(object):
+    """
+    Appends a JSON line per span to a file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span, default=str) + '\n'
+        # Reopened every time so that forked plug-ins and several processes
+        # can append to the same file.
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+def trace_sink_set(sink):
+    """
+    Sets where finished spans go: a file name to append a JSON line per span
+    to, a callable taking each span as a dictionary, or None to stop tracing.
+    """
+    if sink is None:
+        del _sinks[:]
+    elif callable(sink):
+        _sinks[:] = [sink]
+    else:
+        _sinks[:] = [_FileSink(sink)]
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def _collectors():
+    try:
+        return _local.collectors
+    except AttributeError:
+        _local.collectors = []
+        return _local.collectors
+
+
+def enabled():
+    """
+    Returns True when finished spans would go somewhere.
+    """
+    return bool(_sinks) or bool(getattr(_local, 'collectors', None))
+
+
+def emit(spans):
+    """
+    Hands finished spans, e.g. the ones sent back by a plug-in, to the sink.
+    Errors of the sink are ignored, tracing must not break the request.
+    """
+    for sink in list(_sinks):
+        for s in spans:
+            try:
+                sink(s)
+            except Exception:
+                pass
+
+
+def context():
+    """
+    Returns the trace context of the current span to send along with a
+    request, or None outside of any span.
+    """
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return None
+    return {'trace_id': stack[-1].trace_id, 'span_id': stack[-1].span_id}
+
+
+class _Span(object):
+    __slots__ = ['name', 'attributes', 'trace_id', 'span_id', 'parent_id',
+                 'start']
+
+    def __init__(self, name, attributes, parent=None):
+        self.name = name
+        self.attributes = attributes
+        if parent is None:
+            parent = context()
+        if parent is None:
+            self.trace_id = '%032x' % random.getrandbits(128)
+            self.parent_id = None
+        else:
+            self.trace_id = parent['trace_id']
+            self.parent_id = parent['span_id']
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.start = None
+
+    def __enter__(self):
+        _stack().append(self)
+        self.start = time.time()
+        return self.attributes
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.time() - self.start
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+
+        record = {'trace_id': self.trace_id, 'span_id': self.span_id,
+                  'parent_id': self.parent_id, 'name': self.name,
+                  'start': self.start, 'duration': duration,
+                  'pid': os.getpid(), 'attributes': self.attributes}
+        if exc_type is not None:
+            record['error'] = '%s: %s' % (exc_type.__name__, exc_value)
+
+        for spans in getattr(_local, 'collectors', ()):
+            spans.append(record)
+        emit([record])
+        return False
+
+
+class _NoSpan(object):
+    """
+    What trace_span() returns when tracing is off.
+    """
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, parent=None, attributes=None):
+    """
+    Like trace_span(), parent is the trace context received with a request
+    or None for a child of the current span.
+    """
+    if not _sinks and not getattr(_local, 'collectors', None):
+        return _NO_SPAN
+    return _Span(name, attributes or {}, parent)
+
+
+def trace_span(name, **attributes):
+    """
+    Returns a context manager timing the code it runs as a span named name,
+    a child of the span the thread is in, if any.  The keyword arguments
+    are recorded with it, the context manager gives the dictionary of
+    them to add more:
+
+        with lsm.trace_span('inventory', uri=uri) as attrs:
+            attrs['volumes'] = len(client.volumes())
+
+    Costs next to nothing when tracing is off.
+    """
+    return span(name, None, attributes)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Context manager giving a list which receives every span of the thread
+    finished while it runs, whether a sink is set or not.
+    """
+    spans = []
+    collectors = _collectors()
+    collectors.append(spans)
+    try:
+        yield spans
+    finally:
+        collectors.pop()
+
+
+if os.getenv('LSM_TRACE_FILE'):
+    trace_sink_set(os.getenv('LSM_TRACE_FILE'))
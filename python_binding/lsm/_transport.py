@@ -17,14 +17,20 @@
 import json
 import socket
 import string
+import struct
 import os
-import unittest
+import time
 import threading
+import collections
 
 from lsm._common import LsmError, ErrorNumber
 from lsm._common import SocketEOF as _SocketEOF
 from lsm._data import DataDecoder as _DataDecoder
 from lsm._data import DataEncoder as _DataEncoder
+from lsm._data import MsgPackCodec as _MsgPackCodec
+from lsm._data import IData as _IData
+from lsm._data import Volume as _Volume
+from lsm import _tracing
 
 class TransPort(object):
     """
@@ -36,43 +42,158 @@ class TransPort(object):
     valid json.
 
     Notes:
-    id field (json-rpc) is present but currently not being used.
-    This is available to be expanded on later.
+    Every request carries a unique, monotonically increasing id.  The caller
+    may send several requests in a row and collect the replies later, replies
+    are matched to their request by id.  Many threads can share the same
+    transport, each waiting on its own reply.
+
+    Optional protocol features are negotiated during plugin_register: the
+    client lists the features it supports in the 'features' member of the
+    request and the plug-in replies with the subset it agrees to use.  Plug-ins
+    which do not know about this (C plug-ins, older python plug-ins) will
+    always reply with id 100, in that case replies are matched in the order
+    the requests were sent, which is the order a plug-in processes them.
+
+    When both sides agree on binary framing, every message after the
+    plugin_register reply uses a 8 byte network order length instead of the
+    ASCII header.  When both sides agree on msgpack, the messages after the
+    plugin_register reply are serialized with msgpack instead of json, see
+    lsm._data.MsgPackCodec.
+
+    When both sides agree on streaming, a plug-in method may return a
+    generator, the plug-in then sends the items in a series of 'chunk'
+    messages with the id of the request, terminated by a regular reply
+    holding the remaining items (or an error).
+
+    When both sides agree on batches, the client can send a 'batch' request
+    holding a list of [method, params] pairs, the plug-in runs them one after
+    the other and replies with a list holding {'result': ...} or
+    {'error': ...} for each of them, see lsm.IPlugin.batch().
+
+    When both sides agree on tracing, a request sent while the client is in
+    a span (see lsm.trace_span()) carries its context in a 'trace' member,
+    {'trace_id': ..., 'span_id': ...}.  The plug-in runs the request in a
+    child span and returns the spans it finished in the 'spans' member of
+    the reply, which the client hands to its trace sink.
+
+    A request can ask for a raw reply, in which the lsm data objects are
+    left as the dictionaries sent on the wire.  While raw requests are
+    outstanding every message is parsed this way and the replies of the
+    other requests are turned into objects afterwards.
     """
 
     HDR_LEN = 10
 
+    # Plug-in will send back the id of the request it is replying to.
+    FEATURE_MSG_ID = 'msg_id'
+
+    # Messages are framed with a binary length instead of the ASCII one.
+    FEATURE_BINARY_HDR = 'binary_hdr'
+
+    # Messages are serialized with msgpack instead of json.
+    FEATURE_MSGPACK = 'msgpack'
+
+    # Replies of generator results can be sent in chunks.
+    FEATURE_STREAM = 'stream'
+
+    # Many requests can be sent in a single 'batch' request.
+    FEATURE_BATCH = 'batch'
+
+    # Requests carry a trace context, replies the spans of the plug-in.
+    FEATURE_TRACE = 'trace'
+
+    SUPPORTED_FEATURES = [FEATURE_MSG_ID, FEATURE_BINARY_HDR, FEATURE_STREAM,
+                          FEATURE_BATCH, FEATURE_TRACE]
+    if _MsgPackCodec.available():
+        SUPPORTED_FEATURES.append(FEATURE_MSGPACK)
+
+    _BIN_HDR = struct.Struct('!Q')
+
+    # Number of items sent in each chunk of a streamed reply.
+    STREAM_CHUNK_SIZE = 1000
+
+    # Maximum number of requests rpc_pipeline() keeps in flight.
+    PIPELINE_DEPTH = 16
+
     def _read_all(self, l):
         """
-        Reads l number of bytes before returning.  Will raise a SocketEOF
-        if socket returns zero bytes (i.e. socket no longer connected)
+        Reads l number of bytes into a single buffer before returning.  Will
+        raise a SocketEOF if socket returns zero bytes (i.e. socket no longer
+        connected)
         """
 
         if l < 1:
             raise ValueError("Trying to read less than 1 byte!")
 
-        data = bytearray()
-        while len(data) < l:
-            r = self.s.recv(l - len(data))
+        data = bytearray(l)
+        view = memoryview(data)
+        got = 0
+        while got < l:
+            r = self.s.recv_into(view[got:], l - got)
             if not r:
                 raise _SocketEOF()
-            data += r
+            got += r
+
+        return data
+
+    def _send_all(self, hdr, payload):
+        """
+        Sends header and payload without joining them together first when
+        the socket supports scatter/gather I/O.
+        """
+        if not hasattr(self.s, 'sendmsg'):
+            self.s.sendall(hdr)
+            self.s.sendall(payload)
+            return
+
+        buffers = [memoryview(hdr), memoryview(payload)]
+        while buffers:
+            sent = self.s.sendmsg(buffers)
+            while sent:
+                if sent >= len(buffers[0]):
+                    sent -= len(buffers[0])
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
 
-        return data.decode("utf-8")
+    def _serialize(self, msg):
+        """
+        Returns the message serialized with the negotiated codec.
+        """
+        if TransPort.FEATURE_MSGPACK in self.features:
+            return _MsgPackCodec.dumps(msg)
+        return json.dumps(msg, cls=_DataEncoder).encode('utf-8')
 
-    def _send_msg(self, msg):
+    def _deserialize(self, payload, raw=False):
         """
-        Sends the json formatted message by pre-appending the length
+        Returns the message parsed with the negotiated codec, lsm data objects
+        are left as dictionaries when raw is True.
+        """
+        if TransPort.FEATURE_MSGPACK in self.features:
+            return _MsgPackCodec.loads(payload, raw)
+        if raw:
+            return json.loads(payload.decode('utf-8'))
+        return json.loads(payload.decode('utf-8'), cls=_DataDecoder)
+
+    def _send_msg(self, payload):
+        """
+        Sends the serialized message by pre-appending the length
         first.
         """
 
-        if msg is None or len(msg) < 1:
+        if payload is None or len(payload) < 1:
             raise ValueError("Msg argument empty")
 
         # Note: Don't catch io exceptions at this level!
-        s = str.zfill(str(len(msg)), self.HDR_LEN) + msg
-        # common.Info("SEND: ", msg)
-        self.s.sendall(bytes(s.encode('utf-8')))
+        # common.Info("SEND: ", payload)
+        if TransPort.FEATURE_BINARY_HDR in self.features:
+            self._send_all(self._BIN_HDR.pack(len(payload)), payload)
+            self.bytes_sent += self._BIN_HDR.size + len(payload)
+        else:
+            hdr = str.zfill(str(len(payload)), self.HDR_LEN)
+            self.s.sendall(hdr.encode('utf-8') + payload)
+            self.bytes_sent += self.HDR_LEN + len(payload)
 
     def _recv_msg(self):
         """
@@ -80,8 +201,15 @@ def _recv_msg(self):
         bytes of the message.
         """
         try:
-            l = self._read_all(self.HDR_LEN)
-            msg = self._read_all(int(l))
+            if TransPort.FEATURE_BINARY_HDR in self.features:
+                l = self._BIN_HDR.unpack(
+                    bytes(self._read_all(self._BIN_HDR.size)))[0]
+                self.recv_len = self._BIN_HDR.size + l
+            else:
+                l = int(self._read_all(self.HDR_LEN))
+                self.recv_len = self.HDR_LEN + l
+            self.recv_start = time.time()
+            msg = self._read_all(l)
             # common.Info("RECV: ", msg)
         except socket.error as e:
             raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
@@ -91,6 +219,25 @@ def _recv_msg(self):
 
     def __init__(self, socket_descriptor):
         self.s = socket_descriptor
+        self.features = []
+
+        self._msg_id = 0
+        self._send_lock = threading.Lock()
+        self._recv_cond = threading.Condition()
+        self._reading = False
+        # Ids of requests sent and not yet replied, in sending order.
+        self._outstanding = collections.deque()
+        # Messages read from the socket which are not yet claimed, a deque of
+        # messages per request id.
+        self._replies = {}
+        # Ids of outstanding requests which asked for a raw reply.
+        self._raw = set()
+
+        # Instrumentation, see lsm.PluginRunner: bytes sent so far, size of
+        # the last message received and when it started to arrive.
+        self.bytes_sent = 0
+        self.recv_len = 0
+        self.recv_start = None
 
     @staticmethod
     def get_socket(path):
@@ -122,20 +269,47 @@ def close(self):
         """
         self.s.close()
 
-    def send_req(self, method, args):
+    def send_req(self, method, args, raw=False):
         """
         Sends a request given a method and arguments.
         Note: arguments must be in the form that can be automatically
         serialized to json
+
+        When raw is True the lsm data objects of the reply are left as
+        dictionaries.
+
+        Returns the id of the request which is needed to retrieve the reply.
         """
         try:
-            msg = {'method': method, 'id': 100, 'params': args}
-            data = json.dumps(msg, cls=_DataEncoder)
-            self._send_msg(data)
+            with self._send_lock:
+                self._msg_id += 1
+                msg_id = self._msg_id
+                msg = {'method': method, 'id': msg_id, 'params': args}
+                if method == 'plugin_register':
+                    msg['features'] = TransPort.SUPPORTED_FEATURES
+                elif TransPort.FEATURE_TRACE in self.features:
+                    trace = _tracing.context()
+                    if trace is not None:
+                        msg['trace'] = trace
+                data = self._serialize(msg)
+
+                with self._recv_cond:
+                    self._outstanding.append(msg_id)
+                    if raw:
+                        self._raw.add(msg_id)
+                try:
+                    self._send_msg(data)
+                except Exception:
+                    # No reply will come for it.
+                    with self._recv_cond:
+                        self._outstanding.remove(msg_id)
+                        self._raw.discard(msg_id)
+                    raise
         except socket.error as se:
             raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
                            "Error while sending a message to the plug-in",
                            str(se))
+        return msg_id
 
     def read_req(self):
         """
@@ -144,42 +318,258 @@ def read_req(self):
         data = self._recv_msg()
         if len(data):
             # common.Info(str(data))
-            return json.loads(data, cls=_DataDecoder)
+            return self._deserialize(data)
 
-    def rpc(self, method, args):
+    def rpc(self, method, args, raw=False):
         """
         Sends a request and waits for a response.
         """
-        self.send_req(method, args)
-        (reply, msg_id) = self.read_resp()
-        assert msg_id == 100
-        return reply
+        if _tracing.enabled():
+            with _tracing.span('lsm.client.' + method):
+                return self.read_resp(self.send_req(method, args, raw))[0]
+        return self.read_resp(self.send_req(method, args, raw))[0]
+
+    def rpc_iter(self, method, args):
+        """
+        Sends a request and returns a generator yielding the items of the
+        list result as they arrive from the plug-in.
+        """
+        return self.read_resp_iter(self.send_req(method, args))
+
+    def rpc_pipeline(self, requests):
+        """
+        Sends all the requests, a list of (method, args), without waiting for
+        each reply before sending the next request.  At most PIPELINE_DEPTH
+        requests are in flight, so that neither side can block forever on a
+        full socket buffer while the other side is blocked too.
+
+        Returns a list of results in the same order as the requests.  If any
+        of the requests failed, the first error is raised once all the replies
+        have been read.
+        """
+        results = self._pipeline(requests)
+        for r in results:
+            if isinstance(r, LsmError):
+                raise r
+        return results
+
+    def _pipeline(self, requests):
+        """
+        Does the work of rpc_pipeline(), the result of a failed request is its
+        LsmError.
+        """
+        in_flight = collections.deque()
+        results = []
 
-    def send_error(self, msg_id, error_code, msg, data=None):
+        requests = collections.deque(requests)
+        while requests or in_flight:
+            if requests and len(in_flight) < self.PIPELINE_DEPTH:
+                (method, args) = requests.popleft()
+                in_flight.append(self.send_req(method, args))
+                continue
+
+            try:
+                results.append(self.read_resp(in_flight.popleft())[0])
+            except LsmError as lsm_err:
+                results.append(lsm_err)
+
+        return results
+
+    def rpc_batch(self, requests, flags=0):
         """
-        Used to transmit an error.
+        Runs the requests, a list of (method, args), in a single 'batch'
+        request when the plug-in agreed to it, else with rpc_pipeline().
+
+        Returns a list holding the result of each request in order, or the
+        LsmError of the requests which failed.  A failed request does not
+        stop the following ones.
+        """
+        if TransPort.FEATURE_BATCH not in self.features:
+            return self._pipeline(requests)
+
+        results = self.rpc('batch', {
+            'requests': [[method, args] for (method, args) in requests],
+            'flags': flags})
+        return [LsmError(**r['error']) if 'error' in r else r['result']
+                for r in results]
+
+    def send_error(self, msg_id, error_code, msg, data=None, spans=None):
+        """
+        Used to transmit an error, along with the trace spans of the request
+        if any.
         """
         e = {'id': msg_id, 'error': {'code': error_code, 'message': msg,
                                      'data': data}}
-        self._send_msg(json.dumps(e, cls=_DataEncoder))
+        if spans:
+            e['spans'] = spans
+        self._send_msg(self._serialize(e))
 
-    def send_resp(self, result, msg_id=100):
+    def send_resp(self, result, msg_id=100, features=None, spans=None):
         """
-        Used to transmit a response
+        Used to transmit a response, along with the trace spans of the request
+        if any.
         """
         r = {'id': msg_id, 'result': result}
-        self._send_msg(json.dumps(r, cls=_DataEncoder))
+        if features is not None:
+            r['features'] = features
+        if spans:
+            r['spans'] = spans
+        self._send_msg(self._serialize(r))
 
-    def read_resp(self):
-        data = self._recv_msg()
-        resp = json.loads(data, cls=_DataDecoder)
+    def send_resp_stream(self, result, msg_id=100, spans=None):
+        """
+        Used to transmit the items of an iterable result in chunks, the last
+        chunk is sent as a regular response carrying the trace spans.
+        Returns the number of items sent.
+        """
+        count = 0
+        chunk = []
+        for item in result:
+            chunk.append(item)
+            if len(chunk) >= self.STREAM_CHUNK_SIZE:
+                self._send_msg(self._serialize({'id': msg_id,
+                                                'chunk': chunk}))
+                count += len(chunk)
+                chunk = []
+        self.send_resp(chunk, msg_id, spans=spans)
+        return count + len(chunk)
+
+    def _reply_id(self, resp):
+        """
+        Works out which outstanding request the reply belongs to.  Must be
+        called with self._recv_cond held.
+        """
+        if 'features' in resp:
+            self.features = [f for f in resp['features']
+                             if f in TransPort.SUPPORTED_FEATURES]
+
+        if not self._outstanding:
+            # Nothing sent via send_req(), e.g. an error sent by the plug-in
+            # before it read anything.
+            return resp.get('id')
+
+        # A chunk is not the end of the reply, the request stays outstanding.
+        is_chunk = 'chunk' in resp
+
+        if TransPort.FEATURE_MSG_ID in self.features:
+            msg_id = resp.get('id')
+            if msg_id is None and 'error' in resp:
+                # The plug-in failed to parse a request, it does not know
+                # its id.  Requests are read in order, it is the oldest.
+                return self._outstanding.popleft()
+            if msg_id not in self._outstanding:
+                raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
+                               "Plug-in replied with unexpected id %s" %
+                               str(msg_id))
+            if not is_chunk:
+                self._outstanding.remove(msg_id)
+            return msg_id
+
+        if is_chunk:
+            return self._outstanding[0]
+        return self._outstanding.popleft()
+
+    def _next_msg(self, msg_id=None):
+        """
+        Waits for the next message, a reply or a chunk of a reply, of the
+        request with id msg_id, or the oldest outstanding request if msg_id
+        is None.
+
+        Returns a tuple (message, id).
+        """
+        with self._recv_cond:
+            if msg_id is None and self._outstanding:
+                msg_id = self._outstanding[0]
+
+            while msg_id not in self._replies:
+                if self._reading:
+                    # Another thread is reading from the socket, it will
+                    # hand over our reply when it arrives.
+                    self._recv_cond.wait()
+                    continue
+
+                self._reading = True
+                raw = bool(self._raw)
+                self._recv_cond.release()
+                try:
+                    resp = self._deserialize(self._recv_msg(), raw)
+                finally:
+                    self._recv_cond.acquire()
+                    self._reading = False
+                    self._recv_cond.notify_all()
+
+                reply_id = self._reply_id(resp)
+                if raw and reply_id not in self._raw:
+                    resp = _IData._factory_all(resp)
+                if 'chunk' not in resp:
+                    self._raw.discard(reply_id)
+                if msg_id is None:
+                    msg_id = reply_id
+                self._replies.setdefault(
+                    reply_id, collections.deque()).append(resp)
+
+            msgs = self._replies[msg_id]
+            resp = msgs.popleft()
+            if not msgs:
+                del self._replies[msg_id]
+
+        if 'spans' in resp:
+            _tracing.emit(resp.pop('spans'))
+        return resp, msg_id
+
+    def read_resp(self, msg_id=None):
+        """
+        Waits for the reply of the request with id msg_id, or the oldest
+        outstanding request if msg_id is None.  The items of a streamed
+        reply are joined back into one list.
+
+        Returns a tuple (result, id), raises LsmError if the plug-in replied
+        with an error.
+        """
+        items = []
+        while True:
+            resp, msg_id = self._next_msg(msg_id)
+            if 'chunk' not in resp:
+                break
+            items.extend(resp['chunk'])
 
         if 'result' in resp:
+            if items:
+                return items + resp['result'], resp['id']
             return resp['result'], resp['id']
         else:
             e = resp['error']
             raise LsmError(**e)
 
+    def read_resp_iter(self, msg_id):
+        """
+        Generator yielding the items of the list result of the request with
+        id msg_id as they arrive.  Raises LsmError if the plug-in replied
+        with an error, which could happen after some items were yielded.
+        """
+        try:
+            while True:
+                resp, msg_id = self._next_msg(msg_id)
+                if 'chunk' in resp:
+                    for item in resp['chunk']:
+                        yield item
+                    continue
+
+                if 'result' in resp:
+                    for item in resp['result']:
+                        yield item
+                    return
+                else:
+                    e = resp['error']
+                    raise LsmError(**e)
+        except GeneratorExit:
+            # Caller stopped early, discard the rest of the reply so it does
+            # not linger in self._replies.  Nothing is left to read when it
+            # stopped in the final reply.
+            while 'chunk' in resp:
+                resp, msg_id = self._next_msg(msg_id)
+            raise
+
 
 def _server(s):
     """
@@ -197,75 +587,262 @@ def _server(s):
                     msg['id'],
                     msg['params']['errorcode'],
                     msg['params']['errormsg'])
+            elif msg['method'] == 'unparsable':
+                # As PluginRunner does when it fails to parse a request
+                srv.send_error(None, -32700, 'Unparsable request')
+            elif msg['method'] == 'trace':
+                # Reply with the trace context and a span of our own
+                srv.send_resp(msg.get('trace'), msg['id'],
+                              spans=[{'name': 'server',
+                                      'trace': msg.get('trace')}])
+            elif msg['method'] == 'stream':
+                srv.send_resp_stream(iter(msg['params']), msg['id'])
+            elif msg['method'] == 'batch':
+                srv.send_resp(
+                    [{'error': {'code': params['errorcode'],
+                                'message': params['errormsg']}}
+                     if method == 'error' else {'result': params}
+                     for (method, params) in msg['params']['requests']],
+                    msg['id'])
+            elif 'features' in msg:
+                srv.send_resp(msg['params'], msg['id'], msg['features'])
+                srv.features = msg['features']
             else:
-                srv.send_resp(msg['params'])
+                srv.send_resp(msg['params'], msg['id'])
             msg = srv.read_req()
-        srv.send_resp(msg['params'])
+        srv.send_resp(msg['params'], msg['id'])
     finally:
         s.close()
 
 
-class _TestTransport(unittest.TestCase):
-    def setUp(self):
-        (self.c, self.s) = socket.socketpair(
-            socket.AF_UNIX, socket.SOCK_STREAM)
-
-        self.client = TransPort(self.c)
-
-        self.server = threading.Thread(target=_server, args=(self.s,))
-        self.server.start()
+if __name__ == "__main__":
+    import unittest
+
+    class _TestTransport(unittest.TestCase):
+        def setUp(self):
+            (self.c, self.s) = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_STREAM)
+
+            self.client = TransPort(self.c)
+
+            self.server = threading.Thread(target=_server, args=(self.s,))
+            self.server.start()
+
+        def test_simple(self):
+            tc = ['0', ' ', '   ', '{}:""', "Some text message", 'DEADBEEF']
+
+            for t in tc:
+                sent_id = self.client.send_req('test', t)
+                reply, msg_id = self.client.read_resp()
+                self.assertTrue(msg_id == sent_id)
+                self.assertTrue(reply == t)
+
+        def test_pipeline(self):
+            tc = ['0', ' ', '   ', '{}:""', "Some text message", 'DEADBEEF']
+
+            # Send everything first, then collect the replies out of order
+            msg_ids = [self.client.send_req('test', t) for t in tc]
+            self.assertTrue(msg_ids == sorted(set(msg_ids)))
+
+            for t, sent_id in reversed(list(zip(tc, msg_ids))):
+                reply, msg_id = self.client.read_resp(sent_id)
+                self.assertTrue(msg_id == sent_id)
+                self.assertTrue(reply == t)
+
+            self.assertTrue(self.client.rpc_pipeline(
+                [('test', t) for t in tc]) == tc)
+
+        def test_binary_hdr(self):
+            self.client.rpc('plugin_register', None)
+            self.assertTrue(
+                TransPort.FEATURE_BINARY_HDR in self.client.features)
+
+            for l in (1, 10, 4096, 1024 * 1024):
+                payload = "x" * l
+                self.assertTrue(self.client.rpc('test', payload) == payload)
+
+        def test_stream(self):
+            self.client.rpc('plugin_register', None)
+            self.assertTrue(TransPort.FEATURE_STREAM in self.client.features)
+
+            for l in (0, 1, TransPort.STREAM_CHUNK_SIZE,
+                      TransPort.STREAM_CHUNK_SIZE * 3 + 7):
+                payload = list(range(l))
+                self.assertTrue(self.client.rpc('stream', payload) == payload)
+                self.assertTrue(
+                    list(self.client.rpc_iter('stream', payload)) == payload)
+
+            # Stop early, the rest of the reply must be discarded
+            items = self.client.rpc_iter('stream', list(range(5000)))
+            self.assertTrue(next(items) == 0)
+            items.close()
+            self.assertTrue(self.client.rpc('test', 'after') == 'after')
+            self.assertTrue(len(self.client._replies) == 0)
+
+        def test_stream_stop_last(self):
+            chunk = TransPort.STREAM_CHUNK_SIZE
+            for register in (False, True):
+                if register:
+                    self.client.rpc('plugin_register', None)
+
+                # Stop in the final reply, a plain one or the last chunk
+                for (payload, skip) in (([1, 2, 3], 1),
+                                        (list(range(chunk * 2 + 500)),
+                                         chunk * 2 + 100)):
+                    items = self.client.rpc_iter('stream', payload)
+                    for _ in range(skip):
+                        next(items)
+                    items.close()
+                    self.assertTrue(
+                        self.client.rpc('test', 'after') == 'after')
+                    self.assertTrue(len(self.client._replies) == 0)
+
+        def test_batch(self):
+            requests = [('test', 'a'),
+                        ('error', {'errorcode': 100,
+                                   'errormsg': 'Test error'}),
+                        ('test', 'b')]
+
+            def check(results):
+                self.assertTrue(results[0] == 'a' and results[2] == 'b')
+                self.assertTrue(isinstance(results[1], LsmError))
+                self.assertTrue(results[1].code == 100)
+
+            # Without the batch feature the requests are pipelined
+            check(self.client.rpc_batch(requests))
+
+            self.client.rpc('plugin_register', None)
+            self.assertTrue(TransPort.FEATURE_BATCH in self.client.features)
+            check(self.client.rpc_batch(requests))
+            self.assertTrue(self.client.rpc_batch([]) == [])
+
+        def test_trace(self):
+            self.client.rpc('plugin_register', None)
+            self.assertTrue(TransPort.FEATURE_TRACE in self.client.features)
+
+            # No sink, no context sent
+            self.assertTrue(self.client.rpc('trace', None) is None)
+
+            spans = []
+            _tracing.trace_sink_set(spans.append)
+            try:
+                with _tracing.trace_span('outer', n=1) as attrs:
+                    attrs['m'] = 2
+                    trace = self.client.rpc('trace', None)
+            finally:
+                _tracing.trace_sink_set(None)
+
+            self.assertTrue([s['name'] for s in spans] ==
+                            ['server', 'lsm.client.trace', 'outer'])
+            (server, client, outer) = spans
+            self.assertTrue(server['trace'] == trace)
+            self.assertTrue(trace['span_id'] == client['span_id'])
+            self.assertTrue(client['parent_id'] == outer['span_id'])
+            self.assertTrue(client['trace_id'] == outer['trace_id'] ==
+                            trace['trace_id'])
+            self.assertTrue(outer['parent_id'] is None)
+            self.assertTrue(outer['attributes'] == {'n': 1, 'm': 2})
+            self.assertTrue(_tracing.context() is None)
+
+        def test_raw(self):
+            vol = _Volume('VOL_1', 'vol_1', '', 512, 1024,
+                          _Volume.ADMIN_STATE_ENABLED, 'sys', 'p1')
+
+            # The plain reply arrives while the raw request is outstanding
+            raw_id = self.client.send_req('test', [vol], raw=True)
+            obj_id = self.client.send_req('test', [vol])
+
+            reply, msg_id = self.client.read_resp(obj_id)
+            self.assertTrue(isinstance(reply[0], _Volume))
+            self.assertTrue(reply[0].num_of_blocks == 1024)
+
+            reply, msg_id = self.client.read_resp(raw_id)
+            self.assertTrue(reply == [vol._to_dict()])
+            self.assertTrue(len(self.client._raw) == 0)
+
+        def test_threads(self):
+            results = {}
+
+            def caller(i):
+                results[i] = [self.client.rpc('test', '%d_%d' % (i, j))
+                              for j in range(50)]
+
+            callers = [threading.Thread(target=caller, args=(i,))
+                       for i in range(8)]
+            for t in callers:
+                t.start()
+            for t in callers:
+                t.join()
+
+            for i in range(8):
+                self.assertTrue(results[i] == ['%d_%d' % (i, j)
+                                               for j in range(50)])
+
+        def test_exceptions(self):
+
+            e_msg = 'Test error message'
+            e_code = 100
 
-    def test_simple(self):
-        tc = ['0', ' ', '   ', '{}:""', "Some text message", 'DEADBEEF']
+            self.client.send_req('error', {'errorcode': e_code,
+                                           'errormsg': e_msg})
+            self.assertRaises(LsmError, self.client.read_resp)
 
-        for t in tc:
-            self.client.send_req('test', t)
-            reply, msg_id = self.client.read_resp()
-            self.assertTrue(msg_id == 100)
-            self.assertTrue(reply == t)
+            try:
+                self.client.send_req('error', {'errorcode': e_code,
+                                               'errormsg': e_msg})
+                self.client.read_resp()
+            except LsmError as e:
+                self.assertTrue(e.code == e_code)
+                self.assertTrue(e.msg == e_msg)
 
-    def test_exceptions(self):
+        def test_parse_error(self):
+            self.client.rpc('plugin_register', None)
+            self.assertTrue(TransPort.FEATURE_MSG_ID in self.client.features)
 
-        e_msg = 'Test error message'
-        e_code = 100
+            test_id = self.client.send_req('test', 'a')
+            error_id = self.client.send_req('unparsable', None)
+            try:
+                self.client.read_resp(error_id)
+                self.assertTrue(False, "Expected a LsmError")
+            except LsmError as e:
+                self.assertTrue(e.code == -32700)
+            self.assertTrue(self.client.read_resp(test_id)[0] == 'a')
 
-        self.client.send_req('error', {'errorcode': e_code, 'errormsg': e_msg})
-        self.assertRaises(LsmError, self.client.read_resp)
+        def test_send_failure(self):
+            def broken(payload):
+                raise socket.error("Broken pipe")
 
-        try:
-            self.client.send_req('error', {'errorcode': e_code,
-                                           'errormsg': e_msg})
-            self.client.read_resp()
-        except LsmError as e:
-            self.assertTrue(e.code == e_code)
-            self.assertTrue(e.msg == e_msg)
+            self.client._send_msg = broken
+            self.assertRaises(LsmError, self.client.send_req, 'test', 'a')
+            del self.client._send_msg
+            self.assertTrue(len(self.client._outstanding) == 0)
+            self.assertTrue(self.client.rpc('test', 'b') == 'b')
 
-    def test_slow(self):
+        def test_slow(self):
 
-        # Try to test the receiver getting small chunks to read
-        # in a loop
-        for l in range(1, 4096, 10):
+            # Try to test the receiver getting small chunks to read
+            # in a loop
+            for l in range(1, 4096, 10):
 
-            payload = "x" * l
-            msg = {'method': 'drip', 'id': 100, 'params': payload}
-            data = json.dumps(msg, cls=_DataEncoder)
+                payload = "x" * l
+                msg = {'method': 'drip', 'id': 100, 'params': payload}
+                data = json.dumps(msg, cls=_DataEncoder)
 
-            wire = string.zfill(len(data), TransPort.HDR_LEN) + data
+                wire = string.zfill(len(data), TransPort.HDR_LEN) + data
 
-            self.assertTrue(len(msg) >= 1)
+                self.assertTrue(len(msg) >= 1)
 
-            for i in wire:
-                self.c.send(i)
+                for i in wire:
+                    self.c.send(i)
 
-            reply, msg_id = self.client.read_resp()
-            self.assertTrue(payload == reply)
+                reply, msg_id = self.client.read_resp()
+                self.assertTrue(payload == reply)
 
-    def tearDown(self):
-        self.client.send_req("done", None)
-        resp, msg_id = self.client.read_resp()
-        self.assertTrue(resp is None)
-        self.server.join()
+        def tearDown(self):
+            self.client.send_req("done", None)
+            resp, msg_id = self.client.read_resp()
+            self.assertTrue(resp is None)
+            self.server.join()
 
 
-if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,446 @@
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+"""
+asyncio client API, python 3.7 or later only.
+
+    import lsm.aio
+
+    async def main():
+        async with await lsm.aio.Client.connect('sim://') as c:
+            for v in await c.volumes():
+                print(v.name)
+
+lsm.aio.Client has a coroutine for every method of lsm.Client, taking the
+same arguments.  It speaks the same wire protocol as lsm.Client, so a single
+event loop can drive many plug-in sessions without a thread for each.
+"""
+
+import os
+import time
+import asyncio
+import functools
+import collections
+
+from lsm._common import LsmError, ErrorNumber, JobStatus, uri_parse
+from lsm._data import IData as _IData
+from lsm._transport import TransPort as _SyncTransPort
+from lsm import _client
+
+
+class _TransPort(_SyncTransPort):
+    """
+    asyncio version of lsm._transport.TransPort, client side only.
+
+    rpc() sends the request right away and returns a future of the result.
+    A reader task is running as long as requests are outstanding, it
+    resolves the futures as the replies arrive.
+    """
+
+    def __init__(self, reader, writer):
+        self.features = []
+        self._reader = reader
+        self._writer = writer
+        self._reader_task = None
+
+        self._msg_id = 0
+        # Ids of requests sent and not yet replied, in sending order.
+        self._outstanding = collections.deque()
+        # Ids of outstanding requests which asked for a raw reply.
+        self._raw = set()
+        # Id => (future, items received in chunks so far)
+        self._futures = {}
+
+    @staticmethod
+    async def open(path=None, sock=None):
+        """
+        Returns a transport connected to the unix domain socket path, or
+        using the already connected socket sock.
+        """
+        if sock is None:
+            if not os.path.exists(path):
+                raise LsmError(ErrorNumber.PLUGIN_NOT_EXIST,
+                               "Plug-in appears to not exist")
+            if not os.access(path, os.R_OK | os.W_OK):
+                raise LsmError(ErrorNumber.PLUGIN_SOCKET_PERMISSION,
+                               "Permissions are incorrect for IPC "
+                               "socket file")
+        try:
+            reader, writer = await asyncio.open_unix_connection(
+                path, sock=sock)
+        except OSError:
+            raise LsmError(ErrorNumber.PLUGIN_IPC_FAIL,
+                           "Unable to connect to lsmd, daemon started?")
+        return _TransPort(reader, writer)
+
+    def close(self):
+        self._writer.close()
+
+    def _frame(self, payload):
+        if _SyncTransPort.FEATURE_BINARY_HDR in self.features:
+            return _SyncTransPort._BIN_HDR.pack(len(payload)) + payload
+        return str(len(payload)).zfill(
+            _SyncTransPort.HDR_LEN).encode('utf-8') + payload
+
+    async def _read_msg(self):
+        if _SyncTransPort.FEATURE_BINARY_HDR in self.features:
+            hdr = await self._reader.readexactly(_SyncTransPort._BIN_HDR.size)
+            msg_len = _SyncTransPort._BIN_HDR.unpack(hdr)[0]
+        else:
+            hdr = await self._reader.readexactly(_SyncTransPort.HDR_LEN)
+            msg_len = int(hdr.decode('utf-8'))
+        return await self._reader.readexactly(msg_len)
+
+    def rpc(self, method, args, raw=False):
+        """
+        Sends a request and returns a future of its result, the future raises
+        LsmError if the plug-in replied with an error.
+        """
+        if self._writer.is_closing():
+            raise LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
+                           "Connection to the plug-in is closed")
+
+        self._msg_id += 1
+        msg = {'method': method, 'id': self._msg_id, 'params': args}
+        if method == 'plugin_register':
+            msg['features'] = _SyncTransPort.SUPPORTED_FEATURES
+        data = self._frame(self._serialize(msg))
+
+        future = asyncio.get_event_loop().create_future()
+        self._futures[self._msg_id] = (future, [])
+        self._outstanding.append(self._msg_id)
+        if raw:
+            self._raw.add(self._msg_id)
+        self._writer.write(data)
+
+        if self._reader_task is None:
+            self._reader_task = asyncio.ensure_future(self._read_replies())
+        return future
+
+    async def _read_replies(self):
+        try:
+            while self._outstanding:
+                raw = bool(self._raw)
+                resp = self._deserialize(await self._read_msg(), raw)
+
+                msg_id = self._reply_id(resp)
+                if raw and msg_id not in self._raw:
+                    resp = _IData._factory_all(resp)
+
+                future, items = self._futures[msg_id]
+                if 'chunk' in resp:
+                    items.extend(resp['chunk'])
+                    continue
+
+                self._raw.discard(msg_id)
+                del self._futures[msg_id]
+                if future.cancelled():
+                    continue
+                if 'result' in resp:
+                    if items:
+                        future.set_result(items + resp['result'])
+                    else:
+                        future.set_result(resp['result'])
+                else:
+                    future.set_exception(LsmError(**resp['error']))
+        except Exception as e:
+            if not isinstance(e, LsmError):
+                e = LsmError(ErrorNumber.TRANSPORT_COMMUNICATION,
+                             "Error while reading from the plug-in", str(e))
+            for future, items in self._futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            self._futures.clear()
+            self._outstanding.clear()
+            self._raw.clear()
+            self._writer.close()
+        finally:
+            self._reader_task = None
+
+
+async def _poll_with_backoff(check, timeout=None, interval=0.05,
+                             max_interval=2.0):
+    """
+    Coroutine version of lsm.poll_with_backoff(), check is a coroutine
+    function.
+    """
+    if timeout is not None:
+        end = time.time() + timeout
+
+    while True:
+        rc = await check()
+        if rc is not None:
+            return rc
+
+        if timeout is not None:
+            left = end - time.time()
+            if left <= 0:
+                return None
+            interval = min(interval, left)
+
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def _timeout(timeout_ms):
+    if timeout_ms is None:
+        return None
+    return timeout_ms / 1000.0
+
+
+def _async_method(func):
+    """
+    Turns the undecorated method func of lsm.Client into a coroutine, func
+    checks its arguments and returns the future of the rpc.
+    """
+    @functools.wraps(func)
+    async def method(self, *args, **kwargs):
+        return await func(self, *args, **kwargs)
+    return method
+
+
+class Client(object):
+    """
+    asyncio client, see the lsm.aio module documentation.  Use connect() to
+    create one.
+    """
+
+    def __init__(self, tp):
+        self._tp = tp
+
+    @classmethod
+    async def connect(cls, uri, plain_text_password=None, timeout_ms=30000,
+                      flags=0):
+        """
+        Connects to the plug-in of uri and registers, returns a Client.
+        """
+        scheme = uri_parse(uri, ['scheme'])['scheme']
+        if "+" in scheme:
+            scheme = scheme.split("+")[0]
+
+        plugin_path = os.path.join(_client.Client._plugin_uds_path(), scheme)
+        if not os.path.exists(plugin_path):
+            if _client.Client._check_daemon_exists():
+                raise LsmError(ErrorNumber.PLUGIN_NOT_EXIST,
+                               "Plug-in %s not found!" % plugin_path)
+            _client._raise_no_daemon()
+
+        return await cls._register(await _TransPort.open(plugin_path), uri,
+                                   plain_text_password, timeout_ms, flags)
+
+    @classmethod
+    async def _register(cls, tp, uri, password, timeout, flags=0):
+        try:
+            await tp.rpc('plugin_register',
+                         dict(uri=uri, password=password, timeout=timeout,
+                              flags=flags))
+        except Exception:
+            tp.close()
+            raise
+        return cls(tp)
+
+    async def close(self, flags=_client.Client.FLAG_RSVD):
+        """
+        Does an orderly plugin_unregister of the plug-in
+        """
+        try:
+            await self._tp.rpc('plugin_unregister', dict(flags=flags))
+        finally:
+            self._tp.close()
+
+    async def plugin_unregister(self, flags=_client.Client.FLAG_RSVD):
+        """
+        Synonym for close.
+        """
+        await self.close(flags)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def job_wait(self, job_id, timeout_ms=None,
+                       flags=_client.Client.FLAG_RSVD):
+        """
+        Waits for the job to finish or timeout_ms to pass, see
+        lsm.Client.job_wait().
+        """
+        try:
+            return await self._tp.rpc('job_wait', dict(
+                job_id=job_id, timeout_ms=timeout_ms, flags=flags))
+        except LsmError as lsm_err:
+            if lsm_err.code != ErrorNumber.NO_SUPPORT:
+                raise
+
+        # Plug-in without job_wait(), check the job from here.
+        last = None
+
+        async def check():
+            nonlocal last
+            last = await self.job_status(job_id, flags)
+            if last[0] != JobStatus.INPROGRESS:
+                return last
+            return None
+
+        await _poll_with_backoff(check, _timeout(timeout_ms))
+        return last
+
+    async def jobs_wait(self, job_ids, timeout_ms=None,
+                        flags=_client.Client.FLAG_RSVD):
+        """
+        Waits for at least one of the jobs to finish or timeout_ms to pass,
+        see lsm.Client.jobs_wait().
+        """
+        try:
+            return await self._tp.rpc('jobs_wait', dict(
+                job_ids=job_ids, timeout_ms=timeout_ms, flags=flags))
+        except LsmError as lsm_err:
+            if lsm_err.code != ErrorNumber.NO_SUPPORT:
+                raise
+
+        # Plug-in without jobs_wait(), check the jobs from here.
+        async def check():
+            done = []
+            for job_id in job_ids:
+                (status, percent, item) = await self.job_status(job_id,
+                                                                flags)
+                if status != JobStatus.INPROGRESS:
+                    done.append([job_id, status, percent, item])
+            return done or None
+
+        if not job_ids:
+            return []
+        return await _poll_with_backoff(check, _timeout(timeout_ms)) or []
+
+
+# Generate the coroutines out of the lsm.Client methods, the ones streaming
+# or post-processing their results and batches are not supported.
+for _name, _func in list(vars(_client.Client).items()):
+    if _name.startswith('_') or hasattr(Client, _name) or \
+            isinstance(_func, staticmethod) or not callable(_func) or \
+            _name.endswith(('_iter', '_columns')) or \
+            _name in ('plugin_register', 'batch'):
+        continue
+    setattr(Client, _name,
+            _async_method(getattr(_func, '__wrapped__', _func)))
+
+
+if __name__ == '__main__':
+    import socket
+    import unittest
+    import threading
+
+    from lsm._data import Volume as _Volume
+    from lsm._transport import _server
+
+    class _TestAio(unittest.TestCase):
+        def setUp(self):
+            (self.c, self.s) = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server = threading.Thread(target=_server, args=(self.s,))
+            self.server.start()
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.tp = self.loop.run_until_complete(
+                _TransPort.open(sock=self.c))
+
+        def _run(self, coro):
+            return self.loop.run_until_complete(coro)
+
+        def test_rpc(self):
+            self.assertTrue(self._run(self.tp.rpc('test', 'hello')) == 'hello')
+
+            async def many():
+                return await asyncio.gather(
+                    *[self.tp.rpc('test', i) for i in range(100)])
+            self.assertTrue(self._run(many()) == list(range(100)))
+
+        def test_features(self):
+            self._run(self.tp.rpc('plugin_register', None))
+            self.assertTrue(
+                _SyncTransPort.FEATURE_BINARY_HDR in self.tp.features)
+            payload = list(range(_SyncTransPort.STREAM_CHUNK_SIZE * 2 + 1))
+            self.assertTrue(
+                self._run(self.tp.rpc('stream', payload)) == payload)
+            self.assertTrue(self._run(self.tp.rpc('test', 'x' * 70000)) ==
+                            'x' * 70000)
+
+        def test_raw(self):
+            vol = _Volume('VOL_1', 'vol_1', '', 512, 1024,
+                          _Volume.ADMIN_STATE_ENABLED, 'sys', 'p1')
+
+            async def both():
+                return await asyncio.gather(
+                    self.tp.rpc('test', [vol], raw=True),
+                    self.tp.rpc('test', [vol]))
+            raw, objs = self._run(both())
+            self.assertTrue(raw == [vol._to_dict()])
+            self.assertTrue(objs[0].num_of_blocks == 1024)
+
+        def test_error(self):
+            try:
+                self._run(self.tp.rpc('error', {'errorcode': 100,
+                                                'errormsg': 'Test error'}))
+                self.assertTrue(False)
+            except LsmError as e:
+                self.assertTrue(e.code == 100)
+                self.assertTrue(e.msg == 'Test error')
+
+        def test_client(self):
+            client = Client(self.tp)
+            self.assertTrue(asyncio.iscoroutinefunction(client.volumes))
+            # Arguments are checked like lsm.Client does
+            try:
+                self._run(client.volumes('no_such_key', 1))
+                self.assertTrue(False)
+            except LsmError as e:
+                self.assertTrue(e.code == ErrorNumber.UNSUPPORTED_SEARCH_KEY)
+
+        def test_jobs_wait_fallback(self):
+            class NoJobsWait(object):
+                # Plug-in without job_wait() and jobs_wait(), job 'b' is
+                # the only one done.
+                def __init__(self, loop):
+                    self.loop = loop
+
+                def rpc(self, method, args, raw=False):
+                    future = self.loop.create_future()
+                    if method in ('job_wait', 'jobs_wait'):
+                        future.set_exception(
+                            LsmError(ErrorNumber.NO_SUPPORT, 'No support'))
+                    elif args['job_id'] == 'b':
+                        future.set_result([JobStatus.COMPLETE, 100, None])
+                    else:
+                        future.set_result([JobStatus.INPROGRESS, 50, None])
+                    return future
+
+            client = Client(NoJobsWait(self.loop))
+            self.assertTrue(self._run(client.jobs_wait(['a', 'b'])) ==
+                            [['b', JobStatus.COMPLETE, 100, None]])
+            self.assertTrue(self._run(client.jobs_wait(['a'], 100)) == [])
+            self.assertTrue(self._run(client.job_wait('b')) ==
+                            [JobStatus.COMPLETE, 100, None])
+            self.assertTrue(self._run(client.job_wait('a', 100)) ==
+                            [JobStatus.INPROGRESS, 50, None])
+
+        def tearDown(self):
+            self.assertTrue(self._run(self.tp.rpc('done', None)) is None)
+            self.tp.close()
+            self._run(asyncio.sleep(0))
+            self.server.join()
+            self.loop.close()
+            asyncio.set_event_loop(None)
+
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+# Description:   Many threads calling the same plug-in through one shared
+#                lsm.Client and through a lsm.PooledClient.  Checks that
+#                every thread gets the right replies and reports the calls
+#                per second of both.  Needs lsmd running.
+#
+# Usage: client_threads_stress.py [--threads N] [--count N] [--uri URI]
+
+import sys
+import time
+import argparse
+import threading
+
+import lsm
+
+_METHODS = ('systems', 'pools', 'volumes', 'disks', 'access_groups')
+
+
+def _ids(client, method):
+    return [o.id for o in getattr(client, method)()]
+
+
+def stress(name, client, expected, threads, count):
+    """
+    Runs count calls in each of threads threads on client, returns the
+    number of wrong replies and errors.
+    """
+    failures = []
+
+    def worker(offset):
+        for i in range(count):
+            method = _METHODS[(offset + i) % len(_METHODS)]
+            try:
+                if _ids(client, method) != expected[method]:
+                    failures.append('%s: wrong reply' % method)
+            except Exception as e:
+                failures.append('%s: %r' % (method, e))
+
+    workers = [threading.Thread(target=worker, args=(i,))
+               for i in range(threads)]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    seconds = time.time() - start
+
+    sys.stdout.write("%-16s %4d threads %10.0f calls/s %6d failures\n" %
+                     (name, threads, threads * count / seconds,
+                      len(failures)))
+    for f in sorted(set(failures)):
+        sys.stdout.write("    %s\n" % f)
+    sys.stdout.flush()
+    return len(failures)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='libStorageMgmt client threads stress test')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Number of threads, default 8')
+    parser.add_argument('--count', type=int, default=200,
+                        help='Number of calls per thread, default 200')
+    parser.add_argument('--uri', default='sim://',
+                        help='URI of the plug-in to call, default sim://')
+    parser.add_argument('--password', default=None,
+                        help='Password of the URI')
+    args = parser.parse_args()
+
+    shared = lsm.Client(args.uri, args.password)
+    expected = dict((m, _ids(shared, m)) for m in _METHODS)
+
+    failed = stress('shared Client', shared, expected, args.threads,
+                    args.count)
+    shared.close()
+
+    pooled = lsm.PooledClient(args.uri, args.password,
+                              max_connections=args.threads)
+    failed += stress('PooledClient', pooled, expected, args.threads,
+                     args.count)
+    pooled.close()
+
+    sys.exit(1 if failed else 0)
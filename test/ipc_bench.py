@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# Copyright (C) 2016 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+# Description:   Micro benchmarks for the python IPC code paths, they do not
+#                need lsmd or a plug-in to run.
+#
+# Usage: ipc_bench.py [--count N] [benchmark ...]
+
+import sys
+import time
+import gc
+import json
+import argparse
+
+import lsm
+from lsm._data import DataEncoder, DataDecoder, MsgPackCodec
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _volumes(count):
+    return [lsm.Volume('VOL_ID_%08d' % i, 'volume_%d' % i,
+                       '600508b1001c%020x' % i, 512, 2 ** 21 + i,
+                       lsm.Volume.ADMIN_STATE_ENABLED, 'sim-01', 'POOL_ID_01')
+            for i in range(count)]
+
+
+def _timed(func, *args, **kwargs):
+    start = time.time()
+    rc = func(*args, **kwargs)
+    return time.time() - start, rc
+
+
+def _report(name, count, seconds, size=None):
+    line = "%-28s %10.3f s %12.0f obj/s" % (name, seconds, count / seconds)
+    if size is not None:
+        line += " %12d bytes" % size
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def bench_codec(count):
+    """
+    Compare json DataEncoder/DataDecoder with MsgPackCodec on a reply
+    holding a list of volumes.
+    """
+    msg = {'id': 1, 'result': _volumes(count)}
+
+    t, data = _timed(json.dumps, msg, cls=DataEncoder)
+    _report('json encode', count, t, len(data))
+    t, rc = _timed(json.loads, data, cls=DataDecoder)
+    _report('json decode', count, t)
+    assert len(rc['result']) == count
+
+    if not MsgPackCodec.available():
+        sys.stdout.write("msgpack C extension not installed, skipping "
+                         "MsgPackCodec\n")
+        return
+
+    t, data = _timed(MsgPackCodec.dumps, msg)
+    _report('msgpack encode', count, t, len(data))
+    t, rc = _timed(MsgPackCodec.loads, data)
+    _report('msgpack decode', count, t)
+    assert len(rc['result']) == count
+    assert rc['result'][-1].num_of_blocks == 2 ** 21 + count - 1
+
+
+def bench_decode(count):
+    """
+    Decode throughput of DataDecoder on a reply holding a list of volumes,
+    compared with plain json parsing of the same message.
+    """
+    data = json.dumps({'id': 1, 'result': _volumes(count)}, cls=DataEncoder)
+
+    t, rc = _timed(json.loads, data)
+    _report('json parse only', count, t)
+    t, rc = _timed(json.loads, data, cls=DataDecoder)
+    _report('DataDecoder', count, t)
+    assert isinstance(rc['result'][-1], lsm.Volume)
+    assert rc['result'][-1].num_of_blocks == 2 ** 21 + count - 1
+
+
+def bench_columns(count):
+    """
+    Time to get from a reply holding a list of volumes to the total size per
+    pool, with Volume objects and with a lsm.ColumnTable.
+    """
+    msg = {'id': 1, 'result': _volumes(count)}
+    data = json.dumps(msg, cls=DataEncoder)
+
+    def objects():
+        used = {}
+        for v in json.loads(data, cls=DataDecoder)['result']:
+            used[v.pool_id] = used.get(v.pool_id, 0) + v.size_bytes
+        return used
+
+    def columns(payload, loads, **kwargs):
+        t = lsm.ColumnTable(lsm.Volume, loads(payload, **kwargs)['result'])
+        used = {}
+        for pool_id, bs, nob in zip(t['pool_id'], t['block_size'],
+                                    t['num_of_blocks']):
+            used[pool_id] = used.get(pool_id, 0) + bs * nob
+        return used
+
+    t, expected = _timed(objects)
+    _report('json objects', count, t)
+    t, used = _timed(columns, data, json.loads)
+    _report('json columns', count, t)
+    assert used == expected
+
+    if MsgPackCodec.available():
+        packed = MsgPackCodec.dumps(msg)
+        t, used = _timed(columns, packed, MsgPackCodec.loads, raw=True)
+        _report('msgpack columns', count, t)
+        assert used == expected
+
+
+def bench_objects(count):
+    """
+    Memory used by a list of volumes and the cost of reading their
+    attributes.  Memory is only reported when tracemalloc is available
+    (python 3.4 or later).
+    """
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        vols = _volumes(count)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        sys.stdout.write("%-28s %10.1f MiB %12.0f bytes/obj\n" %
+                         ('memory', size / 2.0 ** 20, size / float(count)))
+    else:
+        vols = _volumes(count)
+
+    size = sys.getsizeof(vols[0])
+    if hasattr(vols[0], '__dict__'):
+        size += sys.getsizeof(vols[0].__dict__)
+    sys.stdout.write("%-28s %10d bytes excluding values\n" %
+                     ('object size', size))
+    t, total = _timed(sum, (v.num_of_blocks for v in vols))
+    _report('property access', count, t)
+    t, total = _timed(sum, (v._num_of_blocks for v in vols))
+    _report('attribute access', count, t)
+    t, dicts = _timed(lambda: [v._to_dict() for v in vols])
+    _report('_to_dict', count, t)
+
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'columns': bench_columns,
+    'decode': bench_decode,
+    'objects': bench_objects,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='libStorageMgmt python IPC micro benchmarks')
+    parser.add_argument('--count', type=int, default=100000,
+                        help='Number of objects to use, default 100000')
+    parser.add_argument('benchmark', nargs='*',
+                        help='Benchmarks to run, one or more of: %s. '
+                             'Default all' % ', '.join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark '%s'" % name)
+
+    for name in args.benchmark or sorted(BENCHMARKS.keys()):
+        sys.stdout.write("== %s (%d objects)\n" % (name, args.count))
+        BENCHMARKS[name](args.count)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Red Hat, Inc.
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; If not, see <http://www.gnu.org/licenses/>.
+
+# Description:   Plug-in startup latency, time from a client connection until
+#                the plug-in replied to plugin_register, when the plug-in is
+#                exec'ed for the connection like lsmd does by default and when
+#                it is forked by a plug-in zygote.  Does not need lsmd, the
+#                plug-in processes are started like lsmd would.
+#
+# Usage: plugin_start_bench.py [--count N] [--plugin PATH]
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import argparse
+
+from lsm._transport import TransPort
+from lsm._pluginrunner import PluginRunner, _send_fd
+
+# Same as the sim_lsmplugin script, for running from a source tree
+_SIM_PLUGIN = """
+import sys
+from lsm import PluginRunner
+from lsm.plugin.sim.simulator import SimPlugin
+PluginRunner(SimPlugin, sys.argv).run()
+"""
+
+
+def _spawn(cmd, fd):
+    """
+    Fork and exec cmd with fd as its last argument, like lsmd does.
+    """
+    pid = os.fork()
+    if pid == 0:
+        # Like lsmd, only pass fd on, python 2 does not close on exec
+        os.closerange(3, fd)
+        os.closerange(fd + 1, 1024)
+        if hasattr(os, 'set_inheritable'):
+            os.set_inheritable(fd, True)
+        try:
+            os.execv(cmd[0], cmd + [str(fd)])
+        finally:
+            os._exit(127)
+    return pid
+
+
+def _session(sock, uri):
+    """
+    Registers over connected socket sock, returns the seconds it took.
+    """
+    start = time.time()
+    tp = TransPort(sock)
+    tp.rpc('plugin_register',
+           dict(uri=uri, password=None, timeout=30000, flags=0))
+    t = time.time() - start
+    tp.rpc('plugin_unregister', dict(flags=0))
+    tp.close()
+    return t
+
+
+def _report(name, times):
+    times = sorted(times)
+    sys.stdout.write("%-20s mean %8.2f ms  median %8.2f ms  max %8.2f ms\n" %
+                     (name, sum(times) * 1000.0 / len(times),
+                      times[len(times) // 2] * 1000.0, times[-1] * 1000.0))
+    sys.stdout.flush()
+
+
+def bench_exec(cmd, uri, count):
+    times = []
+    for _ in range(count):
+        (c, s) = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        start = time.time()
+        pid = _spawn(cmd, s.fileno())
+        s.close()
+        _session(c, uri)
+        times.append(time.time() - start)
+        os.waitpid(pid, 0)
+    _report('exec', times)
+
+
+def bench_zygote(cmd, uri, count):
+    (ctl, zygote_ctl) = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    start = time.time()
+    pid = _spawn(cmd + [PluginRunner.ZYGOTE_ARG], zygote_ctl.fileno())
+    zygote_ctl.close()
+
+    # First connection includes the zygote start up
+    times = []
+    for _ in range(count + 1):
+        (c, s) = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        if times:
+            start = time.time()
+        _send_fd(ctl, s.fileno())
+        s.close()
+        _session(c, uri)
+        times.append(time.time() - start)
+
+    ctl.close()
+    os.waitpid(pid, 0)
+    _report('zygote first', times[:1])
+    _report('zygote fork', times[1:])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='libStorageMgmt plug-in startup latency benchmark')
+    parser.add_argument('--count', type=int, default=50,
+                        help='Number of connections to time, default 50')
+    parser.add_argument('--plugin',
+                        help='Path of the sim plug-in to start, default '
+                             'the simulator from the python path')
+    args = parser.parse_args()
+
+    if args.plugin:
+        plugin_cmd = [os.path.abspath(args.plugin)]
+    else:
+        plugin_cmd = [sys.executable, '-c', _SIM_PLUGIN]
+
+    state_fd, state_file = tempfile.mkstemp(suffix='.db')
+    os.close(state_fd)
+    os.unlink(state_file)
+    sim_uri = 'sim://?statefile=%s' % state_file
+    try:
+        bench_exec(plugin_cmd, sim_uri, args.count)
+        bench_zygote(plugin_cmd, sim_uri, args.count)
+    finally:
+        if os.path.exists(state_file):
+            os.unlink(state_file)
@@ -19,7 +19,6 @@
 import os
 import sys
 import getpass
-import time
 import tty
 import termios
 from argparse import ArgumentParser
@@ -201,15 +200,27 @@ def _add_common_options(arg_parser, is_child=False):
         arg_parser.set_defaults(**default_dict)
 
 
+# The lsm data classes use __slots__, volumes and disks are copied into a
+# subclass of theirs which can hold the extra sd_paths property.
+_SD_PATHS_CLASSES = {}
+
+
 def _add_sd_paths(lsm_obj):
-    lsm_obj.sd_paths = []
+    cls = type(lsm_obj)
+    if cls not in _SD_PATHS_CLASSES:
+        _SD_PATHS_CLASSES[cls] = type(cls.__name__, (cls,), {})
+    obj = _SD_PATHS_CLASSES[cls].__new__(_SD_PATHS_CLASSES[cls])
+    for key in cls.__slots__:
+        setattr(obj, key, getattr(lsm_obj, key))
+
+    obj.sd_paths = []
     try:
-        if len(lsm_obj.vpd83) > 0:
-            lsm_obj.sd_paths = LocalDisk.vpd83_search(lsm_obj.vpd83)
+        if len(obj.vpd83) > 0:
+            obj.sd_paths = LocalDisk.vpd83_search(obj.vpd83)
     except LsmError as lsm_err:
         if lsm_err.code != ErrorNumber.NO_SUPPORT:
             raise
-    return lsm_obj
+    return obj
 
 
 # This class represents a command line argument error
@@ -1450,19 +1461,14 @@ def _wait_for_it(self, msg, job, item):
                 out(job)
                 self.shutdown(ErrorNumber.JOB_STARTED)
 
-            while True:
-                (s, percent, item) = self.c.job_status(job)
+            (s, percent, item) = self.c.job_wait(job)
 
-                if s == JobStatus.INPROGRESS:
-                    # Add an option to spit out progress?
-                    # print "%s - Percent %s complete" % (job, percent)
-                    time.sleep(0.25)
-                elif s == JobStatus.COMPLETE:
-                    self.c.job_free(job)
-                    return item
-                else:
-                    # Something better to do here?
-                    raise ArgError(msg + " job error code= " + str(s))
+            if s == JobStatus.COMPLETE:
+                self.c.job_free(job)
+                return item
+            else:
+                # Something better to do here?
+                raise ArgError(msg + " job error code= " + str(s))
 
     # Retrieves the status of the specified job
     def job_status(self, args):